@@ -0,0 +1,162 @@
+"""
+Sync against async read views under ASGI: the project's ASGI app runs under uvicorn in its own process on a scratch
+SQLite file, and many concurrent slow clients (they trickle their request out and think between requests, like
+phones on a bad network) read the notification list, product list and detail, group listing and both dashboards,
+first through the sync routes, then through their async/ versions.
+
+Per route set it reports throughput and p50/p95/p99 latency, measured from the last byte of the request to the last
+byte of the response, so the trickle itself doesnt count.
+
+    python -m benchmarks.async_reads --clients 200 --seconds 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.common import PROJECT_ROOT, percentile, print_table, setup_django
+from benchmarks.load import seed, wait_for
+
+
+def read_paths(product_ids):
+    """(name, path, token kind) of the reads, the same for both route sets."""
+    return [
+        ('notifications', '/notification-set/', 'customer'),
+        ('products', '/products-set/', 'customer'),
+        ('product', lambda: f'/products-set/{random.choice(product_ids)}/', 'customer'),
+        ('groups', '/group-listing/', None),
+        ('supplier dashboard', '/supplier-dashboard-analytics/', 'supplier'),
+        ('admin dashboard', '/admin-dashboard-analytics/', 'admin'),
+    ]
+
+
+async def slow_get(port, path, token, trickle):
+    """
+    One GET over its own connection, the request line and headers sent in pieces trickle seconds apart.
+    :return: (status, milliseconds from the end of the request to the end of the response)
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        pieces = [f'GET {path} HTTP/1.1\r\n', 'Host: 127.0.0.1\r\n']
+        if token:
+            pieces.append(f'Authorization: Token {token}\r\n')
+        pieces.append('Connection: close\r\n\r\n')
+        for piece in pieces[:-1]:
+            writer.write(piece.encode())
+            await writer.drain()
+            await asyncio.sleep(trickle)
+        writer.write(pieces[-1].encode())
+        await writer.drain()
+        started = time.perf_counter()
+        response = await reader.read()
+        elapsed = (time.perf_counter() - started) * 1000
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return status, elapsed
+
+
+async def run_clients(port, prefix, reads, tokens, args):
+    results = defaultdict(list)  # read name -> [(ok, ms)]
+    deadline = time.monotonic() + args.seconds
+
+    async def client(i):
+        rng = random.Random(i)
+        while time.monotonic() < deadline:
+            name, path, kind = rng.choice(reads)
+            path = path() if callable(path) else path
+            token = rng.choice(tokens[kind]) if kind else None
+            try:
+                status, elapsed = await slow_get(port, prefix + path, token, args.trickle)
+                results[name].append((status == 200, elapsed))
+            except OSError:
+                results[name].append((False, None))
+            await asyncio.sleep(rng.uniform(0, 2 * args.think))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.clients)))
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall_seconds):
+    def stats(samples):
+        latencies = [elapsed for ok, elapsed in samples if elapsed is not None]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for ok, _ in samples if not ok),
+            'throughput': round(len(samples) / wall_seconds, 1),
+            'p50_ms': round(percentile(latencies, 50) or 0, 2),
+            'p95_ms': round(percentile(latencies, 95) or 0, 2),
+            'p99_ms': round(percentile(latencies, 99) or 0, 2),
+        }
+
+    per_read = {name: stats(samples) for name, samples in sorted(results.items())}
+    return per_read, stats([sample for samples in results.values() for sample in samples])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent slow clients.')
+    parser.add_argument('--seconds', type=float, default=20, help='How long each route set is read.')
+    parser.add_argument('--trickle', type=float, default=0.05, help='Seconds between the pieces of a request.')
+    parser.add_argument('--think', type=float, default=0.1, help='Mean seconds a client waits between requests.')
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--suppliers', type=int, default=10)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--notifications', type=int, default=100, help='Notifications of every customer.')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    customer_tokens, supplier_tokens, admin_token, product_ids = seed(args.customers, args.suppliers, args.products)
+
+    from rest_framework.authtoken.models import Token
+
+    from ems_app.models import Notification
+    users = Token.objects.filter(key__in=customer_tokens).values_list('user_id', flat=True)
+    Notification.objects.bulk_create([Notification(user_id=user_id, message=f'Update {i}') for user_id in users for i in range(args.notifications)])
+
+    from django.db import connections
+    connections.close_all()
+
+    tokens = {'customer': customer_tokens, 'supplier': supplier_tokens, 'admin': [admin_token]}
+    reads = read_paths(product_ids)
+    env = {**os.environ, 'SQLITE_PATH': str(db_path), 'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'}
+    # a saturated server makes every request a slow one, their log lines would drown the report
+    env.setdefault('METRICS_SLOW_REQUEST_SECONDS', '60')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'ecommerce_management_system.asgi:application', '--port', str(args.port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=PROJECT_ROOT, env=env,
+    )
+    try:
+        wait_for(args.port, server)
+        runs = {}
+        for label, prefix in (('sync', ''), ('async', '/async')):
+            results, wall_seconds = asyncio.run(run_clients(args.port, prefix, reads, tokens, args))
+            runs[label] = summarize(results, wall_seconds)
+    finally:
+        server.terminate()
+        server.wait()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(f'{db_path}{suffix}'):
+                os.remove(f'{db_path}{suffix}')
+
+    print(f'{args.clients} slow clients, {args.seconds:.0f}s per route set, {args.trickle * 1000:.0f}ms trickle, {args.think * 1000:.0f}ms think time')
+    headers = ['read', 'routes', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms']
+    keys = ['requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms']
+    rows = []
+    for name in [*runs['sync'][0], 'all']:
+        for label, (per_read, total) in runs.items():
+            stats = total if name == 'all' else per_read.get(name)
+            if stats:
+                rows.append([name, label, *(stats[key] for key in keys)])
+    print_table(headers, rows)
+
+
+if __name__ == '__main__':
+    main()
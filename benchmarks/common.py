@@ -0,0 +1,67 @@
+"""
+Shared setup for the benchmark scripts. Every benchmark runs against its own scratch SQLite file (never db.sqlite3)
+and is started from the project root, e.g. `python -m benchmarks.pagination`.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup_django(db_path=None):
+    """
+    Point the settings at a fresh scratch database, run django.setup() and migrate it.
+    :return: path of the scratch database
+    """
+    if db_path is None:
+        handle, db_path = tempfile.mkstemp(prefix='ems-bench-', suffix='.sqlite3')
+        os.close(handle)
+        os.remove(db_path)
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    os.environ['SQLITE_PATH'] = str(db_path)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_management_system.settings')
+
+    import django
+    django.setup()
+
+    # allows the 'testserver' host of the request factories and swaps email for the locmem backend
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def time_call(func, repeat=20):
+    """
+    Run func repeat times.
+    :return: median wall time in milliseconds
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    line = '  '.join(f'{{:>{width}}}' for width in widths)
+    print(line.format(*headers))
+    for row in rows:
+        print(line.format(*row))
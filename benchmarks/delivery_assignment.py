@@ -0,0 +1,69 @@
+"""
+manage.py assign_deliveries over tens of thousands of pending deliveries: wall time, queries and how even the
+couriers' loads come out, for a few batch sizes. Every batch size starts from the same pending deliveries.
+
+    python -m benchmarks.delivery_assignment --deliveries 50000 --couriers 200
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import print_table, setup_django
+
+
+def seed(deliveries, couriers):
+    from ems_app.models import Customer, Delivery, DeliveryPersonnel, Order, User
+
+    customer = Customer.objects.create(
+        user=User.objects.create(email='customer@example.com', username='customer', full_name='Customer', user_role='customer'),
+        phone='1', address='Kathmandu',
+    )
+    users = User.objects.bulk_create([
+        User(email=f'courier{i}@example.com', username=f'courier{i}', full_name=f'Courier {i}', user_role='delivery') for i in range(couriers)
+    ])
+    personnel = DeliveryPersonnel.objects.bulk_create([DeliveryPersonnel(user=user, phone='2', address='Bhaktapur') for user in users])
+    orders = Order.objects.bulk_create([Order(customer=customer, status='placed', payment_status='paid', total_amount=10) for _ in range(deliveries)])
+    # a few couriers start out busy, the heap has to even that out
+    Delivery.objects.bulk_create([
+        Delivery(order=order, delivery_status='assigned' if i < couriers * 5 else 'pending', delivery_personnel=personnel[i % 10] if i < couriers * 5 else None)
+        for i, order in enumerate(orders)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--deliveries', type=int, default=50000)
+    parser.add_argument('--couriers', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='250,2000,5000')
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    seed(args.deliveries, args.couriers)
+
+    from django.db import connection, transaction
+    from django.db.models import Count, Max, Min, Q
+    from django.test.utils import CaptureQueriesContext
+
+    from ems_app.delivery_assignment import assign_deliveries
+    from ems_app.models import DeliveryPersonnel
+
+    rows = []
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                totals = assign_deliveries(batch_size=batch_size)
+                elapsed = time.perf_counter() - started
+            loads = DeliveryPersonnel.objects.annotate(open=Count('delivery', filter=Q(delivery__delivery_status='assigned'))).aggregate(low=Min('open'), high=Max('open'))
+            rows.append([batch_size, totals['assigned'], f'{elapsed:.2f}', round(totals['assigned'] / elapsed), len(queries), f"{loads['low']}-{loads['high']}"])
+            transaction.set_rollback(True)  # the next batch size starts from the same pending deliveries
+
+    print(f'{args.deliveries} deliveries, {args.couriers} couriers')
+    print_table(['batch', 'assigned', 'seconds', 'per second', 'queries', 'open per courier'], rows)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(f'{db_path}{suffix}'):
+            os.remove(f'{db_path}{suffix}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+End to end load on the real url routes: many customers concurrently going through cart -> checkout -> payment
+(order-set/, order-item-set/, order-set/<pk>/checkout/, payment-set/) while admins and suppliers poll their
+dashboards. The app runs in a threaded WSGI server in its own process on a scratch SQLite file with the locmem email
+backend, the clients are threads of this process talking HTTP to it.
+
+Per endpoint it reports throughput, p50/p95/p99 latency and queries per request (counted in the server and sent back
+in a response header), and writes the whole run as JSON so runs can be compared.
+
+    python -m benchmarks.load --clients 16 --flows 20 --output before.json
+    python -m benchmarks.load --clients 16 --flows 20 --compare before.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.common import PROJECT_ROOT, percentile, print_table, setup_django
+
+QUERY_HEADER = 'X-Bench-Queries'
+
+
+def serve(db_path, port):
+    """The server process: the project's WSGI app behind a threaded server, every response says how many queries it ran."""
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    setup_django(db_path)
+
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+
+    app = get_wsgi_application()
+
+    def counted(environ, start_response):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # the response is complete when the handler returns, DRF renders before start_response is called
+        captured = {}
+        with connection.execute_wrapper(count):
+            body = app(environ, lambda status, headers, exc_info=None: captured.update(status=status, headers=headers))
+        start_response(captured['status'], captured['headers'] + [(QUERY_HEADER, str(queries))])
+        return body
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = make_server('127.0.0.1', port, counted, server_class=Server, handler_class=QuietHandler)
+    server.serve_forever()
+
+
+def seed(customers, suppliers, products):
+    """Users with tokens in the groups register() puts them in, and products with stock for every flow of the run."""
+    from decimal import Decimal
+
+    from django.contrib.auth.models import Group, Permission
+    from rest_framework.authtoken.models import Token
+
+    from benchmarks.permissions import GROUP_PERMISSIONS
+    from ems_app.models import Customer, Product, ProductCategory, Supplier, User
+    from ems_app.supplier_stats import rebuild_supplier_stats
+
+    for group_id, (name, codenames) in GROUP_PERMISSIONS.items():
+        group, _ = Group.objects.get_or_create(id=group_id, defaults={'name': name})
+        group.permissions.set(Permission.objects.filter(content_type__app_label='ems_app', codename__in=codenames))
+
+    def users(role, count):
+        return User.objects.bulk_create([
+            User(email=f'{role}{i}@example.com', username=f'{role}{i}', full_name=f'{role.title()} {i}', user_role=role) for i in range(count)
+        ])
+
+    customer_users, supplier_users = users('customer', customers), users('supplier', suppliers)
+    Group.objects.get(id=3).user_set.add(*customer_users)
+    Group.objects.get(id=2).user_set.add(*supplier_users)
+    Customer.objects.bulk_create([Customer(user=user, phone='9800000000', address='Kathmandu') for user in customer_users])
+    supplier_rows = Supplier.objects.bulk_create([Supplier(user=user, phone='9800000001', address='Lalitpur') for user in supplier_users])
+    admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+
+    category = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+    product_rows = Product.objects.bulk_create([
+        Product(
+            supplier=supplier_rows[i % suppliers], product_name=f'Product {i}', product_description='A product',
+            product_price=Decimal('10.00') + i % 50, stock_quantity=1_000_000, category=category,
+        )
+        for i in range(products)
+    ])
+    rebuild_supplier_stats()
+
+    # the key is made in Token.save(), which bulk_create skips
+    tokens = Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in [*customer_users, *supplier_users, admin]])
+    keys = {token.user_id: token.key for token in tokens}
+    return (
+        [keys[user.id] for user in customer_users],
+        [keys[user.id] for user in supplier_users],
+        keys[admin.id],
+        [product.id for product in product_rows],
+    )
+
+
+class Client:
+    """One keep-alive-less HTTP client (wsgiref speaks HTTP/1.0), records every request under its route."""
+
+    def __init__(self, port, token, results):
+        self.port = port
+        self.headers = {'Host': 'testserver', 'Authorization': f'Token {token}', 'Content-Type': 'application/json'}
+        self.results = results
+
+    def request(self, method, path, route, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=self.headers)
+            response = connection.getresponse()
+            content = response.read()
+            elapsed = (time.perf_counter() - started) * 1000
+            queries = int(response.getheader(QUERY_HEADER, 0))
+        finally:
+            connection.close()
+        self.results.append((f'{method} {route}', elapsed, queries, response.status < 400))
+        if response.status >= 400:
+            return None
+        return json.loads(content) if content else {}
+
+
+def customer_flow(client, product_ids, items):
+    order = client.request('POST', '/order-set/', 'order-set/', {})
+    if order is None:
+        return
+    for product_id in random.sample(product_ids, items):
+        client.request('POST', '/order-item-set/', 'order-item-set/', {'order': order['id'], 'product': product_id, 'quantity': 1})
+    if client.request('POST', f"/order-set/{order['id']}/checkout/", 'order-set/<pk>/checkout/') is None:
+        return
+    client.request('POST', '/payment-set/', 'payment-set/', {'order': order['id']})
+
+
+def wait_for(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('the server process exited before it was listening')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'nothing listening on port {port} after {timeout}s')
+
+
+def summarize(results, wall_seconds):
+    by_route = defaultdict(list)
+    for route, elapsed, queries, ok in results:
+        by_route[route].append((elapsed, queries, ok))
+
+    def stats(samples):
+        latencies = [elapsed for elapsed, _, _ in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, ok in samples if not ok),
+            'throughput': round(len(samples) / wall_seconds, 1),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(queries for _, queries, _ in samples) / len(samples), 2),
+        }
+
+    endpoints = {route: stats(samples) for route, samples in sorted(by_route.items())}
+    return endpoints, stats([sample for samples in by_route.values() for sample in samples])
+
+
+def print_report(endpoints, total, baseline=None):
+    headers = ['endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries/req']
+    keys = ['requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+
+    def row(name, stats, before):
+        values = []
+        for key in keys:
+            value = stats[key]
+            if before and key not in ('requests', 'errors') and before.get(key):
+                value = f'{value} ({(value - before[key]) / before[key] * 100:+.0f}%)'
+            values.append(value)
+        return [name, *values]
+
+    baseline = baseline or {}
+    rows = [row(name, stats, baseline.get('endpoints', {}).get(name)) for name, stats in endpoints.items()]
+    rows.append(row('all', total, baseline.get('total')))
+    print_table(headers, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent customers going through the flow.')
+    parser.add_argument('--flows', type=int, default=20, help='Cart -> checkout -> payment rounds per customer.')
+    parser.add_argument('--items', type=int, default=3, help='Lines put on every cart.')
+    parser.add_argument('--dashboard-clients', type=int, default=2, help='Admins and suppliers polling their dashboards meanwhile.')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--suppliers', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the product picks.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON file of an earlier run, every number is shown with its change against it.')
+    parser.add_argument('--serve', metavar='DB', help=argparse.SUPPRESS)  # the server process
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    random.seed(args.seed)
+    db_path = setup_django()
+    customer_tokens, supplier_tokens, admin_token, product_ids = seed(args.clients, args.suppliers, args.products)
+
+    from django.db import connections
+    connections.close_all()
+
+    env = {**os.environ, 'SQLITE_PATH': str(db_path), 'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'}
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.load', '--serve', str(db_path), '--port', str(args.port)], cwd=PROJECT_ROOT, env=env)
+    try:
+        wait_for(args.port, server)
+        results = []  # list.append is atomic, every client thread appends to it
+        done = threading.Event()
+
+        def customer(token):
+            client = Client(args.port, token, results)
+            for _ in range(args.flows):
+                customer_flow(client, product_ids, args.items)
+
+        def dashboards(i):
+            # every other one is an admin, the rest are suppliers
+            if i % 2 == 0:
+                client, path = Client(args.port, admin_token, results), 'admin-dashboard-analytics/'
+            else:
+                client, path = Client(args.port, supplier_tokens[i % len(supplier_tokens)], results), 'supplier-dashboard-analytics/'
+            while not done.is_set():
+                client.request('GET', f'/{path}', path)
+
+        customers = [threading.Thread(target=customer, args=(token,)) for token in customer_tokens]
+        pollers = [threading.Thread(target=dashboards, args=(i,)) for i in range(args.dashboard_clients)]
+        started = time.perf_counter()
+        for thread in customers + pollers:
+            thread.start()
+        for thread in customers:
+            thread.join()
+        done.set()
+        for thread in pollers:
+            thread.join()
+        wall_seconds = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(f'{db_path}{suffix}'):
+                os.remove(f'{db_path}{suffix}')
+
+    endpoints, total = summarize(results, wall_seconds)
+    print(f'{args.clients} customers x {args.flows} flows of {args.items} items, {args.dashboard_clients} dashboard clients, {wall_seconds:.1f}s')
+    baseline = None
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+    print_report(endpoints, total, baseline)
+
+    if args.output:
+        run = {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'arguments': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'serve')},
+            'wall_seconds': round(wall_seconds, 2),
+            'endpoints': endpoints,
+            'total': total,
+        }
+        with open(args.output, 'w') as target:
+            json.dump(run, target, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
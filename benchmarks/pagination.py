@@ -0,0 +1,61 @@
+"""
+Deep paging on notification-set/: LimitOffsetPagination against the keyset cursors.
+
+    python -m benchmarks.pagination --rows 200000
+"""
+import argparse
+
+from benchmarks.common import print_table, setup_django, time_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--page-size', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from ems_app.models import Notification, User
+    from ems_app.pagination import KeysetPagination
+    from ems_app.views import NotificationViewSet
+
+    user = User.objects.create(email='bench@example.com', username='bench', full_name='Bench', user_role='customer')
+    for start in range(0, args.rows, 10_000):
+        Notification.objects.bulk_create(
+            [Notification(user=user, message=f'message {i}') for i in range(start, min(start + 10_000, args.rows))]
+        )
+
+    view = NotificationViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+    newest_first = Notification.objects.filter(user=user).order_by('-created_at', '-id')
+
+    def get(params):
+        request = factory.get('/notification-set/', params)
+        force_authenticate(request, user=user)
+        response = view(request)
+        assert response.status_code == 200, response.data
+        return response
+
+    rows = []
+    for depth in (0, args.rows // 100, args.rows // 10, args.rows // 2, args.rows - args.page_size):
+        offset_ms = time_call(lambda: get({'limit': args.page_size, 'offset': depth}))
+
+        if depth:
+            # cursor pointing at the row just before this depth, exactly what the previous page's next link holds
+            anchor = newest_first[depth - 1]
+            params = {'cursor': KeysetPagination.make_cursor(KeysetPagination.position(anchor)), 'page_size': args.page_size}
+        else:
+            params = {'page_size': args.page_size}
+        keyset_ms = time_call(lambda: get(params))
+
+        rows.append((depth, f'{offset_ms:.2f}', f'{keyset_ms:.2f}'))
+
+    print(f'{args.rows} notifications, page size {args.page_size}, median of 20 requests (ms)')
+    print_table(['depth', 'limit/offset', 'keyset'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+The DjangoModelPermissions check of a write request (POST /order-set/ as a customer), with Django's ModelBackend
+against CachedModelBackend. Every request gets a new User instance, like the token authentication gives it, so
+ModelBackend's per instance cache never helps.
+
+    python -m benchmarks.permissions
+"""
+import argparse
+
+from benchmarks.common import print_table, setup_django, time_call
+
+GROUP_PERMISSIONS = {
+    2: ('Supplier', ['add_product', 'change_product', 'delete_product', 'view_product', 'add_productcategory', 'view_productcategory', 'view_notification']),
+    3: ('Customer', ['view_product', 'add_order', 'change_order', 'view_order', 'add_orderitem', 'change_orderitem', 'delete_orderitem', 'view_orderitem', 'add_payment', 'view_notification']),
+    4: ('Delivery personnel', ['view_delivery', 'change_delivery', 'view_notification']),
+}
+
+
+def seed(users):
+    from django.contrib.auth.models import Group, Permission
+
+    from ems_app.models import User
+
+    for group_id, (name, codenames) in GROUP_PERMISSIONS.items():
+        group, _ = Group.objects.get_or_create(id=group_id, defaults={'name': name})
+        group.permissions.set(Permission.objects.filter(content_type__app_label='ems_app', codename__in=codenames))
+
+    customers = Group.objects.get(id=3)
+    created = User.objects.bulk_create([
+        User(email=f'customer{i}@example.com', username=f'customer{i}', full_name='Customer', user_role='customer') for i in range(users)
+    ])
+    customers.user_set.add(*created)
+    return [user.pk for user in created]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_django()
+    user_ids = seed(args.users)
+
+    from django.core.cache import caches
+    from django.db import connection
+    from django.test.utils import override_settings
+    from rest_framework.permissions import DjangoModelPermissions
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from ems_app.models import Order, User
+    from ems_app.permission_cache import CACHE_ALIAS
+
+    users = list(User.objects.filter(pk__in=user_ids))
+    factory = APIRequestFactory()
+    # only the queryset's model matters to DjangoModelPermissions, the viewset's get_queryset would add its own queries
+    view = type('OrderView', (), {'queryset': Order.objects.none()})()
+    permission = DjangoModelPermissions()
+
+    def check(user):
+        # the same rows as a new instance, that is what every request starts from
+        fresh = User.from_db('default', [field.attname for field in User._meta.concrete_fields], [getattr(user, field.attname) for field in User._meta.concrete_fields])
+        request = Request(factory.post('/order-set/'))
+        request.user = fresh
+        assert permission.has_permission(request, view)
+
+    def run():
+        for i in range(args.requests):
+            check(users[i % len(users)])
+
+    rows = []
+    for backend in ('django.contrib.auth.backends.ModelBackend', 'ems_app.permission_cache.CachedModelBackend'):
+        with override_settings(AUTHENTICATION_BACKENDS=[backend]):
+            caches[CACHE_ALIAS].clear()
+            run()  # warm up, fills the cache for the cached backend
+            queries = []
+            with connection.execute_wrapper(lambda execute, sql, params, many, context: queries.append(sql) or execute(sql, params, many, context)):
+                run()
+            total_ms = time_call(run, repeat=5)
+        rows.append((backend.rsplit('.', 1)[-1], f'{len(queries) / args.requests:.1f}', f'{total_ms * 1000 / args.requests:.1f}'))
+
+    print(f'{args.requests} permission checks over {args.users} customers, median of 5 runs')
+    print_table(['backend', 'queries/request', 'us/request'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+?search= on products-set/: the FTS5 index against DRF's LIKE based SearchFilter.
+
+    python -m benchmarks.product_search --rows 1000000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import print_table, setup_django, time_call
+
+WORDS = (
+    'electric kettle toaster blender mixer lamp chair desk table shirt jacket shoe sock bag wallet watch phone cable '
+    'charger headphone speaker football racket bottle notebook pencil backpack pillow blanket mirror heater fan'
+).split()
+
+
+def seed(rows):
+    from django.db import connection, transaction
+
+    from ems_app.models import ProductCategory, Supplier, User
+
+    user = User.objects.create(email='supplier@example.com', username='supplier', full_name='Supplier', user_role='supplier')
+    supplier = Supplier.objects.create(user=user, phone='1', address='Kathmandu')
+    categories = [ProductCategory.objects.create(category_name=name, category_description=name).id for name in ('household', 'electronics', 'clothing', 'sports')]
+
+    generator = random.Random(42)
+    started = time.perf_counter()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, 50_000):
+            batch = []
+            for i in range(start, min(start + 50_000, rows)):
+                name = ' '.join(generator.sample(WORDS, 2)) + f' {i}'
+                description = ' '.join(generator.choices(WORDS, k=12))
+                batch.append(('2025-01-01 00:00:00', '2025-01-01 00:00:00', supplier.id, name, description, generator.randint(1, 500), 'products/x.png', 10, generator.choice(categories), 5, '{}'))
+            # raw executemany, going through the ORM would make seeding the slow part; the fts triggers still run
+            cursor.executemany(
+                'INSERT INTO ems_app_product (created_at, updated_at, supplier_id, product_name, product_description, product_price, '
+                'product_image, stock_quantity, category_id, low_stock_threshold, image_variants) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                batch,
+            )
+    print(f'seeded {rows} products in {time.perf_counter() - started:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    setup_django()
+    seed(args.rows)
+
+    from rest_framework.filters import SearchFilter
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from ems_app.catalog_cache import bump_catalog_version
+    from ems_app.models import User
+    from ems_app.search import ProductSearchFilter
+    from ems_app.views import ProductViewSet
+
+    customer = User.objects.create(email='customer@example.com', username='customer', full_name='Customer', user_role='customer')
+    factory = APIRequestFactory()
+
+    def run(search, backend):
+        # a new catalog version per call so the catalog cache never answers for the database
+        bump_catalog_version()
+        view = ProductViewSet.as_view({'get': 'list'}, filter_backends=[backend])
+        request = factory.get('/products-set/', {'search': search, 'limit': 10})
+        force_authenticate(request, user=customer)
+        response = view(request)
+        assert response.status_code == 200, response.data
+        return response
+
+    rows = []
+    for search in ('kettle', 'kett', 'electric kettle', 'blanket 99999', 'nomatch'):
+        fts_ms = time_call(lambda: run(search, ProductSearchFilter), repeat=5)
+        like_ms = time_call(lambda: run(search, SearchFilter), repeat=5)
+        rows.append((search, f'{fts_ms:.1f}', f'{like_ms:.1f}', f'{like_ms / fts_ms:.1f}x'))
+
+    print(f'{args.rows} products, first page of 10 incl. COUNT, median of 5 requests (ms)')
+    print_table(['search', 'fts5', 'LIKE', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
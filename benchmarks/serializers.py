@@ -0,0 +1,86 @@
+"""
+Rendering 1k rows of each list endpoint's serializer: ModelSerializer over model instances against the precompiled
+values() renderer of FastReadMixin. "fetch+render" includes the query, "render" starts from rows already in memory.
+
+    python -m benchmarks.serializers
+"""
+import argparse
+from decimal import Decimal
+
+from benchmarks.common import print_table, setup_django, time_call
+
+
+def seed(rows):
+    from ems_app.models import Customer, Notification, Order, Payment, Product, ProductCategory, Supplier, User
+
+    supplier = Supplier.objects.create(
+        user=User.objects.create(email='supplier@example.com', username='supplier', full_name='Supplier', user_role='supplier'),
+        phone='1', address='Lalitpur',
+    )
+    customer = Customer.objects.create(
+        user=User.objects.create(email='customer@example.com', username='customer', full_name='Customer', user_role='customer'),
+        phone='2', address='Kathmandu',
+    )
+    category = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+
+    Product.objects.bulk_create([
+        Product(supplier=supplier, category=category, product_name=f'Product {i}', product_description='A product',
+                product_price=Decimal('12.50'), product_image=f'products/{i}.png', stock_quantity=i)
+        for i in range(rows)
+    ])
+    orders = Order.objects.bulk_create([
+        Order(customer=customer, status='ordered', payment_status='paid', total_amount=Decimal('12.50')) for _ in range(rows)
+    ])
+    Payment.objects.bulk_create([
+        Payment(order=order, customer=customer, amount=order.total_amount, status='completed', transaction_id=f'txn-{order.id}') for order in orders
+    ])
+    Notification.objects.bulk_create([Notification(user=customer.user, message=f'message {i}') for i in range(rows)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+    seed(args.rows)
+
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from ems_app.fast_serializers import renderer_for
+    from ems_app.models import Notification, Order, Payment, Product
+    from ems_app.serializers import NotificationSerializer, OrderSerializer, PaymentSerializer, ProductSerializer
+
+    request = Request(APIRequestFactory().get('/'))
+    rows = []
+    for model, serializer_class in ((Product, ProductSerializer), (Order, OrderSerializer), (Payment, PaymentSerializer), (Notification, NotificationSerializer)):
+        renderer = renderer_for(serializer_class)
+        queryset = model.objects.order_by('-created_at')
+
+        def regular():
+            return serializer_class(list(queryset), many=True, context={'request': request}).data
+
+        def fast():
+            return renderer.render(renderer.values(queryset), request)
+
+        assert [dict(item) for item in regular()] == fast()
+
+        instances = list(queryset)
+        values = list(renderer.values(queryset))
+        regular_ms = time_call(regular, repeat=10)
+        fast_ms = time_call(fast, repeat=10)
+        regular_render_ms = time_call(lambda: serializer_class(instances, many=True, context={'request': request}).data, repeat=10)
+        fast_render_ms = time_call(lambda: renderer.render(values, request), repeat=10)
+        rows.append((
+            serializer_class.__name__,
+            f'{regular_ms:.1f}', f'{fast_ms:.1f}', f'{regular_ms / fast_ms:.1f}x',
+            f'{regular_render_ms:.1f}', f'{fast_render_ms:.1f}', f'{regular_render_ms / fast_render_ms:.1f}x',
+        ))
+
+    print(f'{args.rows} objects per serializer, median of 10 runs (ms)')
+    print_table(['serializer', 'fetch+render', 'fast', 'speedup', 'render', 'fast', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,7 +46,7 @@ INSTALLED_APPS = [
 ]
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',    
+        'ems_app.authentication.CachedTokenAuthentication',  # TokenAuthentication with a per process token -> user cache
     ],
     'DEFAULT_PERMISSION_CLASSES':['rest_framework.permissions.IsAuthenticated'],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend','rest_framework.filters.SearchFilter'],
@@ -55,6 +56,7 @@ REST_FRAMEWORK = {
     
 }
 MIDDLEWARE = [
+    'ems_app.metrics.MetricsMiddleware',  # first, so its latency covers the whole stack (served on /metrics)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,10 +93,43 @@ WSGI_APPLICATION = 'ecommerce_management_system.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': config('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),  # benchmarks point this at a scratch file
+        'OPTIONS': {
+            # WAL lets readers run while a checkout is writing, IMMEDIATE takes the write lock at BEGIN so concurrent
+            # payments queue up on the timeout instead of failing with "database is locked" when they upgrade to a writer
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # file based so the concurrency tests run against a real WAL database
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # product catalog pages (see ems_app/catalog_cache.py). locmem is per process, point this at a shared backend
+    # such as django.core.cache.backends.redis.RedisCache when running more than one worker
+    'catalog': {
+        'BACKEND': config('CATALOG_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CATALOG_CACHE_LOCATION', default='catalog'),
+        'TIMEOUT': config('CATALOG_CACHE_TIMEOUT', default=300, cast=int),
+    },
+    # group and user permissions (see ems_app/permission_cache.py), shared by every worker on a shared backend
+    'permissions': {
+        'BACKEND': config('PERMISSION_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('PERMISSION_CACHE_LOCATION', default='permissions'),
+        'TIMEOUT': config('PERMISSION_CACHE_TIMEOUT', default=3600, cast=int),
+    },
+}
+
+# permission checks go through the permissions cache, login still authenticates exactly like ModelBackend
+AUTHENTICATION_BACKENDS = ['ems_app.permission_cache.CachedModelBackend']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -114,13 +149,40 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
-from decouple import config
-
 EMAIL_HOST = config('EMAIL_HOST')
 EMAIL_PORT = config('EMAIL_PORT', cast=int)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool)
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+
+# outbox worker (manage.py send_queued_emails)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = config('EMAIL_OUTBOX_RETRY_BASE_SECONDS', default=60, cast=int)
+
+# check-stock/ does not alert about the same product again within this window
+LOW_STOCK_REALERT_HOURS = config('LOW_STOCK_REALERT_HOURS', default=24, cast=int)
+
+# seconds a checkout holds its stock for the payment (StockReservation), manage.py release_stock_reservations sweeps
+# the expired ones
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=900, cast=int)
+
+# manage.py assign_deliveries: pending deliveries assigned per UPDATE, and the most open deliveries a courier is given
+DELIVERY_ASSIGN_BATCH_SIZE = config('DELIVERY_ASSIGN_BATCH_SIZE', default=2000, cast=int)
+DELIVERY_MAX_OPEN_PER_COURIER = config('DELIVERY_MAX_OPEN_PER_COURIER', default=None, cast=lambda value: int(value) if value else None)
+
+# users a notification broadcast (ems_app/notifications.py) writes per transaction
+NOTIFICATION_BROADCAST_BATCH_SIZE = config('NOTIFICATION_BROADCAST_BATCH_SIZE', default=500, cast=int)
+
+# CachedTokenAuthentication: seconds a cached token -> user entry is trusted, and how many tokens a process keeps
+TOKEN_CACHE_TTL = config('TOKEN_CACHE_TTL', default=60, cast=int)
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+
+# MetricsMiddleware (ems_app/metrics.py): per route latency and SQL on /metrics, requests this slow are logged with
+# their slowest queries
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_SLOW_REQUEST_SECONDS = config('METRICS_SLOW_REQUEST_SECONDS', default=1.0, cast=float)
+METRICS_SLOW_REQUEST_TOP_QUERIES = config('METRICS_SLOW_REQUEST_TOP_QUERIES', default=5, cast=int)
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -4,13 +4,17 @@ from .models import *
 # Register your models here.
 
 admin.site.register(User)
-admin.site.register(Supplier)
-admin.site.register(Customer)
-admin.site.register(DeliveryPersonnel)
+# their __str__ shows the user's name, joined in so the list pages dont query it row by row
+class ProfileAdmin(admin.ModelAdmin):
+    list_select_related = ['user']
+admin.site.register(Supplier, ProfileAdmin)
+admin.site.register(Customer, ProfileAdmin)
+admin.site.register(DeliveryPersonnel, ProfileAdmin)
 admin.site.register(Product)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'customer', 'status', 'created_at']  # attributes to show in the list view
     list_filter = ['status']  
+    list_select_related = ['customer__user']
 admin.site.register(Order, OrderAdmin)
 # admin.site.register(OrderItem)
 admin.site.register(Payment)
@@ -0,0 +1,152 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySalesRollup, DailySupplierSales, Order, OrderItem, Payment, Supplier
+
+TOP_SUPPLIERS_LIMIT = 5
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _created_between(start, end, field='created_at'):
+    # open ended on either side so the same helper serves a single day and the live tail after the last rollup
+    lookup = Q()
+    if start is not None:
+        lookup &= Q(**{f'{field}__gte': start})
+    if end is not None:
+        lookup &= Q(**{f'{field}__lt': end})
+    return lookup
+
+
+def _totals_between(start, end):
+    revenue = Payment.objects.filter(_created_between(start, end), status='completed').aggregate(
+        revenue=Sum('amount', default=0),
+    )['revenue']
+
+    order_counts = Order.objects.filter(_created_between(start, end)).aggregate(
+        total_orders=Count('id'),
+        pending_orders=Count('id', filter=Q(status='checkout_pending')),
+        delivered_orders=Count('id', filter=Q(status='delivered')),
+        cancelled_orders=Count('id', filter=Q(status='cancelled')),
+    )
+    return {'revenue': revenue, **order_counts}
+
+
+def _supplier_sales_between(start, end):
+    rows = (
+        OrderItem.objects
+        .filter(_created_between(start, end, field='order__created_at'), order__payment_status='paid', product__supplier__isnull=False)
+        .values('product__supplier')
+        .annotate(total_sales=Sum('line_total'))
+    )
+    return {row['product__supplier']: row['total_sales'] for row in rows}
+
+
+def roll_up_day(day, computed_at):
+    """
+    Recompute the rollup rows of a single day from the source tables.
+    :param day: date to recompute
+    :param computed_at: start time of the current run, stored as the watermark
+    """
+    start = _day_start(day)
+    end = start + timedelta(days=1)
+    totals = _totals_between(start, end)
+    supplier_sales = _supplier_sales_between(start, end)
+
+    with transaction.atomic():
+        DailySalesRollup.objects.update_or_create(day=day, defaults={**totals, 'computed_at': computed_at})
+        DailySupplierSales.objects.filter(day=day).delete()
+        DailySupplierSales.objects.bulk_create([
+            DailySupplierSales(day=day, supplier_id=supplier_id, total_sales=total)
+            for supplier_id, total in supplier_sales.items()
+        ])
+
+
+def _days_touched_since(since, before_day):
+    # any order or payment written after the last run may have changed the totals of the day it was created on
+    days = set()
+    for model in (Order, Payment):
+        touched = model.objects.filter(updated_at__gte=since) if since else model.objects.all()
+        days.update(touched.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct())
+    return sorted(day for day in days if day < before_day)
+
+
+def _days_closed_since(last_day, today):
+    # every day that closed after the last materialized one, the run that rolled last_day ran on the day after it and
+    # what was created later that day is only seen by rolling it now. Without any rollup yet only yesterday is added,
+    # it marks the days up to it as done
+    first = last_day + timedelta(days=1) if last_day else today - timedelta(days=1)
+    return [first + timedelta(days=offset) for offset in range((today - first).days)]
+
+
+def refresh_daily_rollups(full=False):
+    """
+    Fill the daily rollup tables. Only closed days (before today) are materialized, today is always read live.
+    Every run rolls up to yesterday, so the last rolled up day is where the previous run stopped: the days closed since
+    then are rolled, and so is any older day with an order or payment written since the previous run.
+    :param full: rebuild every day from scratch instead of the days closed or touched since the last run
+    :return: number of days recomputed
+    """
+    started = timezone.now()
+    today = timezone.localdate(started)
+
+    if full:
+        with transaction.atomic():
+            DailySupplierSales.objects.all().delete()
+            DailySalesRollup.objects.all().delete()
+        last = {'last_run': None, 'last_day': None}
+    else:
+        last = DailySalesRollup.objects.aggregate(last_run=Max('computed_at'), last_day=Max('day'))
+
+    days = sorted(set(_days_touched_since(last['last_run'], today)) | set(_days_closed_since(last['last_day'], today)))
+    for day in days:
+        roll_up_day(day, computed_at=started)
+    return len(days)
+
+
+def admin_dashboard_summary():
+    """
+    Dashboard totals read from the daily rollups plus a live aggregate over whatever was created after the last
+    rolled up day. Changes to already rolled up days show up after the next `rollup_daily_sales` run.
+    """
+    rolled = DailySalesRollup.objects.aggregate(
+        revenue=Sum('revenue', default=0),
+        total_orders=Sum('total_orders', default=0),
+        pending_orders=Sum('pending_orders', default=0),
+        delivered_orders=Sum('delivered_orders', default=0),
+        cancelled_orders=Sum('cancelled_orders', default=0),
+        last_day=Max('day'),
+    )
+    last_day = rolled.pop('last_day')
+    live_start = _day_start(last_day + timedelta(days=1)) if last_day else None
+
+    live = _totals_between(live_start, None)
+    totals = {key: rolled[key] + live[key] for key in live}
+
+    supplier_sales = {
+        row['supplier']: row['total_sales']
+        for row in DailySupplierSales.objects.values('supplier').annotate(total_sales=Sum('total_sales'))
+    }
+    for supplier_id, total in _supplier_sales_between(live_start, None).items():
+        supplier_sales[supplier_id] = supplier_sales.get(supplier_id, 0) + total
+
+    top = sorted(supplier_sales.items(), key=lambda pair: pair[1], reverse=True)[:TOP_SUPPLIERS_LIMIT]
+    names = dict(Supplier.objects.filter(id__in=[supplier_id for supplier_id, _ in top]).values_list('id', 'user__full_name'))
+
+    return {
+        'total_revenue': totals['revenue'],
+        'total_orders': totals['total_orders'],
+        'pending_orders': totals['pending_orders'],
+        'delivered_orders': totals['delivered_orders'],
+        'cancelled_orders': totals['cancelled_orders'],
+        'top_suppliers': [
+            {'supplier_id': supplier_id, 'supplier_name': names.get(supplier_id), 'total_sales': total}
+            for supplier_id, total in top
+        ],
+    }
@@ -0,0 +1,201 @@
+"""
+Async versions of the read heavy endpoints, served under async/ next to the sync ones. Under ASGI a sync view holds
+one thread of the worker's pool for its whole request, slow clients included, these only hold the event loop while
+they run and await the database with the async ORM in between.
+They answer like the sync views: same token authentication (and token cache), same permission checks, same
+payloads and error bodies, and the same ETag revalidation and catalog cache (their urls are their own, so are their
+ETags and cache entries).
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .analytics import admin_dashboard_summary
+from .authentication import CachedTokenAuthentication
+from .catalog_cache import catalog_cache_key, read_catalog_page, store_catalog_page
+from .conditional import conditional_status, validator_headers
+from .fast_serializers import renderer_for
+from .models import NotificationCount, SupplierStats
+from .notifications import unread_count
+from .serializers import GroupSerializer
+from .supplier_stats import get_supplier_stats
+from .views import NotificationViewSet, ProductViewSet
+
+_authentication = CachedTokenAuthentication()
+_renderer = JSONRenderer()
+
+
+def json_response(data, status=200, headers=None):
+    # the JSONRenderer of the sync views, so both give byte for byte the same body
+    return HttpResponse(_renderer.render(data), status=status, headers=headers, content_type=_renderer.media_type)
+
+
+def error_response(exc):
+    # what DRF's exception handler makes of it
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    headers = {'WWW-Authenticate': _authentication.authenticate_header(None)} if exc.status_code == 401 else None
+    return json_response(data, status=exc.status_code, headers=headers)
+
+
+def async_read_view(allow_anonymous=False, admin_only=False):
+    """
+    GET/HEAD only, with the checks the sync views get from DRF: the token is authenticated (an invalid one is a 401
+    even where anonymous users are let in), then IsAuthenticated, or IsAdminUser with admin_only.
+    request.user and request.auth are set before the view runs.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405, headers={'Allow': 'GET, HEAD'})
+            try:
+                authenticated = await _authentication.aauthenticate(request)
+                if authenticated is not None:
+                    request.user, request.auth = authenticated
+                elif not allow_anonymous:
+                    raise NotAuthenticated()
+                if admin_only and not request.user.is_staff:
+                    raise PermissionDenied()
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                return error_response(exc)
+        return wrapped
+    return decorate
+
+
+def _viewset(viewset_class, request, action, **kwargs):
+    # the sync viewset, only for its queryset, filters, paginator and cache scope, nothing of it runs a query
+    drf_request = Request(request)
+    drf_request.user = request.user
+    view = viewset_class(request=drf_request, args=(), kwargs=kwargs, action=action, format_kwarg=None)
+    return view, drf_request
+
+
+async def _filtered_queryset(view):
+    queryset = view.get_queryset()
+    if view.request.query_params.get('search'):
+        # the first search of a process checks whether the fts table exists, that is a sync introspection query
+        return await sync_to_async(view.filter_queryset)(queryset)
+    return view.filter_queryset(queryset)
+
+
+def _not_modified(request, headers):
+    status = conditional_status(request, headers)
+    return HttpResponse(status=status, headers=headers) if status is not None else None
+
+
+async def _list(view, drf_request):
+    """ConditionalGetMixin.list + FastReadMixin.list: the validator query, then the page of .values() rows."""
+    queryset = await _filtered_queryset(view)
+    stats = await queryset.aaggregate(last_modified=Max('updated_at'), rows=Count('pk'))
+    headers = validator_headers(drf_request, stats['last_modified'], stats['rows'], scope=view.validator_scope())
+    not_modified = _not_modified(drf_request, headers)
+    if not_modified is not None:
+        return not_modified, None, headers
+
+    renderer = renderer_for(view.get_serializer_class())
+    paginator = view.paginator
+    page = await paginator.apaginate_queryset(renderer.values(queryset, view.fast_read_extra_columns), drf_request, view)
+    data = paginator.get_paginated_response(renderer.render(page, drf_request)).data
+    return None, data, headers
+
+
+async def _retrieve(view, drf_request, pk):
+    """ConditionalGetMixin.retrieve + FastReadMixin.retrieve."""
+    queryset = (await _filtered_queryset(view)).filter(pk=pk)
+    updated_at = await queryset.values_list('updated_at', flat=True).afirst()
+    if updated_at is None:
+        raise NotFound(f'No {queryset.model._meta.object_name} matches the given query.')
+    headers = validator_headers(drf_request, updated_at, scope=view.validator_scope())
+    not_modified = _not_modified(drf_request, headers)
+    if not_modified is not None:
+        return not_modified, None, headers
+
+    renderer = renderer_for(view.get_serializer_class())
+    row = await renderer.values(queryset).afirst()
+    if row is None:
+        raise NotFound(f'No {queryset.model._meta.object_name} matches the given query.')
+    return None, renderer.render([row], drf_request)[0], headers
+
+
+async def _catalog_read(view, drf_request, action, read):
+    """CatalogCacheMixin: the cached page, or read it and cache it."""
+    # the cache calls block (a network round trip on a shared backend), they run in a thread like the sync ORM calls
+    key = await sync_to_async(catalog_cache_key)(f'{view.catalog_cache_kind}:{action}', view.catalog_cache_scope(), drf_request)
+    entry = await sync_to_async(read_catalog_page)(key)
+    if entry is not None:
+        data, headers = entry
+        not_modified = _not_modified(drf_request, headers) if headers else None
+        return not_modified or json_response(data, headers=headers)
+
+    not_modified, data, headers = await read()
+    if not_modified is not None:
+        return not_modified
+    await sync_to_async(store_catalog_page)(key, data, headers)
+    return json_response(data, headers=headers)
+
+
+@async_read_view()
+async def product_list(request):
+    view, drf_request = _viewset(ProductViewSet, request, 'list')
+    return await _catalog_read(view, drf_request, 'list', lambda: _list(view, drf_request))
+
+
+@async_read_view()
+async def product_detail(request, pk):
+    view, drf_request = _viewset(ProductViewSet, request, 'retrieve', pk=pk)
+    return await _catalog_read(view, drf_request, 'retrieve', lambda: _retrieve(view, drf_request, pk))
+
+
+@async_read_view()
+async def notification_list(request):
+    view, drf_request = _viewset(NotificationViewSet, request, 'list')
+    not_modified, data, headers = await _list(view, drf_request)
+    return not_modified or json_response(data, headers=headers)
+
+
+@async_read_view()
+async def notification_unread_count(request):
+    count = await NotificationCount.objects.filter(user=request.user).values_list('unread', flat=True).afirst()
+    if count is None:
+        # no counter yet, unread_count builds it
+        count = await sync_to_async(unread_count)(request.user)
+    return json_response({'unread': count})
+
+
+@async_read_view(allow_anonymous=True)
+async def group_listing(request):
+    groups = [group async for group in Group.objects.all()]
+    return json_response(GroupSerializer(groups, many=True).data)
+
+
+@async_read_view(admin_only=True)
+async def admin_dashboard_analytics(request):
+    # a dozen rollup queries with their own connection handling, one trip to a thread runs them all
+    return json_response(await sync_to_async(admin_dashboard_summary)())
+
+
+@async_read_view()
+async def supplier_dashboard_analytics(request):
+    user = request.user
+    if user.user_role != 'supplier':
+        raise PermissionDenied('You are not a supplier.')
+
+    stats = await SupplierStats.objects.filter(supplier_id=user.supplier.id).afirst()
+    if stats is None:
+        # not built yet for this supplier, get_supplier_stats builds it
+        stats = await sync_to_async(get_supplier_stats)(user.supplier)
+
+    return json_response({
+        'total_products': stats.total_products,
+        'total_stock': stats.total_stock,
+        'low_stock_products': stats.low_stock_products,
+        'revenue_generated': stats.revenue_generated,
+        'orders_pending': stats.orders_pending,
+    })
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import Customer, DeliveryPersonnel, Supplier, User
+
+TOKEN_CACHE_TTL = getattr(settings, 'TOKEN_CACHE_TTL', 60)
+TOKEN_CACHE_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 10000)
+
+# the role profiles the viewsets reach through request.user (user.customer, user.supplier, user.deliverypersonnel)
+PROFILE_MODELS = {'customer': Customer, 'supplier': Supplier, 'delivery': DeliveryPersonnel}
+# one joined query for the token, its user and every role profile
+TOKEN_RELATED = ['user'] + [f'user__{model._meta.model_name}' for model in PROFILE_MODELS.values()]
+
+
+def _row(instance):
+    return tuple(getattr(instance, field.attname) for field in instance._meta.concrete_fields)
+
+
+def _instance(model, row):
+    return model.from_db(DEFAULT_DB_ALIAS, [field.attname for field in model._meta.concrete_fields], row)
+
+
+class TokenCache:
+    """
+    token key -> (token row, user row, role profile row), least recently used first, every entry valid for ttl seconds.
+    Rows are cached instead of model instances so every request gets its own Token and User, nothing one request
+    caches on them (permissions, related objects) is seen by another.
+    """
+
+    def __init__(self, ttl=TOKEN_CACHE_TTL, size=TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        # bumped by every forget, a lookup that started before one must not put what it read into the cache
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, _, token_row, user_row, profile = entry
+            if expires <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+
+        token = _instance(Token, token_row)
+        token.user = user = _instance(User, user_row)
+        if profile is not None:
+            model, profile_row = profile
+            # reverse one-to-one assignment, user.customer (or supplier, deliverypersonnel) is then served without a query
+            setattr(user, model._meta.model_name, _instance(model, profile_row))
+        return token
+
+    def set(self, token, generation):
+        user = token.user
+        model = PROFILE_MODELS.get(user.user_role)
+        profile = getattr(user, model._meta.model_name, None) if model else None
+        entry = (time.monotonic() + self.ttl, user.pk, _row(token), _row(user), (model, _row(profile)) if profile is not None else None)
+
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._drop(token.key)
+            self._entries[token.key] = entry
+            self._keys_by_user.setdefault(user.pk, set()).add(token.key)
+            while len(self._entries) > self.size:
+                self._drop(next(iter(self._entries)))
+
+    def forget_token(self, key):
+        with self._lock:
+            self.generation += 1
+            self._drop(key)
+
+    def forget_user(self, user_id):
+        with self._lock:
+            self.generation += 1
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with the token -> user lookup, and the user's role profile, kept in a per process cache.
+    A cache miss is one joined query for token, user and profile, a hit is none. Entries are dropped when the token is
+    deleted or the user or profile is saved or deleted (see signals.py), queryset.update() skips those signals and
+    other processes dont see them, the TTL bounds how long such a change goes unnoticed.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            generation = token_cache.generation
+            try:
+                token = Token.objects.select_related(*TOKEN_RELATED).get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(token, generation)
+        return self._checked(token)
+
+    async def aauthenticate(self, request):
+        """authenticate() for the async views, a cache miss is read with the async ORM."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        # same header checks and messages as TokenAuthentication.authenticate
+        if len(auth) == 1:
+            raise AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+
+        # the token cache waits on a threading lock, that is done in a thread and not on the event loop
+        token = await sync_to_async(token_cache.get)(key)
+        if token is None:
+            generation = token_cache.generation
+            try:
+                token = await Token.objects.select_related(*TOKEN_RELATED).aget(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            await sync_to_async(token_cache.set)(token, generation)
+        return self._checked(token)
+
+    def _checked(self, token):
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return (token.user, token)
@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+from .order_totals import apply_line_delta
+
+
+class CartClosed(Exception):
+    """The order stopped being a cart (it was checked out) before its lines could be written."""
+
+
+def claim_cart(order_id, now=None):
+    """
+    Hold the order as a cart for the rest of the transaction, a conditional UPDATE run before any line is written:
+    a checkout of it waits for the transaction, or has already taken it out of the cart state.
+    Has to run inside transaction.atomic.
+    :raises CartClosed: the order is not a cart (anymore)
+    """
+    if not Order.objects.filter(pk=order_id, status='cart').update(updated_at=now or timezone.now()):
+        raise CartClosed(order_id)
+
+
+def cart_line_errors(lines, products):
+    """
+    Check the lines of a bulk cart write against the products they point at.
+    :param lines: validated lines, dicts of product id and quantity
+    :param products: dict of product id -> Product for every product id in lines
+    :return: one error dict per line (empty when the line is fine), in the same order as lines
+    """
+    errors = []
+    seen = set()
+    for line in lines:
+        product = products.get(line['product'])
+        if product is None:
+            errors.append({'product': [f"Invalid pk \"{line['product']}\" - object does not exist."]})
+        elif product.id in seen:
+            errors.append({'product': ['This product is already on another line of the request.']})
+        elif product.stock_quantity < line['quantity']:
+            errors.append({'quantity': [
+                f"Not enough stock for '{product.product_name}'. "
+                f"Available product at the moment: {product.stock_quantity}, you requested for: {line['quantity']}."
+            ]})
+        else:
+            errors.append({})
+        seen.add(line['product'])
+    return errors
+
+
+def cart_line_products(lines):
+    # the stock check of every line comes out of this one query (in_bulk would split it in batches of 999 ids)
+    products = Product.objects.filter(id__in={line['product'] for line in lines}).only('id', 'product_name', 'product_price', 'stock_quantity')
+    return {product.id: product for product in products}
+
+
+def upsert_cart_lines(order, lines, products):
+    """
+    Put the lines on the cart in one go: a product that already has a line on the order gets that line's quantity and
+    price replaced, any other product gets a new line. The order total moves once by the difference.
+    :param lines: validated lines without errors, see cart_line_errors
+    :return: the cart lines of the products in lines
+    :raises CartClosed: the order is not a cart (anymore)
+    """
+    quantities = {line['product']: line['quantity'] for line in lines}
+    now = timezone.now()
+
+    with transaction.atomic():
+        claim_cart(order.pk, now)
+
+        existing = {}
+        duplicates = []
+        old_total = 0
+        for item in OrderItem.objects.filter(order=order, product_id__in=quantities).order_by('id'):
+            old_total += item.line_total
+            if item.product_id in existing:
+                duplicates.append(item.id)  # older carts can hold a product twice, it ends up on a single line
+            else:
+                existing[item.product_id] = item
+
+        changed, created = [], []
+        for product_id, quantity in quantities.items():
+            price = products[product_id].product_price
+            item = existing.get(product_id)
+            if item is None:
+                # bulk_create skips save(), so line_total is set here
+                created.append(OrderItem(order=order, product_id=product_id, quantity=quantity, price=price, line_total=price * quantity))
+            else:
+                item.quantity, item.price, item.line_total, item.updated_at = quantity, price, price * quantity, now
+                changed.append(item)
+
+        if duplicates:
+            OrderItem.objects.filter(id__in=duplicates).delete()
+        if changed:
+            OrderItem.objects.bulk_update(changed, ['quantity', 'price', 'line_total', 'updated_at'])
+        if created:
+            OrderItem.objects.bulk_create(created)
+
+        items = changed + created
+        apply_line_delta(order.id, sum(item.line_total for item in items) - old_total)
+    return items
@@ -0,0 +1,125 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .conditional import conditional_response
+
+CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')
+
+VERSION_KEY = 'catalog:version'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def catalog_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # seeded from the clock so a version key that got evicted never comes back as a number old entries were stored under
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def invalidate_catalog():
+    # after commit, otherwise a read in between could cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+def _count(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cache_stats():
+    cache = _cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'version': catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+def catalog_cache_key(kind, scope, request):
+    # host is part of it because image urls in the payload are absolute, query params are sorted so ?a=1&b=2 and ?b=2&a=1 share an entry
+    query = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    digest = hashlib.md5(repr((request.get_host(), request.path, query)).encode()).hexdigest()
+    return f'catalog:v{catalog_version()}:{kind}:{scope}:{digest}'
+
+
+def read_catalog_page(key):
+    """
+    :return: the (data, validator headers) cached under key, None on a miss. Hits and misses are counted for
+        catalog-cache-stats/.
+    """
+    entry = _cache().get(key)
+    _count(MISSES_KEY if entry is None else HITS_KEY)
+    return entry
+
+
+def store_catalog_page(key, data, headers):
+    _cache().set(key, (data, {header: headers[header] for header in VALIDATOR_HEADERS if header in headers}))
+
+
+class CatalogCacheMixin:
+    """
+    Read-through cache for list/retrieve of catalog viewsets. Entries are keyed by the catalog version, so every
+    write only has to call invalidate_catalog() and all the old pages, filters and single items are dropped at once.
+    """
+    catalog_cache_kind = None
+
+    def catalog_cache_scope(self):
+        # viewsets whose queryset depends on the user have to return something that tells those querysets apart
+        return 'all'
+
+    def validator_scope(self):
+        # the cached validators are served to everyone in the entry's scope, so they are computed for that scope
+        return f'catalog:{self.catalog_cache_scope()}'
+
+    def _cached_response(self, action, build_response):
+        request = self.request
+        key = catalog_cache_key(f'{self.catalog_cache_kind}:{action}', self.catalog_cache_scope(), request)
+
+        entry = read_catalog_page(key)
+        if entry is not None:
+            data, headers = entry
+            # the validators (ETag, Last-Modified) are cached with the page, revalidating a cached page needs no query
+            not_modified = conditional_response(request, headers) if headers else None
+            if not_modified is not None:
+                return not_modified
+            return Response(data, headers=headers)
+
+        response = build_response()
+        if response.status_code == 200:
+            store_catalog_page(key, response.data, response.headers)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response('list', lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response('retrieve', lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
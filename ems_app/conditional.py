@@ -0,0 +1,79 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date
+from rest_framework.response import Response
+
+
+def validator_headers(request, *state, scope=None):
+    """
+    ETag and Last-Modified of a response.
+    :param state: what the response body depends on besides the url and the user, the last updated_at first
+    :param scope: who gets this body, the user when None. A body shared by many users (a catalog cache entry) gives
+        the scope it is shared in, all of them then get the same ETag for the same bytes
+    """
+    # query params sorted like the catalog cache keys, ?a=1&b=2 and ?b=2&a=1 are the same body
+    query = sorted((key, sorted(values)) for key, values in request.GET.lists())
+    owner = request.user.pk if scope is None else scope
+    digest = hashlib.md5(repr((request.get_host(), request.path, query, owner, state)).encode()).hexdigest()
+    headers = {'ETag': f'"{digest}"'}
+    if state and state[0] is not None:
+        headers['Last-Modified'] = http_date(state[0].timestamp())
+    return headers
+
+
+def conditional_status(request, headers):
+    """
+    Django's own evaluation of If-None-Match / If-Modified-Since (and If-Match) against the validators.
+    :return: 304 (or 412), None when the client has to get the full response
+    """
+    last_modified = parse_http_date(headers['Last-Modified']) if 'Last-Modified' in headers else None
+    response = get_conditional_response(request, etag=headers['ETag'], last_modified=last_modified)
+    return response.status_code if response is not None else None
+
+
+def conditional_response(request, headers):
+    """:return: the 304 (or 412) response with the validators, None when the client has to get the full response"""
+    status = conditional_status(request, headers)
+    if status is None:
+        return None
+    return Response(status=status, headers=headers)
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified on list and retrieve. The validators come from one cheap query, MAX(updated_at) and COUNT over
+    the filtered queryset for lists (the count catches deletes), the row's updated_at for retrieve. A client that
+    already has the current payload gets a 304 before any page is read or serialized.
+    A delete only changes a list's ETag, not its Last-Modified, list clients should revalidate with If-None-Match
+    (which takes precedence over If-Modified-Since).
+    """
+
+    def validator_scope(self):
+        # the ETag is per user unless the viewset shares its responses more widely
+        return None
+
+    def _conditional(self, headers, build_response):
+        response = conditional_response(self.request, headers)
+        if response is not None:
+            return response
+        response = build_response()
+        if response.status_code == 200:
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        stats = self.filter_queryset(self.get_queryset()).aggregate(last_modified=Max('updated_at'), rows=Count('pk'))
+        headers = validator_headers(request, stats['last_modified'], stats['rows'], scope=self.validator_scope())
+        return self._conditional(headers, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        updated_at = queryset.values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)  # the 404 comes from there
+        headers = validator_headers(request, updated_at, scope=self.validator_scope())
+        return self._conditional(headers, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
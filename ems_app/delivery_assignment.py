@@ -0,0 +1,120 @@
+import heapq
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Delivery, DeliveryPersonnel
+from .notifications import create_notifications
+from .outbox import enqueue_emails
+
+# pending deliveries assigned per transaction, each batch is one UPDATE however many couriers it spreads over
+ASSIGN_BATCH_SIZE = getattr(settings, 'DELIVERY_ASSIGN_BATCH_SIZE', 2000)
+# open (assigned, not yet delivered) deliveries a courier is given at most, None for no limit
+MAX_OPEN_DELIVERIES = getattr(settings, 'DELIVERY_MAX_OPEN_PER_COURIER', None)
+
+
+def active_couriers():
+    """
+    Every active courier with the number of deliveries they have open, one grouped query.
+    :return: (dict of courier id -> (user id, email, full name), min-heap of (open deliveries, courier id))
+    """
+    rows = (
+        DeliveryPersonnel.objects
+        .filter(user__is_active=True)
+        .annotate(open_deliveries=Count('delivery', filter=Q(delivery__delivery_status='assigned')))
+        .values_list('id', 'open_deliveries', 'user_id', 'user__email', 'user__full_name')
+    )
+    couriers, loads = {}, []
+    for courier_id, load, user_id, email, name in rows:
+        couriers[courier_id] = (user_id, email, name)
+        loads.append((load, courier_id))
+    heapq.heapify(loads)
+    return couriers, loads
+
+
+def pending_delivery_ids(after_id, batch_size):
+    # keyset over the (delivery_status, id) index, every batch is an index range however many deliveries are waiting
+    pending = Delivery.objects.filter(delivery_status='pending', delivery_personnel__isnull=True, id__gt=after_id)
+    return list(pending.order_by('id').values_list('id', flat=True)[:batch_size])
+
+
+def balance(delivery_ids, loads, max_load=None):
+    """
+    Hand every delivery to the courier with the fewest open ones, loads is the (open deliveries, courier id) min-heap
+    and is updated in place.
+    :return: dict of courier id -> [delivery ids], deliveries left over once every courier has max_load are left out
+    """
+    assigned = {}
+    for delivery_id in delivery_ids:
+        if not loads or (max_load is not None and loads[0][0] >= max_load):
+            break
+        load, courier_id = loads[0]
+        heapq.heapreplace(loads, (load + 1, courier_id))
+        assigned.setdefault(courier_id, []).append(delivery_id)
+    return assigned
+
+
+def notify_couriers(assigned, couriers):
+    # one notification and one email per courier for the whole batch, each kind written with bulk INSERTs
+    notifications, emails = [], []
+    for courier_id, delivery_ids in assigned.items():
+        user_id, email, name = couriers[courier_id]
+        message = f"You have been assigned {len(delivery_ids)} new deliveries: {', '.join(f'#{delivery_id}' for delivery_id in delivery_ids)}."
+        notifications.append((user_id, message))
+        emails.append((f"{len(delivery_ids)} new deliveries", f"Dear {name},\n\n{message}\n\n- Aryush Ecom", [email]))
+    create_notifications(notifications)
+    enqueue_emails(emails)
+
+
+def assign_deliveries(batch_size=None, max_load=MAX_OPEN_DELIVERIES):
+    """
+    Assign the pending deliveries to couriers, evening out how many each has open. The couriers and their loads are
+    read once into a min-heap, after that every batch of batch_size deliveries costs a fixed handful of queries: its
+    ids, one conditional UPDATE with a CASE per courier and the bulk inserts of the courier notifications and emails.
+    A delivery someone assigned by hand in between is left alone, the loads are then read again.
+    :param max_load: no courier gets more open deliveries than this, the rest stay pending for the next run
+    :return: dict of how many deliveries were assigned, how many are still pending and how many couriers got some
+    """
+    batch_size = batch_size or ASSIGN_BATCH_SIZE
+    couriers, loads = active_couriers()
+    totals = {'assigned': 0, 'pending': 0, 'couriers': 0}
+    busy = set()
+
+    after_id = 0
+    while True:
+        ids = pending_delivery_ids(after_id, batch_size)
+        if not ids:
+            break
+        after_id = ids[-1]
+        assigned = balance(ids, loads, max_load)
+        delivery_ids = [delivery_id for courier_ids in assigned.values() for delivery_id in courier_ids]
+        totals['pending'] += len(ids) - len(delivery_ids)
+        if not delivery_ids:
+            continue  # every courier is full, the rest are only counted
+
+        now = timezone.now()
+        courier_of = Case(
+            *[When(id__in=courier_ids, then=Value(courier_id)) for courier_id, courier_ids in assigned.items()],
+            output_field=IntegerField(),
+        )
+        with transaction.atomic():
+            updated = Delivery.objects.filter(id__in=delivery_ids, delivery_status='pending', delivery_personnel__isnull=True).update(
+                delivery_personnel_id=courier_of, delivery_status='assigned', assigned_date=now, updated_at=now,
+            )
+            if updated != len(delivery_ids):
+                # what this UPDATE assigned is told apart by its timestamp
+                assigned = {}
+                rows = Delivery.objects.filter(id__in=delivery_ids, delivery_status='assigned', assigned_date=now)
+                for delivery_id, courier_id in rows.values_list('id', 'delivery_personnel_id'):
+                    assigned.setdefault(courier_id, []).append(delivery_id)
+            notify_couriers(assigned, couriers)
+
+        totals['assigned'] += updated
+        busy.update(assigned)
+        if updated != len(delivery_ids):
+            couriers, loads = active_couriers()
+
+    totals['couriers'] = len(busy)
+    return totals
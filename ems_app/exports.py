@@ -0,0 +1,159 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Order, OrderItem, Payment
+
+# rows fetched from the database per round trip, and bytes of output collected before a piece is sent
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_BUFFER_SIZE = getattr(settings, 'EXPORT_BUFFER_SIZE', 64 * 1024)
+EXPORT_OUTPUTS = ('csv', 'jsonl')
+
+# carts and checkouts waiting for payment arent orders yet, the admin order listing leaves them out too
+UNPLACED_ORDER_STATUSES = ['cart', 'checkout_pending']
+
+# kind -> (queryset, date column the range applies to, ordering along an index, [(column, lookup)])
+EXPORTS = {
+    'orders': (
+        lambda: Order.objects.exclude(status__in=UNPLACED_ORDER_STATUSES),
+        'created_at', ['created_at', 'id'],
+        [
+            ('id', 'id'), ('created_at', 'created_at'), ('status', 'status'), ('payment_status', 'payment_status'),
+            ('total_amount', 'total_amount'), ('customer_id', 'customer_id'), ('customer_email', 'customer__user__email'),
+            ('customer_name', 'customer__user__full_name'),
+        ],
+    ),
+    'order-items': (
+        lambda: OrderItem.objects.exclude(order__status__in=UNPLACED_ORDER_STATUSES),
+        'order__created_at', ['order__created_at', 'order_id', 'product_id'],
+        [
+            ('id', 'id'), ('order_id', 'order_id'), ('order_created_at', 'order__created_at'), ('order_status', 'order__status'),
+            ('customer_id', 'order__customer_id'), ('customer_email', 'order__customer__user__email'),
+            ('product_id', 'product_id'), ('product_name', 'product__product_name'), ('product_sku', 'product__sku'),
+            ('supplier_id', 'product__supplier_id'), ('supplier_name', 'product__supplier__user__full_name'),
+            ('quantity', 'quantity'), ('price', 'price'), ('line_total', 'line_total'),
+        ],
+    ),
+    'payments': (
+        lambda: Payment.objects.all(),
+        'created_at', ['created_at', 'id'],
+        [
+            ('id', 'id'), ('created_at', 'created_at'), ('order_id', 'order_id'), ('customer_id', 'customer_id'),
+            ('customer_email', 'customer__user__email'), ('status', 'status'), ('amount', 'amount'),
+            ('payment_gateway', 'payment_gateway'), ('transaction_id', 'transaction_id'),
+        ],
+    ),
+}
+
+
+def parse_bound(value, end=False):
+    """
+    A date range bound, a date or a datetime. A date alone covers that whole day, so an end date is the start of the
+    next day (compared with <).
+    :return: aware datetime, None when value is empty
+    :raises ValueError: when value is neither
+    """
+    if not value:
+        return None
+    try:
+        # the date first, parse_datetime would also take a date alone, as midnight
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f"'{value}' is not a date or a datetime.")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(kind, start=None, end=None):
+    """
+    :param kind: a key of EXPORTS
+    :param start: only rows from this moment on, end: only rows before it
+    :return: (column names, iterator of value tuples) read chunk by chunk with a server side iterator, the joined
+        customer, product and supplier columns come from the same query
+    """
+    queryset, date_column, ordering, columns = EXPORTS[kind]
+    rows = queryset()
+    if start is not None:
+        rows = rows.filter(**{f'{date_column}__gte': start})
+    if end is not None:
+        rows = rows.filter(**{f'{date_column}__lt': end})
+    rows = rows.order_by(*ordering).values_list(*[lookup for _, lookup in columns])
+    return [name for name, _ in columns], rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _Line:
+    # csv.writer writes into this and gets the line back, so a row is formatted without a buffer holding the file
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        # the same ISO 8601 datetimes as the json output and the api
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(lines, size=None):
+    # one piece per EXPORT_BUFFER_SIZE bytes instead of one per row, every piece is a write to the client
+    size = size or EXPORT_BUFFER_SIZE
+    pending, length = [], 0
+    for line in lines:
+        pending.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(pending).encode()
+            pending, length = [], 0
+    if pending:
+        yield ''.join(pending).encode()
+
+
+def gzipped(pieces):
+    compressor = zlib.compressobj(wbits=31)  # 31 is the gzip container around the deflate stream
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(kind, output='csv', start=None, end=None, gzip=False):
+    """
+    The export as a download streamed while it is read from the database, the memory it takes doesnt grow with the
+    number of rows.
+    :param output: 'csv' or 'jsonl'
+    :param gzip: compress it, the download is then a .gz file
+    """
+    columns, rows = export_rows(kind, start, end)
+    lines = csv_lines(columns, rows) if output == 'csv' else jsonl_lines(columns, rows)
+    pieces = buffered(lines)
+    filename = f'{kind}-{timezone.localdate().isoformat()}.{output}'
+    content_type = 'text/csv; charset=utf-8' if output == 'csv' else 'application/x-ndjson; charset=utf-8'
+    if gzip:
+        pieces = gzipped(pieces)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(pieces, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
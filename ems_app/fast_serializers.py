@@ -0,0 +1,170 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.shortcuts import get_object_or_404
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, fields, relations, serializers
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+# fields whose to_representation gives back what the database already returns for them (int, str, bool, choice key)
+IDENTITY_FIELDS = (fields.IntegerField, fields.CharField, fields.BooleanField, fields.ChoiceField, relations.PrimaryKeyRelatedField)
+# fields that would need a second query or a model instance to render
+UNSUPPORTED_FIELDS = (serializers.BaseSerializer, relations.ManyRelatedField, fields.SerializerMethodField, relations.HyperlinkedRelatedField)
+
+
+def _datetime_converter(field):
+    # DateTimeField.to_representation looks the current timezone up for every value, here it is looked up once per page
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+        return lambda request: field.to_representation
+    if hasattr(field, 'timezone'):
+        return lambda request: field.to_representation
+
+    def bind(request):
+        tz = field.default_timezone()
+        if tz is None:
+            return field.to_representation
+
+        def convert(value):
+            if value.utcoffset() is None:
+                return field.to_representation(value)
+            text = value.astimezone(tz).isoformat()
+            return text[:-6] + 'Z' if text.endswith('+00:00') else text
+        return convert
+    return bind
+
+
+def _file_converter(field, storage):
+    # FileField.to_representation is storage.url() and request.build_absolute_uri() per value. For files on the local
+    # storage the absolute media url is built once per page and the quoted file name appended to it
+    def slow(request):
+        def convert(name):
+            if not name:
+                return None
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert
+
+    if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+        return lambda request: lambda name: name or None
+    if not isinstance(storage, FileSystemStorage) or not (storage.base_url or '').startswith('/'):
+        return slow
+
+    def bind(request):
+        prefix = request.build_absolute_uri(storage.base_url) if request is not None else storage.base_url
+        fallback = slow(request)
+
+        def convert(name):
+            if not name:
+                return None  # no file stored, the serializer renders null
+            path = filepath_to_uri(name).lstrip('/')
+            segments = path.split('/')
+            if '.' in segments or '..' in segments:
+                return fallback(name)  # dot segments, urljoin would resolve them
+            return prefix + path
+        return convert
+    return bind
+
+
+class ValuesRenderer:
+    """
+    The readable fields of a serializer compiled once into (output name, values() column, converter) entries, so a
+    page can be rendered straight from queryset.values() rows. No model instances, no per field get_attribute(), the
+    output is the same dict serializer.data would have given.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        model = serializer_class.Meta.model
+        self.entries = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, UNSUPPORTED_FIELDS) or '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} cant be rendered from values() rows.')
+
+            # each converter is bound per page (to the request, the current timezone), None means the value is used as is
+            if hasattr(field, 'bind_values_renderer'):
+                bind = field.bind_values_renderer  # custom fields that know how to render a values() column themselves
+            elif isinstance(field, fields.FileField):
+                bind = _file_converter(field, model._meta.get_field(field.source).storage)
+            elif isinstance(field, fields.DateTimeField):
+                bind = _datetime_converter(field)
+            elif isinstance(field, IDENTITY_FIELDS):
+                bind = None
+            else:
+                bind = (lambda convert: lambda request: convert)(field.to_representation)
+            self.entries.append((name, field.source, bind))
+
+        self.columns = [source for _, source, _ in self.entries]
+
+    def values(self, queryset, extra_columns=()):
+        # extra() selects (the search rank) have to stay in, the queryset may be ordered by them
+        columns = dict.fromkeys([*self.columns, *extra_columns, *queryset.query.extra_select])
+        return queryset.values(*columns)
+
+    def render(self, rows, request=None):
+        entries = [(name, source, bind(request) if bind else None) for name, source, bind in self.entries]
+        rendered = []
+        for row in rows:
+            data = {}
+            for name, source, convert in entries:
+                value = row[source]
+                if convert is None or value is None:
+                    data[name] = value
+                else:
+                    data[name] = convert(value)
+            rendered.append(data)
+        return rendered
+
+
+_renderers = {}
+
+
+def renderer_for(serializer_class):
+    # compiled on first use and kept for the life of the process
+    renderer = _renderers.get(serializer_class)
+    if renderer is None:
+        renderer = _renderers[serializer_class] = ValuesRenderer(serializer_class)
+    return renderer
+
+
+class FastReadMixin:
+    """
+    Opt-in fast path for list and retrieve: rows are read with .values() and rendered by the precompiled
+    ValuesRenderer of the viewset's serializer instead of going through model instances and the serializer.
+    Writes are untouched. Off unless the viewset sets fast_read = True.
+    """
+    fast_read = False
+    # (created_at, id) are what the keyset cursors are built from, read even when the serializer leaves them out
+    fast_read_extra_columns = ('id', 'created_at')
+
+    def use_fast_read(self):
+        if not self.fast_read:
+            return False
+        # object level permission checks need a model instance, those viewsets keep the regular path
+        return all(type(permission).has_object_permission is BasePermission.has_object_permission for permission in self.get_permissions())
+
+    def fast_renderer(self):
+        return renderer_for(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+
+        renderer = self.fast_renderer()
+        queryset = renderer.values(self.filter_queryset(self.get_queryset()), self.fast_read_extra_columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(renderer.render(page, request))
+        return Response(renderer.render(queryset, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().retrieve(request, *args, **kwargs)
+
+        renderer = self.fast_renderer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = renderer.values(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(renderer.render([row], request)[0])
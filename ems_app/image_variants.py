@@ -0,0 +1,197 @@
+import io
+import posixpath
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .catalog_cache import bump_catalog_version
+from .models import Product, ProductImageJob
+
+# longest side in pixels, the image is scaled down to fit and never up
+VARIANT_SIZES = getattr(settings, 'PRODUCT_IMAGE_VARIANT_SIZES', {'thumbnail': 200, 'medium': 800})
+# format -> (Pillow format, save options, file extension), webp is left out on a Pillow built without it
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}, 'webp'),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}, 'jpg'),
+}
+if not features.check('webp'):
+    del VARIANT_FORMATS['webp']
+
+VARIANT_DIRECTORY = 'products/variants'
+MAX_ATTEMPTS = 3
+RETRY_DELAY = timedelta(minutes=5)
+# a claim older than this belongs to a worker that died mid batch, its jobs are handed out again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_image_variants(products):
+    """
+    Queue a variants job for the current image of every product, one bulk INSERT.
+    :return: the ProductImageJob rows
+    """
+    return ProductImageJob.objects.bulk_create([
+        ProductImageJob(product_id=product.id, source_name=product.product_image.name) for product in products if product.product_image
+    ])
+
+
+def render_variants(source):
+    """
+    Resize one image into every size and format. Pure Pillow work so it can run in a pool process, the caller reads
+    the source and stores the results.
+    :param source: bytes of the original image
+    :return: list of (kind, format, width, height, encoded bytes)
+    """
+    with Image.open(io.BytesIO(source)) as original:
+        original.load()
+        # phone photos are stored sideways with an EXIF rotation, the variants are stored upright
+        image = ImageOps.exif_transpose(original)
+
+    rendered = []
+    for kind, longest_side in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((longest_side, longest_side), Image.Resampling.LANCZOS)
+        for image_format, (pillow_format, options, _) in VARIANT_FORMATS.items():
+            frame = resized
+            if pillow_format == 'JPEG' and frame.mode != 'RGB':
+                frame = _flatten(frame)
+            elif frame.mode not in ('RGB', 'RGBA'):
+                frame = frame.convert('RGBA' if 'A' in frame.getbands() or 'transparency' in frame.info else 'RGB')
+            output = io.BytesIO()
+            frame.save(output, pillow_format, **options)
+            rendered.append((kind, image_format, frame.width, frame.height, output.getvalue()))
+    return rendered
+
+
+def _flatten(image):
+    # jpeg has no alpha, transparent parts go white instead of black
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def variant_name(source_name, kind, image_format):
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    return f'{VARIANT_DIRECTORY}/{stem}-{kind}.{VARIANT_FORMATS[image_format][2]}'
+
+
+def claim_jobs(batch_size, worker_id):
+    now = timezone.now()
+    due = Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', claimed_at__lt=now - CLAIM_TIMEOUT)
+    ids = list(ProductImageJob.objects.filter(due).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # same conditional claim as the email outbox, a job another worker took in between is skipped
+    ProductImageJob.objects.filter(due, id__in=ids).update(status='processing', claimed_by=worker_id, claimed_at=now, updated_at=now)
+    return list(ProductImageJob.objects.filter(id__in=ids, status='processing', claimed_by=worker_id).order_by('id'))
+
+
+def _finish(job, **changes):
+    ProductImageJob.objects.filter(id=job.id).update(
+        attempts=F('attempts') + 1, claimed_by='', claimed_at=None, updated_at=timezone.now(), **changes
+    )
+
+
+def _fail(job, error):
+    if job.attempts + 1 >= MAX_ATTEMPTS:
+        _finish(job, status='failed', last_error=str(error))
+        return 'failed'
+    _finish(job, status='pending', next_attempt_at=timezone.now() + RETRY_DELAY, last_error=str(error))
+    return 'retried'
+
+
+def _store_variants(job, rendered):
+    """
+    Save the files and point the product at them, unless the product got a new image since the job was queued.
+    :return: True when the product was updated
+    """
+    variants = {}
+    for kind, image_format, width, height, content in rendered:
+        name = default_storage.save(variant_name(job.source_name, kind, image_format), ContentFile(content))
+        variants.setdefault(kind, {})[image_format] = {'name': name, 'width': width, 'height': height, 'bytes': len(content)}
+
+    old = Product.objects.filter(pk=job.product_id).values_list('image_variants', flat=True).first()
+    updated = Product.objects.filter(pk=job.product_id, product_image=job.source_name).update(image_variants=variants, updated_at=timezone.now())
+    stale = _variant_names(variants) if not updated else _variant_names(old or {}) - _variant_names(variants)
+    for name in stale:
+        default_storage.delete(name)
+    return bool(updated)
+
+
+def _variant_names(variants):
+    return {variant['name'] for formats in variants.values() for variant in formats.values()}
+
+
+def delete_variant_files(variants):
+    """Delete the files of variants no product points at any more, once the change that dropped them is committed."""
+    names = _variant_names(variants)
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def process_batch(executor, batch_size=20, worker_id=None):
+    """
+    Claim up to batch_size due jobs, resize their images on the executor's processes and store the variants.
+    :param executor: a concurrent.futures executor, ProcessPoolExecutor in the worker
+    :return: dict with the number of done, skipped (image replaced or product gone), retried and failed jobs
+    """
+    worker_id = worker_id or uuid.uuid4().hex
+    result = {'done': 0, 'skipped': 0, 'retried': 0, 'failed': 0}
+
+    jobs = claim_jobs(batch_size, worker_id)
+    current = dict(Product.objects.filter(id__in={job.product_id for job in jobs}).values_list('id', 'product_image'))
+    pending = []
+    for job in jobs:
+        if current.get(job.product_id) != job.source_name:
+            _finish(job, status='done')
+            result['skipped'] += 1
+            continue
+        try:
+            with default_storage.open(job.source_name, 'rb') as source:
+                pending.append((job, executor.submit(render_variants, source.read())))
+        except Exception as exc:
+            result[_fail(job, exc)] += 1
+
+    for job, future in pending:
+        try:
+            stored = _store_variants(job, future.result())
+        except Exception as exc:
+            result[_fail(job, exc)] += 1
+        else:
+            _finish(job, status='done', last_error='')
+            result['done' if stored else 'skipped'] += 1
+
+    if result['done']:
+        # product pages are cached with their image_variants, one bump for the whole batch
+        bump_catalog_version()
+    return result
+
+
+def drain_image_jobs(workers=None, batch_size=20, executor=None):
+    """
+    Process every due job, batch after batch, on one pool of worker processes.
+    :return: dict with the totals of done, skipped, retried and failed jobs
+    """
+    totals = {'done': 0, 'skipped': 0, 'retried': 0, 'failed': 0}
+    worker_id = uuid.uuid4().hex
+    owned = executor is None
+    executor = executor or ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            result = process_batch(executor, batch_size=batch_size, worker_id=worker_id)
+            for key, value in result.items():
+                totals[key] += value
+            if not any(result.values()):
+                return totals
+    finally:
+        if owned:
+            executor.shutdown()
@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import OrderItem, Product, StockReservation
+
+# seconds a checkout holds its stock for the payment
+RESERVATION_TTL = getattr(settings, 'STOCK_RESERVATION_TTL', 900)
+
+
+class OutOfStock(Exception):
+    """Raised from inside a transaction when some product cant cover the requested quantity, so the whole thing rolls back."""
+
+    def __init__(self, quantities, order_id=None, short=None):
+        super().__init__('Not enough stock.')
+        self.quantities = quantities
+        self.order_id = order_id
+        self.short = short
+
+    def short_products(self):
+        """:return: the products that cant cover their quantity, with available_stock annotated"""
+        if self.short is not None:
+            return self.short
+        # read after the rollback, so these are the real current numbers
+        products = with_available_stock(Product.objects.filter(id__in=self.quantities).only('id', 'product_name', 'stock_quantity'), self.order_id)
+        return [product for product in products.order_by('id') if product.available_stock < self.quantities[product.id]]
+
+
+def order_quantities(order):
+    # the same product can sit on more than one line of an order, the stock check has to be on the total
+    rows = OrderItem.objects.filter(order=order).values('product').annotate(quantity=Sum('quantity'))
+    return {row['product']: row['quantity'] for row in rows}
+
+
+def reserved_by_others(order_id=None):
+    """
+    Quantity of the outer query's product held by live reservations, the ones of order_id left out. A correlated
+    SUM over the (product, expires_at, quantity, order) index, no reservation row is read.
+    """
+    reservations = StockReservation.objects.filter(product=OuterRef('id'), expires_at__gt=timezone.now())
+    if order_id is not None:
+        reservations = reservations.exclude(order_id=order_id)
+    total = reservations.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+
+def with_available_stock(queryset, order_id=None):
+    """Annotates available_stock, stock_quantity minus what live reservations (other than order_id's) hold."""
+    return queryset.annotate(available_stock=F('stock_quantity') - reserved_by_others(order_id))
+
+
+def available_stock(product_ids):
+    """:return: dict of product id -> stock that isnt reserved, one query"""
+    return dict(with_available_stock(Product.objects.filter(id__in=product_ids)).values_list('id', 'available_stock'))
+
+
+def reserve_stock(order, quantities, ttl=None):
+    """
+    Hold the quantities for the order until the payment, for ttl seconds (RESERVATION_TTL by default).
+    Has to run inside transaction.atomic: the products are locked while their available stock is checked (on
+    databases with row locks, sqlite has the whole database locked by the write the checkout started with), so two
+    checkouts cant both take the last units.
+    :param quantities: dict of product id -> quantity
+    :return: when the reservation expires
+    :raises OutOfStock: with the short products (available_stock annotated) in short, nothing is reserved
+    """
+    products = with_available_stock(Product.objects.select_for_update().filter(id__in=quantities).only('id', 'product_name'), order.id)
+    short = [product for product in products.order_by('id') if product.available_stock < quantities[product.id]]
+    if short:
+        raise OutOfStock(quantities, order.id, short)
+
+    expires_at = timezone.now() + timedelta(seconds=RESERVATION_TTL if ttl is None else ttl)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+    return expires_at
+
+
+def convert_reservation(order):
+    """
+    The order's reservation becomes a stock decrement, inside the payment's transaction. What other orders have
+    reserved is off limits, the order's own reservation (even an expired one) is not needed: while it is live
+    the stock is there, once it expired the order gets what nobody else holds.
+    :return: product snapshots as decrement_stock gives them
+    :raises OutOfStock: as decrement_stock
+    """
+    changes = decrement_stock(order_quantities(order), exclude_order_id=order.id)
+    StockReservation.objects.filter(order=order).delete()
+    return changes
+
+
+def release_expired_reservations(batch_size=1000):
+    """
+    Delete the reservations past their expiry, batch_size at a time so no single delete holds the write lock for long.
+    Expired ones already dont count against the stock, this only keeps the table (and its index) small.
+    :return: number deleted
+    """
+    now = timezone.now()
+    released = 0
+    while True:
+        ids = list(StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+        if ids:
+            released += StockReservation.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return released
+
+
+def decrement_stock(quantities, exclude_order_id=None):
+    """
+    Take the quantities out of stock with one conditional UPDATE (stock_quantity = stock_quantity - q WHERE stock_quantity >= q
+    + what live reservations of other orders hold).
+    Has to run inside transaction.atomic, if any product is short OutOfStock is raised and nothing must be kept.
+    :param quantities: dict of product id -> quantity
+    :param exclude_order_id: the order paying, its own reservation doesnt count against it
+    :return: list of (before, after) product snapshots for the supplier stats
+    """
+    if not quantities:
+        return []
+
+    requested = Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+    updated = Product.objects.filter(id__in=quantities, stock_quantity__gte=requested + reserved_by_others(exclude_order_id)).update(
+        stock_quantity=F('stock_quantity') - requested,
+        updated_at=timezone.now(),
+    )
+    if updated != len(quantities):
+        raise OutOfStock(quantities, exclude_order_id)
+
+    rows = Product.objects.filter(id__in=quantities).values_list('id', 'supplier_id', 'stock_quantity', 'low_stock_threshold')
+    return [
+        ((supplier_id, stock + quantities[product_id], threshold), (supplier_id, stock, threshold))
+        for product_id, supplier_id, stock, threshold in rows
+    ]
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ems_app.delivery_assignment import ASSIGN_BATCH_SIZE, MAX_OPEN_DELIVERIES, assign_deliveries
+
+
+class Command(BaseCommand):
+    help = 'Assign the pending deliveries to the couriers with the fewest open ones, in batches, and notify them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ASSIGN_BATCH_SIZE, help='Deliveries assigned per UPDATE.')
+        parser.add_argument('--max-load', type=int, default=MAX_OPEN_DELIVERIES, help='Open deliveries a courier is given at most.')
+        parser.add_argument('--loop', action='store_true', help='Keep assigning new pending deliveries instead of exiting.')
+        parser.add_argument('--interval', type=float, default=30.0, help='Seconds to sleep between runs with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = assign_deliveries(batch_size=options['batch_size'], max_load=options['max_load'])
+            if totals['assigned'] or not options['loop']:
+                self.stdout.write(f"assigned={totals['assigned']} couriers={totals['couriers']} pending={totals['pending']}")
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ems_app.image_variants import enqueue_image_variants
+from ems_app.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Queue image variant jobs for products whose current image has no variants yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Queue every product with an image, also the ones that have variants.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products queued per INSERT.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(product_image='').only('id', 'product_image').order_by('id')
+        if not options['all']:
+            products = products.filter(image_variants={})
+        # a product that already has a job waiting isnt queued twice
+        products = products.exclude(image_jobs__status__in=['pending', 'processing'])
+
+        queued = 0
+        batch = []
+        for product in products.iterator(chunk_size=options['batch_size']):
+            batch.append(product)
+            if len(batch) == options['batch_size']:
+                queued += len(enqueue_image_variants(batch))
+                batch = []
+        queued += len(enqueue_image_variants(batch))
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} product image(s), run manage.py process_image_variants to make them.'))
@@ -0,0 +1,43 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ems_app.models import Supplier
+from ems_app.product_import import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, ImportFileError, import_products
+
+
+class Command(BaseCommand):
+    help = "Create or update a supplier's products from a csv or json lines file, matched on the supplier's sku."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The .csv or .jsonl file.')
+        parser.add_argument('--supplier', type=int, required=True, help='Id of the supplier the products belong to.')
+        parser.add_argument('--format', dest='file_format', choices=sorted(set(IMPORT_FORMATS.values())), help='Format of the file, taken from its extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows validated and written per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            supplier = Supplier.objects.get(pk=options['supplier'])
+        except Supplier.DoesNotExist:
+            raise CommandError(f"No supplier with id {options['supplier']}.")
+        file_format = options['file_format'] or IMPORT_FORMATS.get(os.path.splitext(options['path'])[1].lower())
+        if file_format is None:
+            raise CommandError('Cant tell the format from the file name, pass --format.')
+
+        with open(options['path'], 'rb') as stream:
+            try:
+                report = import_products(supplier, stream, file_format, chunk_size=options['chunk_size'])
+            except ImportFileError as exc:
+                self.write_report(exc.report)
+                raise CommandError(str(exc))
+        self.write_report(report)
+
+    def write_report(self, report):
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']} ({error['sku'] or 'no sku'}): {error['errors']}")
+        if report['errors_truncated']:
+            self.stderr.write(f"only the first {len(report['errors'])} errors are listed")
+        style = self.style.WARNING if report['failed'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{report['rows']} row(s): {report['created']} created, {report['updated']} updated, {report['failed']} failed."
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ems_app.image_variants import drain_image_jobs
+
+
+class Command(BaseCommand):
+    help = 'Make the resized variants of uploaded product images on a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes, one per CPU by default.')
+        parser.add_argument('--batch-size', type=int, default=20, help='Jobs claimed per batch.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for jobs instead of exiting once there are none.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = drain_image_jobs(workers=options['workers'], batch_size=options['batch_size'])
+            if any(totals.values()):
+                self.stdout.write(f"done={totals['done']} skipped={totals['skipped']} retried={totals['retried']} failed={totals['failed']}")
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ems_app.notifications import rebuild_unread_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the unread notification counters from the notifications and report any drift from the stored values.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only rebuild this user id (can be repeated).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not write anything.')
+
+    def handle(self, *args, **options):
+        drift = rebuild_unread_counts(options['users'], dry_run=options['dry_run'])
+
+        for user_id, stored, actual in drift:
+            self.stdout.write(f'user #{user_id}: unread stored={stored} actual={actual}')
+
+        if drift:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} drifted counter(s) found.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
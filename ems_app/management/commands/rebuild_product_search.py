@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ems_app.search import fts_available, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index (SQLite FTS5) from the product table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild.')
+
+    def handle(self, *args, **options):
+        if not fts_available(options['database']):
+            raise CommandError('The product search index only exists on SQLite, run the migrations first.')
+
+        indexed = rebuild_search_index(options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} product(s).'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ems_app.supplier_stats import rebuild_supplier_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the supplier dashboard stats from scratch and report any drift from the stored values.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--supplier', type=int, action='append', dest='suppliers', help='Only rebuild this supplier id (can be repeated).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not write anything.')
+
+    def handle(self, *args, **options):
+        drift = rebuild_supplier_stats(options['suppliers'], dry_run=options['dry_run'])
+
+        for supplier_id, field, stored, actual in drift:
+            self.stdout.write(f'supplier #{supplier_id}: {field} stored={stored} actual={actual}')
+
+        if drift:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} drifted value(s) found.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
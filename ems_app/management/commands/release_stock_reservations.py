@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ems_app.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete the stock reservations of checkouts whose payment never came, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations deleted per statement.')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting once nothing is expired.')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep between sweeps with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_reservations(batch_size=options['batch_size'])
+            if released or not options['loop']:
+                self.stdout.write(f'released={released}')
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
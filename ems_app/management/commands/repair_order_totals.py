@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ems_app.order_totals import repair_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Check every order total against the sum of its line totals and fix the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', type=int, action='append', dest='orders', help='Only check this order id (can be repeated).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not write anything.')
+
+    def handle(self, *args, **options):
+        drift = repair_order_totals(options['orders'], dry_run=options['dry_run'])
+
+        for order_id, stored, expected in drift:
+            self.stdout.write(f'order #{order_id}: total_amount={stored} expected={expected}')
+
+        if drift:
+            action = 'found' if options['dry_run'] else 'repaired'
+            self.stdout.write(self.style.WARNING(f'{len(drift)} order total(s) {action}.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All order totals match their lines.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ems_app.analytics import refresh_daily_rollups
+
+
+class Command(BaseCommand):
+    help = 'Materialize the daily sales rollups read by the admin dashboard. Run it periodically (e.g. from cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every day instead of only the days closed or touched since the last run.')
+
+    def handle(self, *args, **options):
+        days = refresh_daily_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {days} day(s).'))
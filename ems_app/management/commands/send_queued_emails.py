@@ -0,0 +1,36 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from ems_app.outbox import drain_outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Send the queued outbox emails in batches over a single SMTP connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed per batch.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is empty.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                totals = drain_outbox(batch_size=options['batch_size'])
+            except (DatabaseError, OSError):  # smtplib errors are OSErrors
+                if not options['loop']:
+                    raise
+                # the database or the smtp server went away, a long running worker waits and tries again on a fresh connection
+                logger.exception('outbox drain failed, retrying in %ss', options['interval'])
+                connections.close_all()
+            else:
+                if any(totals.values()):
+                    self.stdout.write(f"sent={totals['sent']} retried={totals['retried']} dead={totals['dead']}")
+
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,244 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+# a request taking this long is logged with its slowest queries
+SLOW_REQUEST_SECONDS = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1.0)
+SLOW_REQUEST_TOP_QUERIES = getattr(settings, 'METRICS_SLOW_REQUEST_TOP_QUERIES', 5)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _series(name, label_text):
+    return f'{name}{{{label_text}}}' if label_text else name
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(values.items()):
+            yield f'{_series(self.name, _labels(self.labels, labels))} {_number(value)}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Counts per bucket are kept as they fall, they are only made cumulative when the metrics are read."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series = {}  # labels -> [count per bucket + one for +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in sorted(series.items()):
+            label_text = _labels(self.labels, labels)
+            bucket_prefix = f'{label_text},' if label_text else ''
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{bucket_prefix}le="{bound}"}} {cumulative}'
+            yield f'{_series(self.name + "_sum", label_text)} {_number(total)}'
+            yield f'{_series(self.name + "_count", label_text)} {cumulative}'
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_LABELS = ('route', 'method')
+
+requests_total = Counter('ems_http_requests_total', 'Requests handled, per url route, method and status.', ('route', 'method', 'status'))
+request_seconds = Histogram('ems_http_request_duration_seconds', 'Time spent handling a request.', REQUEST_LABELS, LATENCY_BUCKETS)
+request_queries = Histogram('ems_http_request_sql_queries', 'SQL queries run by a request.', REQUEST_LABELS, QUERY_COUNT_BUCKETS)
+request_sql_seconds = Counter('ems_http_request_sql_seconds_total', 'Time requests spent waiting on SQL queries.', REQUEST_LABELS)
+email_seconds = Histogram('ems_email_seconds', 'Time spent on an outbound email, queueing it in a request or sending it from the outbox.', ('stage',), LATENCY_BUCKETS)
+email_failures = Counter('ems_email_send_failures_total', 'Outbox emails whose send raised.', ())
+
+METRICS = [requests_total, request_seconds, request_queries, request_sql_seconds, email_seconds, email_failures]
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    return '\n'.join(line for metric in METRICS for line in metric.collect()) + '\n'
+
+
+def reset_metrics():
+    for metric in METRICS:
+        metric.reset()
+
+
+@contextmanager
+def observe_email(stage):
+    """Times one outbound email step, 'queue' in the request or 'send' in the outbox worker."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if stage == 'send':
+            email_failures.inc(())
+        raise
+    finally:
+        email_seconds.observe((stage,), time.perf_counter() - started)
+
+
+class QueryRecorder:
+    """execute_wrapper that counts the queries of a request, adds up their time and keeps the slowest few."""
+
+    def __init__(self, keep=SLOW_REQUEST_TOP_QUERIES):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep = keep
+        self.slowest = []  # min-heap of (seconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, sql))
+
+
+# the recorder of the request being handled, sync_to_async copies the context so the threads the async ORM runs
+# queries in see the recorder of the request they run for
+_current_recorder = ContextVar('ems_query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(connection, **kwargs):
+    # once per connection object, it stays on it across reconnects
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """
+    Latency, SQL query count and SQL time of every request, labelled with its url route (the pattern, not the path,
+    so ids dont make a new series each) and method, served on /metrics. Slow requests are logged with their slowest
+    queries. Per process: with several workers every scrape sees the one it reached.
+    Works sync and async. Queries are counted wherever they run, an async view's run on the sync_to_async thread of
+    its request and are counted there too.
+    The body of a streaming response is read after the middleware returns, its queries and time are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not METRICS_ENABLED:
+            return self.get_response(request)
+
+        # connections opened before this module was imported never sent connection_created to it
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        self._observe(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not METRICS_ENABLED:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        self._observe(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _observe(request, response, recorder, elapsed):
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        labels = (route, request.method)
+        requests_total.inc((route, request.method, response.status_code))
+        request_seconds.observe(labels, elapsed)
+        request_queries.observe(labels, recorder.count)
+        request_sql_seconds.inc(labels, recorder.seconds)
+
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            slowest = '\n'.join(f'  {seconds * 1000:.1f}ms {sql[:500]}' for seconds, sql in sorted(recorder.slowest, reverse=True))
+            logger.warning(
+                'slow request %s %s (%s) %s in %.0fms, %d queries in %.0fms, slowest:\n%s',
+                request.method, request.get_full_path(), route, response.status_code, elapsed * 1000,
+                recorder.count, recorder.seconds * 1000, slowest,
+            )
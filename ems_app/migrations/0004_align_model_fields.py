@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0004_delivery_delivery_address'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='delivery',
+            name='delivery_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('assigned', 'Assigned'), ('delivered', 'Delivered')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('cart', 'cart'), ('ordered', 'ordered'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ems_app.productcategory'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='stock_quantity',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='supplier',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ems_app.supplier'),
+        ),
+        migrations.AlterField(
+            model_name='productcategory',
+            name='category_name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0005_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplierStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('total_products', models.IntegerField(default=0)),
+                ('total_stock', models.IntegerField(default=0)),
+                ('low_stock_products', models.IntegerField(default=0)),
+                ('revenue_generated', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders_pending', models.IntegerField(default=0)),
+                ('supplier', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='ems_app.supplier')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
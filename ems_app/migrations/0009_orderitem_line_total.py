@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_line_totals(apps, schema_editor):
+    OrderItem = apps.get_model('ems_app', 'OrderItem')
+    OrderItem.objects.update(line_total=F('price') * F('quantity'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0008_product_low_stock_threshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_line_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:31
+
+from django.db import migrations
+
+# SQLite only: an FTS5 index over the searchable product columns, kept in sync by triggers so every write path
+# (viewsets, bulk_create, queryset.update, the admin) updates it without any python code involved.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE ems_app_product_fts USING fts5(
+        product_name, product_description, category_name, product_price,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER ems_app_product_fts_insert AFTER INSERT ON ems_app_product BEGIN
+        INSERT INTO ems_app_product_fts (rowid, product_name, product_description, category_name, product_price)
+        VALUES (
+            new.id, new.product_name, new.product_description,
+            COALESCE((SELECT category_name FROM ems_app_productcategory WHERE id = new.category_id), ''),
+            printf('%.2f', new.product_price)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER ems_app_product_fts_update AFTER UPDATE OF product_name, product_description, category_id, product_price ON ems_app_product BEGIN
+        UPDATE ems_app_product_fts SET
+            product_name = new.product_name,
+            product_description = new.product_description,
+            category_name = COALESCE((SELECT category_name FROM ems_app_productcategory WHERE id = new.category_id), ''),
+            product_price = printf('%.2f', new.product_price)
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER ems_app_product_fts_delete AFTER DELETE ON ems_app_product BEGIN
+        DELETE FROM ems_app_product_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER ems_app_productcategory_fts_rename AFTER UPDATE OF category_name ON ems_app_productcategory BEGIN
+        UPDATE ems_app_product_fts SET category_name = new.category_name
+        WHERE rowid IN (SELECT id FROM ems_app_product WHERE category_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO ems_app_product_fts (rowid, product_name, product_description, category_name, product_price)
+    SELECT p.id, p.product_name, p.product_description, COALESCE(c.category_name, ''), printf('%.2f', p.product_price)
+    FROM ems_app_product p LEFT JOIN ems_app_productcategory c ON c.id = p.category_id
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS ems_app_productcategory_fts_rename',
+    'DROP TRIGGER IF EXISTS ems_app_product_fts_delete',
+    'DROP TRIGGER IF EXISTS ems_app_product_fts_update',
+    'DROP TRIGGER IF EXISTS ems_app_product_fts_insert',
+    'DROP TABLE IF EXISTS ems_app_product_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
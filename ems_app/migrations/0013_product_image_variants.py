@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+import importlib
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# adding a JSONField makes sqlite rebuild ems_app_product (create, copy, drop, rename), the search index triggers of
+# 0011 that point at the table would break the rename, so they are dropped for it and created again afterwards
+search_index = importlib.import_module('ems_app.migrations.0011_product_search_fts')
+TRIGGER_SQL = [statement for statement in search_index.CREATE_SQL if 'CREATE TRIGGER' in statement]
+DROP_TRIGGER_SQL = [statement for statement in search_index.DROP_SQL if 'DROP TRIGGER' in statement]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0012_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(DROP_TRIGGER_SQL), run_on_sqlite(TRIGGER_SQL)),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='ProductImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=64)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_jobs', to='ems_app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='imagejob_due_idx')],
+            },
+        ),
+        migrations.RunPython(run_on_sqlite(TRIGGER_SQL), run_on_sqlite(DROP_TRIGGER_SQL)),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0014_product_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(condition=models.Q(('sku__isnull', False)), fields=('supplier', 'sku'), name='product_supplier_sku_uniq'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0015_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='ems_app.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='ems_app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at', 'quantity', 'order'], name='reservation_product_live_idx'), models.Index(fields=['expires_at'], name='reservation_expires_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='reservation_order_product_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ems_app', '0017_delivery_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('unread', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddField(
+            model_name='notificationcount',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notification_count', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models import F, Q
 from django.contrib.auth.models import AbstractUser
 from base.models import BaseModel
+from django.utils import timezone
 import uuid    
 # Create your models here.
 
@@ -62,9 +64,30 @@ class Product(BaseModel):
     product_image = models.ImageField(upload_to='products/')
     stock_quantity = models.IntegerField()
     category = models.ForeignKey(ProductCategory, on_delete=models.SET_NULL,null=True)
+    low_stock_threshold = models.PositiveIntegerField(default=5)  # stock below this counts as low and gets the supplier alerted
+    low_stock_alerted_at = models.DateTimeField(null=True, blank=True)  # last low stock alert, so the same alert isnt sent again too soon
+    # resized copies of product_image made by the image worker (see ems_app/image_variants.py):
+    # {kind: {format: {name, width, height, bytes}}}, empty until the worker got to the current image
+    image_variants = models.JSONField(default=dict, blank=True)
+    # the supplier's own product code, what a bulk import matches rows on (see ems_app/product_import.py)
+    sku = models.CharField(max_length=64, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            # unique per supplier, products without a sku (null) are left out
+            models.UniqueConstraint(fields=['supplier', 'sku'], condition=Q(sku__isnull=False), name='product_supplier_sku_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),  # keyset pagination
+            models.Index(fields=['updated_at'], name='product_updated_idx'),  # MAX(updated_at) of the catalog's conditional GET
+            models.Index(fields=['supplier', 'created_at', 'id'], name='product_supplier_created_idx'),  # a supplier's own product listing
+            # partial index holding only the low stock products, the low stock check reads it instead of every product
+            models.Index(fields=['supplier', 'id'], condition=Q(stock_quantity__lt=F('low_stock_threshold')), name='product_low_stock_idx'),
+        ]
+
+    # own columns only, so listing products (the admin does) doesnt query the category and supplier of every row
     def __str__(self):
-        return f"{self.id}. {self.product_name} - {self.category.category_name} from {self.supplier.user.username}"
+        return f"{self.id}. {self.product_name}"
 
 
 # this is to set a default order for using it like a cart at first then later after the completion of the orders it will be stored as a order data or history
@@ -88,6 +111,17 @@ class Order(BaseModel):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_status = models.CharField(choices=PAYMENT_CHOICES, max_length=20)
 
+    class Meta:
+        # created_at buckets orders per day for the dashboard rollups, updated_at finds the days that need re-rolling,
+        # (created_at, id) is also the keyset the order listings page on
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+            models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),  # a customer's cart
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_idx'),
+        ]
+
     # def __str__(self):
     #     return f"Order #{self.id} by {self.customer.user.full_name} |  status={self.status}  |  payment={self.payment_status}  |   {self.order_date}"
 
@@ -97,9 +131,42 @@ class OrderItem(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)  # kept to record the price for later when the price of the same product might change . This i will extract from product
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # price * quantity, stored so order totals and analytics can be summed in SQL
+
+    class Meta:
+        # (order, product) finds the line of a product in a cart, (product, order) serves the per supplier sales joins
+        indexes = [
+            models.Index(fields=['order', 'product'], name='orderitem_order_product_idx'),
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.line_total = self.price * self.quantity
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Product #{self.product_id} x {self.quantity}"
+
+# stock held for an order from checkout until it is paid or expires_at passes, a reservation past expires_at holds
+# nothing anymore and is only left for the sweeper (manage.py release_stock_reservations, see ems_app/inventory.py)
+class StockReservation(BaseModel):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='reservation_order_product_uniq'),
+        ]
+        indexes = [
+            # covering index of the available stock check, a product's live reserved quantity (other orders') is summed from it alone
+            models.Index(fields=['product', 'expires_at', 'quantity', 'order'], name='reservation_product_live_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),  # the sweeper
+        ]
 
     def __str__(self):
-        return f"{self.product.product_name} x {self.quantity}"
+        return f"Order #{self.order_id} holds product #{self.product_id} x {self.quantity} until {self.expires_at}"
 
 # when the payment is done a default delivery obj will be created as a status of pending value so that admin can know that there is a order to be placed to the delivery personnel
 class Delivery(BaseModel):
@@ -116,21 +183,43 @@ class Delivery(BaseModel):
     delivered_date = models.DateTimeField(null=True, blank=True)
     delivery_address = models.TextField(default="Kathmandu")
 
+    class Meta:
+        indexes = [
+            # the pending deliveries the assignment scheduler walks (see ems_app/delivery_assignment.py)
+            models.Index(fields=['delivery_status', 'id'], name='delivery_status_idx'),
+        ]
+
     def __str__(self):
-        if self.delivery_personnel is not None:
-            personnel_name = self.delivery_personnel.user.username
+        if self.delivery_personnel_id is not None:
+            personnel = f"#{self.delivery_personnel_id}"
         else:
-            personnel_name = "Unassigned"
-        return f"ID: {self.id} |  Delivery for Order #{self.order.id}  | status: {self.delivery_status}  |  Personnel: {personnel_name}  |  Address: {self.delivery_address}"
+            personnel = "Unassigned"
+        return f"ID: {self.id} |  Delivery for Order #{self.order_id}  | status: {self.delivery_status}  |  Personnel: {personnel}  |  Address: {self.delivery_address}"
 
 # this is to store and notify user actions or alerts 
 class Notification(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
+    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),  # keyset pagination of a user's notifications
+            models.Index(fields=['user', 'is_read'], name='notification_user_unread_idx'),  # mark-all-read and the unread counter rebuild
+        ]
+
+    def __str__(self):
+        return f"Notification for user #{self.user_id} - {self.created_at}"
+
+
+# a user's number of unread notifications, kept up to date by ems_app/notifications.py so the badge is one row read
+class NotificationCount(BaseModel):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_count')
+    unread = models.PositiveIntegerField(default=0)
+
     def __str__(self):
-        return f"Notification for {self.user.email} - {self.created_at}"
+        return f"{self.unread} unread notifications for user #{self.user_id}"
 
 
 class Payment(BaseModel):
@@ -147,5 +236,112 @@ class Payment(BaseModel):
     payment_gateway = models.CharField(max_length=50, blank=True, null=True)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)# real system when doing online payments in the ecom the transaction id is used to verify the payment status
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+            models.Index(fields=['updated_at'], name='payment_updated_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='payment_customer_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Payment for Order #{self.order_id} - {self.status}"
+
+
+# emails are queued here by send_notification_email and delivered by `manage.py send_queued_emails` (see ems_app/outbox.py)
+class OutboundEmail(BaseModel):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(choices=STATUS_CHOICES, max_length=20, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default='')  # worker currently sending it, so two workers never send the same row
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Email #{self.id} to {', '.join(self.recipients)} | {self.status}"
+
+
+# one per uploaded product image, the image worker (manage.py process_image_variants) claims these and writes the
+# resized variants to Product.image_variants
+class ProductImageJob(BaseModel):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='image_jobs')
+    source_name = models.CharField(max_length=255)  # the product_image the variants are made from, a job for a replaced image is skipped
+    status = models.CharField(choices=STATUS_CHOICES, max_length=20, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='imagejob_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Image job #{self.id} for product #{self.product_id} | {self.status}"
+
+
+# denormalized numbers for the supplier dashboard, kept up to date by the product, payment and delivery write paths (see ems_app/supplier_stats.py)
+class SupplierStats(BaseModel):
+    supplier = models.OneToOneField(Supplier, on_delete=models.CASCADE, related_name='stats')
+    total_products = models.IntegerField(default=0)
+    total_stock = models.IntegerField(default=0)
+    low_stock_products = models.IntegerField(default=0)
+    revenue_generated = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders_pending = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for supplier #{self.supplier_id}"
+
+
+# one row per calendar day with the dashboard totals of everything created that day, filled by `manage.py rollup_daily_sales`
+class DailySalesRollup(BaseModel):
+    day = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_orders = models.PositiveIntegerField(default=0)
+    pending_orders = models.PositiveIntegerField(default=0)
+    delivered_orders = models.PositiveIntegerField(default=0)
+    cancelled_orders = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()  # start of the run that produced this row, used as the watermark for the next incremental run
+
+    def __str__(self):
+        return f"Rollup {self.day} | revenue={self.revenue} | orders={self.total_orders}"
+
+
+# paid sales per supplier per day (bucketed by the order date) so top suppliers can be ranked without touching OrderItem
+class DailySupplierSales(BaseModel):
+    day = models.DateField()
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='daily_sales')
+    total_sales = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'supplier'], name='unique_supplier_sales_per_day'),
+        ]
+
     def __str__(self):
-        return f"Payment for Order #{self.order.id} - {self.status}"
\ No newline at end of file
+        return f"{self.day} | supplier #{self.supplier_id} | {self.total_sales}"
\ No newline at end of file
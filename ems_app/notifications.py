@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, QuerySet
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationCount
+
+# users a broadcast writes per transaction: their notifications (bulk INSERTs) and one counter UPDATE
+BROADCAST_BATCH_SIZE = getattr(settings, 'NOTIFICATION_BROADCAST_BATCH_SIZE', 500)
+
+
+def _add_unread(per_user):
+    # one UPDATE per distinct increment, so a broadcast (everyone +1) is a single one whatever the number of users
+    user_ids_by_increment = defaultdict(list)
+    for user_id, added in per_user.items():
+        user_ids_by_increment[added].append(user_id)
+
+    now = timezone.now()
+    updated = 0
+    for added, user_ids in user_ids_by_increment.items():
+        updated += NotificationCount.objects.filter(user_id__in=user_ids).update(unread=F('unread') + added, updated_at=now)
+    if updated != len(per_user):
+        # first notification of some of them, their counter starts from the real number, which has the new ones already
+        existing = set(NotificationCount.objects.filter(user_id__in=list(per_user)).values_list('user_id', flat=True))
+        rebuild_unread_counts([user_id for user_id in per_user if user_id not in existing])
+
+
+def create_notifications(notifications):
+    """
+    Write many notifications with bulk INSERTs and add them to their users' unread counters, in one transaction.
+    :param notifications: iterable of (user or user id, message)
+    :return: list of the created Notification objects
+    """
+    rows = [Notification(user_id=getattr(user, 'pk', user), message=message) for user, message in notifications]
+    if not rows:
+        return rows
+
+    per_user = defaultdict(int)
+    for row in rows:
+        per_user[row.user_id] += 1
+    with transaction.atomic():
+        Notification.objects.bulk_create(rows)
+        _add_unread(per_user)
+    return rows
+
+
+def broadcast(message, users, batch_size=None):
+    """
+    Send the same notification to many users, BROADCAST_BATCH_SIZE of them at a time.
+    :param users: queryset of users, read as ids in keyset batches and never loaded whole, or an iterable of users / user ids
+    :return: number of notifications created
+    """
+    batch_size = batch_size or BROADCAST_BATCH_SIZE
+    sent = 0
+    for user_ids in _user_id_batches(users, batch_size):
+        sent += len(create_notifications((user_id, message) for user_id in user_ids))
+    return sent
+
+
+def _user_id_batches(users, batch_size):
+    if isinstance(users, QuerySet):
+        after_id = 0
+        while True:
+            user_ids = list(users.filter(pk__gt=after_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                return
+            yield user_ids
+            after_id = user_ids[-1]
+    else:
+        user_ids = [getattr(user, 'pk', user) for user in users]
+        for start in range(0, len(user_ids), batch_size):
+            yield user_ids[start:start + batch_size]
+
+
+def mark_all_read(user):
+    """
+    Mark every unread notification of the user as read with one UPDATE and take them off the counter.
+    :return: number of notifications marked read
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        marked = Notification.objects.filter(user=user, is_read=False).update(is_read=True, updated_at=now)
+        if marked:
+            # relative, a notification that comes in meanwhile stays counted
+            NotificationCount.objects.filter(user=user).update(unread=Greatest(F('unread') - marked, 0), updated_at=now)
+    return marked
+
+
+def unread_count(user):
+    # one row read, the counter of a user that never had one is built from the notifications first
+    count = NotificationCount.objects.filter(user=user).values_list('unread', flat=True).first()
+    if count is None:
+        rebuild_unread_counts([user.pk])
+        count = NotificationCount.objects.filter(user=user).values_list('unread', flat=True).first()
+    return count
+
+
+def count_unread(user_ids=None):
+    """
+    Count the unread notifications from scratch.
+    :param user_ids: restrict to these users, all users with unread notifications when None
+    :return: dict of user id -> unread notifications
+    """
+    unread = Notification.objects.filter(is_read=False)
+    if user_ids is not None:
+        unread = unread.filter(user__in=user_ids)
+    counts = {user_id: 0 for user_id in user_ids or []}
+    counts.update(unread.values('user').annotate(unread=Count('id')).values_list('user', 'unread'))
+    return counts
+
+
+def rebuild_unread_counts(user_ids=None, dry_run=False):
+    """
+    Recompute the stored unread counters and report where they had drifted from the notifications.
+    :return: list of (user_id, stored, actual) for every counter that did not match, stored is None for a missing one
+    """
+    actual = count_unread(user_ids)
+    stored_rows = NotificationCount.objects.all()
+    if user_ids is not None:
+        stored_rows = stored_rows.filter(user__in=user_ids)
+    stored = dict(stored_rows.values_list('user_id', 'unread'))
+
+    drift = []
+    for user_id in sorted(set(actual) | set(stored)):
+        if stored.get(user_id) != actual.get(user_id, 0):
+            drift.append((user_id, stored.get(user_id), actual.get(user_id, 0)))
+
+    if drift and not dry_run:
+        NotificationCount.objects.bulk_create(
+            [NotificationCount(user_id=user_id, unread=unread) for user_id, _, unread in drift],
+            update_conflicts=True, unique_fields=['user'], update_fields=['unread', 'updated_at'],
+        )
+    return drift
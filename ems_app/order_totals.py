@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+CENT = Decimal('0.01')
+
+
+def apply_line_delta(order_id, delta):
+    # called in the same transaction as the line write, the UPDATE is relative so concurrent line changes dont overwrite each other
+    if not delta:
+        return
+    Order.objects.filter(pk=order_id).update(total_amount=F('total_amount') + delta, updated_at=timezone.now())
+
+
+def order_total_drift(order_ids=None):
+    """
+    Compare every order's total_amount with the sum of its line totals.
+    :param order_ids: only check these orders, all orders when None
+    :return: list of (order_id, stored_total, expected_total) for the orders that dont match
+    """
+    lines_total = (
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum('line_total'))
+        .values('total')
+    )
+    orders = Order.objects.annotate(
+        expected_total=Coalesce(Subquery(lines_total), Value(Decimal('0')), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    )
+    if order_ids is not None:
+        orders = orders.filter(pk__in=order_ids)
+
+    drift = []
+    for order_id, stored, expected in orders.values_list('id', 'total_amount', 'expected_total').iterator(chunk_size=2000):
+        # compared in python on cents, sqlite sums decimals as floats
+        if Decimal(stored).quantize(CENT) != Decimal(expected).quantize(CENT):
+            drift.append((order_id, stored, Decimal(expected).quantize(CENT)))
+    return drift
+
+
+def repair_order_totals(order_ids=None, dry_run=False):
+    drift = order_total_drift(order_ids)
+    if not dry_run:
+        with transaction.atomic():
+            for order_id, _, expected in drift:
+                Order.objects.filter(pk=order_id).update(total_amount=expected, updated_at=timezone.now())
+    return drift
@@ -0,0 +1,128 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import observe_email
+from .models import OutboundEmail
+
+# EMAIL_OUTBOX_MAX_ATTEMPTS and EMAIL_OUTBOX_RETRY_BASE_SECONDS are read on every failure, not once at import, so a
+# worker picks up settings overrides
+RETRY_MAX_SECONDS = 6 * 60 * 60
+# a claim older than this belongs to a worker that died mid batch, its rows are handed out again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_email(subject, body, recipient_list, from_email=None):
+    """
+    Queue an email for the outbox worker, this is a single INSERT.
+    :return: the OutboundEmail row
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def enqueue_emails(messages):
+    """
+    Queue many emails with one bulk INSERT.
+    :param messages: iterable of (subject, body, recipient_list) tuples
+    """
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(subject=subject, body=body, from_email=settings.DEFAULT_FROM_EMAIL, recipients=list(recipients))
+        for subject, body, recipients in messages
+    ])
+
+
+def max_attempts():
+    return getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    # exponential backoff: 1, 2, 4, 8 ... minutes, capped
+    base_seconds = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE_SECONDS', 60)
+    return timedelta(seconds=min(base_seconds * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size, worker_id):
+    now = timezone.now()
+    due = Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=now - CLAIM_TIMEOUT)
+    ids = list(OutboundEmail.objects.filter(due).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # the conditional update is what makes the claim safe, a row claimed by another worker in between is skipped
+    OutboundEmail.objects.filter(due, id__in=ids).update(status='sending', claimed_by=worker_id, claimed_at=now, updated_at=now)
+    return list(OutboundEmail.objects.filter(id__in=ids, status='sending', claimed_by=worker_id).order_by('id'))
+
+
+def _record_failure(email, error):
+    now = timezone.now()
+    attempts = email.attempts + 1
+    if attempts >= max_attempts():
+        changes = {'status': 'dead'}
+    else:
+        changes = {'status': 'pending', 'next_attempt_at': now + retry_delay(attempts)}
+
+    OutboundEmail.objects.filter(id=email.id).update(
+        attempts=F('attempts') + 1,
+        last_error=str(error),
+        claimed_by='',
+        claimed_at=None,
+        updated_at=now,
+        **changes,
+    )
+    return changes['status']
+
+
+def deliver_batch(connection, batch_size=100, worker_id=None):
+    """
+    Claim up to batch_size due emails and send them over the given (already open) connection.
+    :return: dict with the number of sent, retried and dead emails
+    """
+    worker_id = worker_id or uuid.uuid4().hex
+    result = {'sent': 0, 'retried': 0, 'dead': 0}
+
+    sent_ids = []
+    for email in claim_batch(batch_size, worker_id):
+        message = EmailMessage(email.subject, email.body, email.from_email, email.recipients, connection=connection)
+        try:
+            with observe_email('send'):
+                message.send(fail_silently=False)
+        except Exception as exc:
+            outcome = _record_failure(email, exc)
+            result['retried' if outcome == 'pending' else 'dead'] += 1
+        else:
+            sent_ids.append(email.id)
+
+    if sent_ids:
+        now = timezone.now()
+        OutboundEmail.objects.filter(id__in=sent_ids).update(
+            status='sent', sent_at=now, attempts=F('attempts') + 1, claimed_by='', claimed_at=None, updated_at=now
+        )
+    result['sent'] = len(sent_ids)
+    return result
+
+
+def drain_outbox(batch_size=100, connection=None):
+    """
+    Send everything that is due, batch after batch, over one SMTP connection.
+    :return: dict with the totals of sent, retried and dead emails
+    """
+    totals = {'sent': 0, 'retried': 0, 'dead': 0}
+    worker_id = uuid.uuid4().hex
+    connection = connection or get_connection()
+
+    with connection:
+        while True:
+            result = deliver_batch(connection, batch_size=batch_size, worker_id=worker_id)
+            for key, value in result.items():
+                totals[key] += value
+            if not any(result.values()):
+                return totals
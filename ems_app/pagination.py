@@ -0,0 +1,162 @@
+import base64
+import binascii
+import json
+from datetime import timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on (created_at, id), newest first. Every page is an index range scan no matter how
+    deep it is and there is no COUNT(*). Clients that still send ?limit=/?offset= (or ?pagination=offset) get the
+    old LimitOffsetPagination response.
+    """
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    offset_query_params = ('limit', 'offset')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def use_offset(self, request):
+        if request.query_params.get('pagination') == 'offset':
+            return True
+        return any(param in request.query_params for param in self.offset_query_params)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def make_cursor(position, reverse=False):
+        created_at, pk = position
+        payload = json.dumps({'t': created_at.isoformat(), 'i': str(pk), 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def encode_cursor(self, position, reverse):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.make_cursor(position, reverse))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            created_at = parse_datetime(payload['t'])
+            if created_at is None:
+                raise ValueError
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at, dt_timezone.utc)
+            # converted here, a pk the filter cant take would otherwise fail later as a 500
+            pk = int(payload['i'])
+            return created_at, pk, bool(payload['r'])
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def position(item):
+        if isinstance(item, dict):
+            return item['created_at'], item['id']
+        return item.created_at, item.pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.offset_paginator = None
+        if self.use_offset(request):
+            return self._offset_page(queryset, request, view)
+        queryset, size, cursor = self._keyset_queryset(queryset, request)
+        return self._keyset_page(list(queryset[:size + 1]), size, cursor)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views, a keyset page is read with the async ORM."""
+        self.request = request
+        self.offset_paginator = None
+        if self.use_offset(request):
+            # the count and the page of LimitOffsetPagination, both queries in one trip to a thread
+            return await sync_to_async(self._offset_page)(queryset, request, view)
+        queryset, size, cursor = self._keyset_queryset(queryset, request)
+        return self._keyset_page([row async for row in queryset[:size + 1]], size, cursor)
+
+    def _offset_page(self, queryset, request, view):
+        self.offset_paginator = LimitOffsetPagination()
+        # same newest first order as the cursors, an unordered LIMIT/OFFSET would page in table order
+        if not queryset.ordered:
+            queryset = queryset.order_by('-created_at', '-id')
+        return self.offset_paginator.paginate_queryset(queryset, request, view)
+
+    def _keyset_queryset(self, queryset, request):
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[2])
+
+        if cursor is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, pk, _ = cursor
+            # the first condition is the index range, the second one only breaks ties on the same timestamp
+            if reverse:
+                queryset = queryset.filter(Q(created_at__gte=created_at), Q(created_at__gt=created_at) | Q(id__gt=pk))
+                queryset = queryset.order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=pk))
+                queryset = queryset.order_by('-created_at', '-id')
+        # one extra row tells whether there is anything beyond this page
+        return queryset, size, cursor
+
+    def _keyset_page(self, rows, size, cursor):
+        reverse = bool(cursor and cursor[2])
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows:
+            if has_more or reverse:
+                self.next_position = self.position(rows[-1])
+            if cursor is not None and (has_more or not reverse):
+                self.previous_position = self.position(rows[0])
+        return rows
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,154 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import User
+
+CACHE_ALIAS = getattr(settings, 'PERMISSION_CACHE_ALIAS', 'permissions')
+
+VERSION_KEY = 'perms:version'
+# bumped by every invalidation, a lookup only stores what it read if this did not change in between
+GENERATION_KEY = 'perms:generation'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # from the clock, same as the catalog version, so an evicted version never reuses an old number
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _key(version, kind, pk):
+    return f'perms:{version}:{kind}:{pk}'
+
+
+def _permission_names(rows):
+    return {f'{app_label}.{codename}' for app_label, codename in rows}
+
+
+def cached_permissions(user):
+    """
+    :return: (user permissions, group permissions) of the user as sets of "app_label.codename". The user's group
+        ids, its own permissions and the permissions of every group are cached separately, a group's entry is shared
+        by all of its members, so the queries only run for whatever is missing from the cache. Entries are dropped by
+        the signals in signals.py, what a lookup read before one of them is not stored (see _store).
+    """
+    cache = _cache()
+    version = _version()
+    groups_key, user_key = _key(version, 'user-groups', user.pk), _key(version, 'user', user.pk)
+    # the generation is read before any query, if an invalidation bumps it meanwhile the queries may have seen the old rows
+    found = cache.get_many([groups_key, user_key, GENERATION_KEY])
+    generation = found.get(GENERATION_KEY)
+    read = {}
+
+    group_ids = found.get(groups_key)
+    if group_ids is None:
+        group_ids = read[groups_key] = sorted(User.groups.through.objects.filter(user_id=user.pk).values_list('group_id', flat=True))
+
+    user_permissions = found.get(user_key)
+    if user_permissions is None:
+        user_permissions = read[user_key] = _permission_names(
+            Permission.objects.filter(user=user.pk).values_list('content_type__app_label', 'codename')
+        )
+
+    group_keys = {_key(version, 'group', group_id): group_id for group_id in group_ids}
+    by_group = {group_keys[key]: permissions for key, permissions in cache.get_many(group_keys).items()}
+    missing = [group_id for group_id in group_ids if group_id not in by_group]
+    if missing:
+        for group_id in missing:
+            by_group[group_id] = set()
+        rows = Permission.objects.filter(group__in=missing).values_list('group', 'content_type__app_label', 'codename')
+        for group_id, app_label, codename in rows:
+            by_group[group_id].add(f'{app_label}.{codename}')
+        read.update({_key(version, 'group', group_id): by_group[group_id] for group_id in missing})
+
+    if read:
+        _store(read, generation)
+    return user_permissions, set().union(*by_group.values())
+
+
+def _store(entries, generation):
+    # an invalidation bumps the generation before it deletes its keys: one that came before the set is seen by the
+    # first check, one whose delete may have run before the set is seen by the second and the entries go again
+    cache = _cache()
+    if cache.get(GENERATION_KEY) != generation:
+        return
+    cache.set_many(entries)
+    if cache.get(GENERATION_KEY) != generation:
+        cache.delete_many(list(entries))
+
+
+def _bump_generation():
+    cache = _cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def _forget(kind, pks):
+    keys = [_key(_version(), kind, pk) for pk in pks]
+
+    def forget():
+        _bump_generation()
+        _cache().delete_many(keys)
+    transaction.on_commit(forget)
+
+
+def forget_user_groups(user_ids):
+    _forget('user-groups', user_ids)
+
+
+def forget_user_permissions(user_ids):
+    _forget('user', user_ids)
+
+
+def forget_group_permissions(group_ids):
+    _forget('group', group_ids)
+
+
+def forget_all_permissions():
+    # for changes that cant be narrowed down to some users or groups, every entry is left behind under the old version
+    def bump():
+        cache = _cache()
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            _version()
+    transaction.on_commit(bump)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend with the permission lookup behind the permissions cache instead of two joined queries per request
+    (per User instance, which is a new one every request). Authentication itself is unchanged. Superusers are
+    left to ModelBackend, there are few of them and they get every permission anyway.
+    """
+
+    def _fill_permission_caches(self, user_obj):
+        user_obj._user_perm_cache, user_obj._group_perm_cache = cached_permissions(user_obj)
+
+    def get_user_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None or user_obj.is_superuser:
+            return super().get_user_permissions(user_obj, obj)
+        if not hasattr(user_obj, '_user_perm_cache'):
+            self._fill_permission_caches(user_obj)
+        return user_obj._user_perm_cache
+
+    def get_group_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None or user_obj.is_superuser:
+            return super().get_group_permissions(user_obj, obj)
+        if not hasattr(user_obj, '_group_perm_cache'):
+            self._fill_permission_caches(user_obj)
+        return user_obj._group_perm_cache
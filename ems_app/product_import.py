@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .catalog_cache import invalidate_catalog
+from .models import Product, ProductCategory
+from .serializers import ProductImportRowSerializer
+from .supplier_stats import product_snapshot, record_product_changes
+
+# rows validated and written together, one SELECT for the chunk's existing skus and one bulk write each way
+IMPORT_CHUNK_SIZE = getattr(settings, 'PRODUCT_IMPORT_CHUNK_SIZE', 500)
+# the report keeps the first errors only, a file of a million bad rows must not turn into a million entries
+IMPORT_MAX_ERRORS = getattr(settings, 'PRODUCT_IMPORT_MAX_ERRORS', 1000)
+# file extension -> format
+IMPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+class ImportFileError(Exception):
+    """
+    The file can't be read as the format it was given as, nothing after the point it failed is imported. report is
+    what import_products had done up to there.
+    """
+    report = None
+
+
+def _csv_rows(text):
+    reader = csv.DictReader(text)
+    for row in reader:
+        # an empty cell is a missing value, so a column can be left empty for the rows it doesnt apply to
+        yield reader.line_num, {field: value for field, value in row.items() if field is not None and value not in ('', None)}
+
+
+def _jsonl_rows(text):
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as exc:
+            yield line_number, ValidationError({'non_field_errors': [f'Not valid JSON: {exc}']})
+
+
+def read_rows(stream, file_format):
+    """
+    The rows of an import file, read as they are needed so only the current chunk is ever in memory.
+    :param stream: the file opened in binary mode, an upload or a file on disk
+    :return: iterator of (line number, row dict), or (line number, ValidationError) for a line that cant be parsed
+    """
+    # utf-8-sig drops the byte order mark spreadsheet programs put in front of an exported csv
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if file_format == 'csv' else None)
+    rows = _csv_rows(text) if file_format == 'csv' else _jsonl_rows(text)
+    try:
+        yield from rows
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ImportFileError(f'The file could not be read as {file_format}: {exc}')
+    finally:
+        text.detach()  # the caller owns the stream, closing the wrapper would close it too
+
+
+def category_map():
+    # every category of the catalog, built once per import, rows name their category and it is looked up here
+    return {name.casefold(): category_id for category_id, name in ProductCategory.objects.values_list('id', 'category_name')}
+
+
+def _write_chunk(supplier, rows):
+    """
+    Create or update the products of one chunk.
+    :param rows: dict of sku -> validated row, one entry per sku
+    :return: (created, updated) counts
+    """
+    existing = {product.sku: product for product in Product.objects.filter(supplier=supplier, sku__in=rows)}
+    now = timezone.now()
+    created, updated, changes = [], [], []
+    fields = {'updated_at'}
+
+    for sku, row in rows.items():
+        values = {('category_id' if field == 'category' else field): value for field, value in row.items() if field != 'sku'}
+        product = existing.get(sku)
+        if product is None:
+            created.append(Product(supplier=supplier, sku=sku, **values))
+            continue
+
+        before = product_snapshot(product)
+        for field, value in values.items():
+            setattr(product, field, value)
+        product.updated_at = now  # bulk_update leaves auto_now alone
+        fields.update(values)
+        # restocked, the next time it runs low the supplier should hear about it straight away (as perform_update does)
+        if product.low_stock_alerted_at and product.stock_quantity >= product.low_stock_threshold:
+            product.low_stock_alerted_at = None
+            fields.add('low_stock_alerted_at')
+        updated.append(product)
+        changes.append((before, product_snapshot(product)))
+
+    with transaction.atomic():
+        Product.objects.bulk_create(created)
+        if updated:
+            Product.objects.bulk_update(updated, sorted(fields))
+        record_product_changes(changes + [(None, product_snapshot(product)) for product in created])
+        if created or updated:
+            invalidate_catalog()
+    return len(created), len(updated)
+
+
+def _write_rows_one_by_one(supplier, rows):
+    """
+    The slow path of a chunk the database refused as a whole, every row in its own transaction.
+    :return: (created, updated) counts and a list of (sku, IntegrityError) of the rows that could not be written
+    """
+    created = updated = 0
+    refused = []
+    for sku, row in rows.items():
+        try:
+            row_created, row_updated = _write_chunk(supplier, {sku: row})
+        except IntegrityError as exc:
+            refused.append((sku, exc))
+            continue
+        created += row_created
+        updated += row_updated
+    return created, updated, refused
+
+
+def import_products(supplier, stream, file_format, chunk_size=None):
+    """
+    Create or update the supplier's products from a csv or json lines file, matched on the supplier's sku. The file is
+    read, validated and written a chunk at a time, each chunk in its own transaction, so memory stays the same however
+    big the file is and a bad row only costs itself. Within a chunk the last row of a sku wins.
+    :param file_format: 'csv' or 'jsonl'
+    :return: report dict: rows, created, updated and failed counts, the first IMPORT_MAX_ERRORS row errors as
+        {'line', 'sku', 'errors'} and whether that list was cut short
+    :raises ImportFileError: when the file stops being readable, the chunks before it stay imported and are in its report
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    report = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    validator = ProductImportRowSerializer(context={'categories': category_map()})
+
+    def fail(line_number, row, detail):
+        report['failed'] += 1
+        if len(report['errors']) >= IMPORT_MAX_ERRORS:
+            report['errors_truncated'] = True
+            return
+        sku = row.get('sku') if isinstance(row, dict) else None
+        report['errors'].append({'line': line_number, 'sku': sku, 'errors': detail})
+
+    rows = read_rows(stream, file_format)
+    while True:
+        try:
+            chunk = list(islice(rows, chunk_size))
+        except ImportFileError as exc:
+            exc.report = report
+            raise
+        if not chunk:
+            return report
+        report['rows'] += len(chunk)
+
+        valid, lines = {}, {}
+        for line_number, row in chunk:
+            if isinstance(row, ValidationError):
+                fail(line_number, None, row.detail)
+                continue
+            try:
+                # one serializer for every row, a new one per row would copy its fields every time
+                data = validator.run_validation(row)
+            except ValidationError as exc:
+                fail(line_number, row, exc.detail)
+                continue
+            valid[data['sku']] = data
+            lines[data['sku']] = line_number
+
+        try:
+            created, updated = _write_chunk(supplier, valid)
+        except IntegrityError:
+            # another import created some of these skus in between, they are updates now
+            try:
+                created, updated = _write_chunk(supplier, valid)
+            except IntegrityError:
+                # not a race then but rows the database refuses, written one at a time so only those fail
+                created, updated, refused = _write_rows_one_by_one(supplier, valid)
+                for sku, exc in refused:
+                    fail(lines[sku], valid[sku], {'non_field_errors': [f'Could not be saved: {exc}']})
+        report['created'] += created
+        report['updated'] += updated
@@ -0,0 +1,75 @@
+from django.db import connections
+from rest_framework.filters import SearchFilter
+
+from .pagination import KeysetPagination
+
+FTS_TABLE = 'ems_app_product_fts'
+
+# bm25 column weights, same order as the fts columns: name, description, category, price
+RANK_EXPRESSION = f'bm25({FTS_TABLE}, 10.0, 1.0, 4.0, 1.0)'
+
+_fts_available = {}
+
+
+def fts_available(alias):
+    # the index is created by migration 0011 and only on sqlite, other databases keep the LIKE based SearchFilter
+    if alias not in _fts_available:
+        connection = connections[alias]
+        _fts_available[alias] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[alias]
+
+
+def fts_match_expression(terms):
+    """
+    Build the MATCH expression: every term has to match (in any column) and the last word of each term matches as a
+    prefix, so "elec kett" finds "Electric kettle". Terms are quoted so user input is never parsed as FTS syntax.
+    """
+    phrases = []
+    for term in terms:
+        if any(char.isalnum() for char in term):
+            phrases.append('"' + term.replace('"', '""') + '"*')
+    return ' '.join(phrases)
+
+
+def search_products(queryset, terms):
+    match = fts_match_expression(terms)
+    if not match:
+        return queryset.none()
+
+    # extra() because the ORM has no way to join the fts virtual table, the MATCH drives the query and every hit is
+    # joined back to its product row by primary key
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = ems_app_product.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'search_rank': RANK_EXPRESSION},
+        order_by=['search_rank', '-id'],
+    )
+
+
+def rebuild_search_index(using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, product_name, product_description, category_name, product_price) "
+            f"SELECT p.id, p.product_name, p.product_description, COALESCE(c.category_name, ''), printf('%.2f', p.product_price) "
+            f"FROM ems_app_product p LEFT JOIN ems_app_productcategory c ON c.id = p.category_id"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+class ProductSearchFilter(SearchFilter):
+    """?search= backed by the FTS5 index with relevance ranking, falls back to DRF's LIKE search elsewhere."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not fts_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, terms)
+
+
+class ProductPagination(KeysetPagination):
+    # search results are ordered by relevance, not by (created_at, id), so those pages use limit/offset
+    offset_query_params = KeysetPagination.offset_query_params + ('search',)
@@ -3,10 +3,85 @@ from rest_framework.serializers import ModelSerializer
 from rest_framework import serializers
 from django.contrib.auth.models import Group
 
+class ImageVariantsField(serializers.Field):
+    """
+    Product.image_variants with absolute urls, the same way product_image is rendered:
+    {"thumbnail": {"webp": {"url", "width", "height", "bytes"}, "jpeg": {...}}, "medium": {...}}, {} while the
+    worker hasnt made them yet.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return self.bind_values_renderer(self.context.get('request'))(value)
+
+    def bind_values_renderer(self, request):
+        # also used by the fast read path (fast_serializers.ValuesRenderer), one converter per page
+        storage = Product._meta.get_field('product_image').storage
+
+        def url(name):
+            location = storage.url(name)
+            return request.build_absolute_uri(location) if request is not None else location
+
+        def convert(variants):
+            return {
+                kind: {
+                    image_format: {'url': url(variant['name']), 'width': variant['width'], 'height': variant['height'], 'bytes': variant['bytes']}
+                    for image_format, variant in formats.items()
+                }
+                for kind, formats in variants.items()
+            }
+        return convert
+
+
+SKU_TAKEN = 'You already have a product with this sku.'
+
+
 class ProductSerializer(ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['low_stock_alerted_at']  # internal bookkeeping of the low stock alerts
+        # the sku is unique per supplier, but the supplier comes from the logged in user, not from the request data
+        validators = []
+
+    def validate_sku(self, value):
+        if not value:
+            return None  # a blank sku is no sku
+        request = self.context.get('request')
+        if request is not None and request.user.user_role == 'supplier':
+            taken = Product.objects.filter(supplier=request.user.supplier, sku=value)
+            if self.instance is not None:
+                taken = taken.exclude(pk=self.instance.pk)
+            if taken.exists():
+                raise serializers.ValidationError(SKU_TAKEN)
+        return value
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """
+    One row of a bulk product import (see ems_app/product_import.py). The category is given by name and looked up in
+    the context's 'categories' map, lowercased name -> id, so validating a row never queries.
+    """
+    sku = serializers.CharField(max_length=64)
+    product_name = serializers.CharField(max_length=255)
+    product_description = serializers.CharField()
+    product_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock_quantity = serializers.IntegerField(min_value=0)
+    low_stock_threshold = serializers.IntegerField(min_value=0, required=False)
+    category = serializers.CharField(max_length=255, required=False, allow_null=True)
+
+    def validate_category(self, value):
+        if value is None:
+            return None
+        category_id = self.context['categories'].get(value.casefold())
+        if category_id is None:
+            raise serializers.ValidationError(f"No category named '{value}'.")
+        return category_id
+
 class UserSerializer(ModelSerializer):
     class Meta:
         model = User
@@ -38,13 +113,45 @@ class OrderSerializer(ModelSerializer):
         model = Order
         fields = '__all__'
         read_only_fields = ['customer','total_amount','status','payment_status']
+
+
+# the statuses an admin moves a placed order between, cart and checkout belong to the customer's own endpoints
+ADMIN_ORDER_STATUSES = ['placed', 'ordered', 'delivered', 'cancelled']
+
+
+class AdminOrderSerializer(OrderSerializer):
+    status = serializers.ChoiceField(choices=ADMIN_ORDER_STATUSES, required=False)
+
+    class Meta(OrderSerializer.Meta):
+        read_only_fields = ['customer','total_amount','payment_status']
         
 class OrderItemSerializer(ModelSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
-        read_only_fields = ['price']
+        read_only_fields = ['price', 'line_total']
         
+# a bulk cart write is capped so one request cant hold the database for too long
+CART_LINES_MAX = 1000
+
+
+class CartLineSerializer(serializers.Serializer):
+    # the product is a plain id here, looking every line's product up one by one is what the bulk endpoint avoids
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class CustomerOrderField(serializers.PrimaryKeyRelatedField):
+    # only the orders of the customer making the request, anyone else's is an unknown pk
+    def get_queryset(self):
+        return Order.objects.filter(customer__user=self.context['request'].user)
+
+
+class BulkCartLinesSerializer(serializers.Serializer):
+    order = CustomerOrderField()
+    lines = CartLineSerializer(many=True, allow_empty=False, max_length=CART_LINES_MAX)
+
+
 class ProductCategorySerializer(ModelSerializer):
     class Meta:
         model = ProductCategory
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .models import Customer, DeliveryPersonnel, Supplier, User
+from .permission_cache import forget_all_permissions, forget_group_permissions, forget_user_groups, forget_user_permissions
+
+M2M_WRITES = ('post_add', 'post_remove', 'post_clear')
+
+
+# the token cache is cleared after commit, clearing it earlier would let a request in between cache the old rows again
+@receiver([post_save, post_delete], sender=Token, dispatch_uid='token_cache_token')
+def forget_cached_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.forget_token(key))
+
+
+@receiver([post_save, post_delete], sender=User, dispatch_uid='token_cache_user')
+def forget_cached_user(sender, instance, **kwargs):
+    user_id = instance.pk  # read now, a deleted instance has its pk set to None before the commit
+    transaction.on_commit(lambda: token_cache.forget_user(user_id))
+
+
+@receiver([post_save, post_delete], sender=Customer, dispatch_uid='token_cache_customer')
+@receiver([post_save, post_delete], sender=Supplier, dispatch_uid='token_cache_supplier')
+@receiver([post_save, post_delete], sender=DeliveryPersonnel, dispatch_uid='token_cache_delivery')
+def forget_cached_profile(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: token_cache.forget_user(user_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid='permission_cache_user_groups')
+def forget_cached_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_WRITES:
+        return
+    if not reverse:
+        forget_user_groups([instance.pk])
+    elif pk_set is not None:
+        forget_user_groups(pk_set)
+    else:
+        forget_all_permissions()  # group.user_set.clear(), the users it had are gone already
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through, dispatch_uid='permission_cache_user_permissions')
+def forget_cached_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_WRITES:
+        return
+    if not reverse:
+        forget_user_permissions([instance.pk])
+    else:
+        forget_all_permissions()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid='permission_cache_group_permissions')
+def forget_cached_group_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_WRITES:
+        return
+    if not reverse:
+        forget_group_permissions([instance.pk])
+    elif pk_set is not None:
+        forget_group_permissions(pk_set)
+    else:
+        forget_all_permissions()
+
+
+# deleting a group, a permission or a content type cascades through the m2m tables without any m2m_changed
+@receiver(post_delete, sender=Group, dispatch_uid='permission_cache_group_delete')
+@receiver([post_save, post_delete], sender=Permission, dispatch_uid='permission_cache_permission')
+@receiver([post_save, post_delete], sender=ContentType, dispatch_uid='permission_cache_content_type')
+def forget_all_cached_permissions(sender, **kwargs):
+    forget_all_permissions()
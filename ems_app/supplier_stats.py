@@ -0,0 +1,201 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import OrderItem, Product, SupplierStats
+
+# an order counts as pending for the supplier once it is paid for and until it gets delivered
+PENDING_ORDER_STATUSES = ['ordered', 'placed']
+
+STAT_FIELDS = ['total_products', 'total_stock', 'low_stock_products', 'revenue_generated', 'orders_pending']
+
+
+def product_snapshot(product):
+    # the part of a product that the supplier stats depend on, taken before and after a write
+    return product.supplier_id, product.stock_quantity, product.low_stock_threshold
+
+
+def _product_contribution(snapshot):
+    supplier_id, stock, threshold = snapshot
+    return supplier_id, {
+        'total_products': 1,
+        'total_stock': stock,
+        'low_stock_products': 1 if stock < threshold else 0,
+    }
+
+
+def _apply_deltas(supplier_id, deltas):
+    deltas = {field: value for field, value in deltas.items() if value}
+    if supplier_id is None or not deltas:
+        return
+
+    updated = SupplierStats.objects.filter(supplier_id=supplier_id).update(
+        updated_at=timezone.now(),
+        **{field: F(field) + value for field, value in deltas.items()},
+    )
+    if not updated:
+        # first write for this supplier, the source tables already hold the change so start from the real numbers
+        rebuild_supplier_stats([supplier_id])
+
+
+def record_product_changes(changes):
+    """
+    Apply stock/product count deltas to the supplier stats.
+    :param changes: iterable of (before, after) product snapshots, None for a created or deleted product
+    """
+    per_supplier = defaultdict(lambda: defaultdict(int))
+    for before, after in changes:
+        if before is not None:
+            supplier_id, contribution = _product_contribution(before)
+            for field, value in contribution.items():
+                per_supplier[supplier_id][field] -= value
+        if after is not None:
+            supplier_id, contribution = _product_contribution(after)
+            for field, value in contribution.items():
+                per_supplier[supplier_id][field] += value
+
+    for supplier_id, deltas in per_supplier.items():
+        _apply_deltas(supplier_id, deltas)
+
+
+def record_product_change(before=None, after=None):
+    record_product_changes([(before, after)])
+
+
+def product_order_lines(product):
+    # what the product's order lines add to its supplier's revenue and pending orders, read before a delete cascades them away
+    return OrderItem.objects.filter(product=product).aggregate(
+        revenue_generated=Sum('line_total', filter=Q(order__payment_status='paid'), default=0),
+        orders_pending=Count('id', filter=Q(order__status__in=PENDING_ORDER_STATUSES)),
+    )
+
+
+def record_product_deleted(snapshot, order_lines):
+    """
+    Take a deleted product and the order lines that went with it off its supplier's stats, one UPDATE.
+    :param order_lines: product_order_lines() of the product
+    """
+    supplier_id, contribution = _product_contribution(snapshot)
+    _apply_deltas(supplier_id, {field: -value for field, value in {**contribution, **order_lines}.items()})
+
+
+def _order_lines_per_supplier(order):
+    return (
+        OrderItem.objects
+        .filter(order=order, product__supplier__isnull=False)
+        .values('product__supplier')
+        .annotate(revenue=Sum('line_total'), lines=Count('id'))
+    )
+
+
+def record_order_paid(order):
+    # the order is now paid and waiting for delivery: revenue goes up and its lines become pending for their suppliers
+    for row in _order_lines_per_supplier(order):
+        _apply_deltas(row['product__supplier'], {'revenue_generated': row['revenue'], 'orders_pending': row['lines']})
+
+
+def record_order_delivered(order):
+    for row in _order_lines_per_supplier(order):
+        _apply_deltas(row['product__supplier'], {'orders_pending': -row['lines']})
+
+
+def order_snapshot(order):
+    # the part of an order that the supplier stats depend on, taken before and after a write
+    return order.status, order.payment_status
+
+
+def _order_weights(snapshot):
+    status, payment_status = snapshot
+    return int(payment_status == 'paid'), int(status in PENDING_ORDER_STATUSES)
+
+
+def record_order_change(order, before, after):
+    """
+    Move the supplier stats along with any change of an order's status or payment status.
+    :param before: order_snapshot() taken before the write, after the one taken after it
+    """
+    (paid_before, pending_before), (paid_after, pending_after) = _order_weights(before), _order_weights(after)
+    if (paid_before, pending_before) == (paid_after, pending_after):
+        return
+    for row in _order_lines_per_supplier(order):
+        _apply_deltas(row['product__supplier'], {
+            'revenue_generated': (paid_after - paid_before) * row['revenue'],
+            'orders_pending': (pending_after - pending_before) * row['lines'],
+        })
+
+
+def compute_supplier_stats(supplier_ids=None):
+    """
+    Compute the supplier stats from scratch out of the source tables.
+    :param supplier_ids: restrict to these suppliers, all suppliers with products or sales when None
+    :return: dict of supplier id -> dict of stat field -> value
+    """
+    products = Product.objects.filter(supplier__isnull=False)
+    items = OrderItem.objects.filter(product__supplier__isnull=False)
+    if supplier_ids is not None:
+        products = products.filter(supplier__in=supplier_ids)
+        items = items.filter(product__supplier__in=supplier_ids)
+
+    stats = defaultdict(lambda: {field: 0 for field in STAT_FIELDS})
+    for supplier_id in supplier_ids or []:
+        stats[supplier_id]
+
+    product_rows = products.values('supplier').annotate(
+        total_products=Count('id'),
+        total_stock=Sum('stock_quantity'),
+        low_stock_products=Count('id', filter=Q(stock_quantity__lt=F('low_stock_threshold'))),
+    )
+    for row in product_rows:
+        supplier_id = row.pop('supplier')
+        stats[supplier_id].update(row)
+
+    item_rows = items.values('product__supplier').annotate(
+        revenue_generated=Sum('line_total', filter=Q(order__payment_status='paid'), default=0),
+        orders_pending=Count('id', filter=Q(order__status__in=PENDING_ORDER_STATUSES)),
+    )
+    for row in item_rows:
+        supplier_id = row.pop('product__supplier')
+        stats[supplier_id].update(row)
+
+    return dict(stats)
+
+
+def rebuild_supplier_stats(supplier_ids=None, dry_run=False):
+    """
+    Recompute the stored supplier stats and report where they had drifted from the source tables.
+    :return: list of (supplier_id, field, stored, actual) for every value that did not match
+    """
+    actual = compute_supplier_stats(supplier_ids)
+    stored_rows = SupplierStats.objects.all()
+    if supplier_ids is not None:
+        stored_rows = stored_rows.filter(supplier__in=supplier_ids)
+    stored = {row.supplier_id: row for row in stored_rows}
+
+    drift = []
+    for supplier_id in sorted(set(actual) | set(stored)):
+        values = actual.get(supplier_id, {field: 0 for field in STAT_FIELDS})
+        row = stored.get(supplier_id)
+        for field in STAT_FIELDS:
+            current = getattr(row, field) if row else 0
+            if current != values[field]:
+                drift.append((supplier_id, field, current, values[field]))
+
+    if not dry_run:
+        with transaction.atomic():
+            for supplier_id, values in actual.items():
+                SupplierStats.objects.update_or_create(supplier_id=supplier_id, defaults=values)
+            # stats of suppliers that no longer have any product or sale
+            SupplierStats.objects.filter(supplier__in=set(stored) - set(actual)).update(
+                updated_at=timezone.now(), **{field: 0 for field in STAT_FIELDS}
+            )
+    return drift
+
+
+def get_supplier_stats(supplier):
+    stats = SupplierStats.objects.filter(supplier=supplier).first()
+    if stats is None:
+        rebuild_supplier_stats([supplier.id])
+        stats = SupplierStats.objects.get(supplier=supplier)
+    return stats
@@ -1,3 +1,1971 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import math
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from .models import Customer, DailySalesRollup, Delivery, DeliveryPersonnel, Notification, NotificationCount, Order, OrderItem, OutboundEmail, Payment, Product, ProductCategory, ProductImageJob, StockReservation, Supplier, User
+from .analytics import admin_dashboard_summary, refresh_daily_rollups
+from .authentication import TokenCache, token_cache
+from .cart import cart_line_products, claim_cart
+from .catalog_cache import CACHE_ALIAS, cache_stats
+from .fast_serializers import FastReadMixin, renderer_for
+from .delivery_assignment import assign_deliveries
+from .image_variants import drain_image_jobs
+from .inventory import available_stock, release_expired_reservations
+from .order_totals import order_total_drift, repair_order_totals
+from . import permission_cache
+from .permission_cache import CACHE_ALIAS as PERMISSION_CACHE_ALIAS, cached_permissions
+from . import product_import
+from .product_import import IMPORT_CHUNK_SIZE
+from .metrics import render_metrics, reset_metrics
+from .notifications import broadcast, rebuild_unread_counts
+from .outbox import deliver_batch, drain_outbox
+from .serializers import OrderSerializer, ProductSerializer, UserSerializer
+from .search import fts_available, rebuild_search_index
+from .supplier_stats import compute_supplier_stats, product_order_lines, rebuild_supplier_stats, record_order_paid
+from .views import OrderViewSet, PaymentViewSet
+from .urls import urlpatterns
+from .utils import create_notification, send_notification_email
 
 # Create your tests here.
+
+# same groups register() puts new users in, with the permissions they have in the real database
+GROUP_PERMISSIONS = {
+    2: ('Supplier', ['add_product', 'change_product', 'delete_product', 'view_product', 'add_productcategory', 'view_productcategory', 'view_notification']),
+    3: ('Customer', ['view_product', 'add_order', 'change_order', 'view_order', 'add_orderitem', 'change_orderitem', 'delete_orderitem', 'view_orderitem', 'add_payment', 'view_notification']),
+    4: ('Delivery personnel', ['view_delivery', 'change_delivery', 'view_notification']),
+}
+ROLE_GROUPS = {'supplier': 2, 'customer': 3, 'delivery': 4}
+
+
+def create_groups():
+    for group_id, (name, codenames) in GROUP_PERMISSIONS.items():
+        group = Group.objects.create(id=group_id, name=name)
+        group.permissions.set(Permission.objects.filter(content_type__app_label='ems_app', codename__in=codenames))
+
+
+def create_user(role, name):
+    user = User.objects.create(email=f'{name}@example.com', username=name, full_name=name.title(), user_role=role)
+    if role in ROLE_GROUPS:
+        user.groups.add(ROLE_GROUPS[role])
+    return user
+
+
+def create_supplier(name='supplier'):
+    return Supplier.objects.create(user=create_user('supplier', name), phone='9800000000', address='Lalitpur')
+
+
+def create_customer(name='customer'):
+    return Customer.objects.create(user=create_user('customer', name), phone='9800000001', address='Kathmandu')
+
+
+def create_product(supplier, stock=10, price='10.00', name='Kettle'):
+    return Product.objects.create(
+        supplier=supplier, product_name=name, product_description='A product', product_price=Decimal(price), stock_quantity=stock,
+    )
+
+
+def create_pending_order(customer, lines):
+    """An order that went through checkout and is waiting for payment, lines are (product, quantity)."""
+    order = Order.objects.create(customer=customer, status='checkout_pending', payment_status='pending', total_amount=0)
+    for product, quantity in lines:
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.product_price)
+    order.total_amount = sum(product.product_price * quantity for product, quantity in lines)
+    order.save()
+    return order
+
+
+def image_upload(name='product.png', size=(64, 48)):
+    content = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+def api_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException('connection refused')
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+
+class OutboxTests(TestCase):
+    def test_send_notification_email_only_queues(self):
+        with self.assertNumQueries(1):
+            send_notification_email('Hello', 'Body', ['a@example.com'])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, 'pending')
+
+    def test_drain_sends_batches_over_one_connection(self):
+        for i in range(5):
+            send_notification_email(f'Subject {i}', 'Body', [f'user{i}@example.com'])
+
+        CountingEmailBackend.opened = 0
+        totals = drain_outbox(batch_size=2, connection=CountingEmailBackend())
+
+        self.assertEqual(totals, {'sent': 5, 'retried': 0, 'dead': 0})
+        self.assertEqual([message.subject for message in mail.outbox], [f'Subject {i}' for i in range(5)])
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertFalse(OutboundEmail.objects.exclude(status='sent').exists())
+
+    def test_failed_send_is_retried_with_backoff_then_dead_lettered(self):
+        send_notification_email('Hello', 'Body', ['a@example.com'])
+        email = OutboundEmail.objects.get()
+
+        result = deliver_batch(FailingEmailBackend())
+        email.refresh_from_db()
+        self.assertEqual(result['retried'], 1)
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('connection refused', email.last_error)
+
+        # not due yet, so the next batch leaves it alone
+        self.assertEqual(deliver_batch(FailingEmailBackend()), {'sent': 0, 'retried': 0, 'dead': 0})
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        # the limit is read when the send fails, an override applies to a worker that is already running
+        with override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2):
+            self.assertEqual(deliver_batch(FailingEmailBackend())['dead'], 1)
+        self.assertEqual(OutboundEmail.objects.get().status, 'dead')
+
+    def test_looping_worker_survives_connection_errors(self):
+        class Stop(Exception):
+            pass
+
+        command = 'ems_app.management.commands.send_queued_emails'
+        results = [OperationalError('database is locked'), SMTPException('connection refused'), {'sent': 1, 'retried': 0, 'dead': 0}, Stop()]
+        out = io.StringIO()
+        with mock.patch(f'{command}.drain_outbox', side_effect=results), mock.patch(f'{command}.time.sleep'), \
+                mock.patch(f'{command}.connections.close_all') as close_all, self.assertLogs(command, 'ERROR') as logs:
+            with self.assertRaises(Stop):
+                call_command('send_queued_emails', loop=True, interval=0, stdout=out)
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(close_all.call_count, 2)
+        self.assertEqual(out.getvalue().strip(), 'sent=1 retried=0 dead=0')
+
+        # without --loop the error is the command's
+        with mock.patch(f'{command}.drain_outbox', side_effect=SMTPException('connection refused')), self.assertRaises(SMTPException):
+            call_command('send_queued_emails')
+
+
+class LowStockAlertTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.kettle = create_product(self.supplier, stock=1)
+        self.toaster = create_product(self.supplier, stock=2, name='Toaster')
+        create_product(self.supplier, stock=50, name='Blender')
+        self.other = create_supplier('other')
+        create_product(self.other, stock=0, name='Mixer')
+
+    def check(self, **data):
+        return self.client.post('/check-stock/', data)
+
+    def test_digest_is_one_email_per_supplier(self):
+        response = self.check(mode='digest')
+
+        self.assertEqual(response.json()['products_alerted'], 3)
+        emails = {email.recipients[0]: email for email in OutboundEmail.objects.all()}
+        self.assertEqual(set(emails), {'supplier@example.com', 'other@example.com'})
+        self.assertIn('2 of your products', emails['supplier@example.com'].body)
+        self.assertIn('Kettle: 1 left', emails['supplier@example.com'].body)
+        self.assertIn('Toaster: 2 left', emails['supplier@example.com'].body)
+        self.assertNotIn('Blender', emails['supplier@example.com'].body)
+        self.assertIn('Mixer: 0 left', emails['other@example.com'].body)
+
+    def test_alerted_products_wait_for_the_realert_window(self):
+        self.assertEqual(self.check().json()['products_alerted'], 3)
+        self.assertEqual(OutboundEmail.objects.count(), 3)
+
+        self.assertIn('already emailed', self.check().json()['detail'])
+        self.assertEqual(OutboundEmail.objects.count(), 3)
+
+        Product.objects.filter(pk=self.kettle.pk).update(low_stock_alerted_at=timezone.now() - timedelta(hours=25))
+        self.assertEqual(self.check().json()['products_alerted'], 1)
+        with override_settings(LOW_STOCK_REALERT_HOURS=0):
+            self.assertEqual(self.check().json()['products_alerted'], 3)
+
+    def test_callers_cant_shorten_the_window(self):
+        self.check()
+        # the endpoint takes no authentication, a window in the request is ignored
+        self.assertIn('already emailed', self.check(realert_hours=0).json()['detail'])
+        self.assertEqual(self.client.post('/check-stock/?realert_hours=0').json().get('products_alerted'), None)
+        self.assertEqual(OutboundEmail.objects.count(), 3)
+
+    def test_alert_leaves_updated_at_alone(self):
+        before = dict(Product.objects.values_list('id', 'updated_at'))
+        self.check()
+        self.assertTrue(Product.objects.filter(pk=self.kettle.pk, low_stock_alerted_at__isnull=False).exists())
+        self.assertEqual(dict(Product.objects.values_list('id', 'updated_at')), before)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_restock_clears_the_alert(self):
+        self.check()
+        response = api_client(self.supplier.user).put(f'/products-set/{self.kettle.id}/', {
+            'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '10.00', 'stock_quantity': 30, 'product_image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.kettle.refresh_from_db()
+        self.toaster.refresh_from_db()
+        self.assertIsNone(self.kettle.low_stock_alerted_at)
+        self.assertIsNotNone(self.toaster.low_stock_alerted_at)
+
+        # run low again, alerted straight away instead of after the window
+        Product.objects.filter(pk=self.kettle.pk).update(stock_quantity=1)
+        self.assertEqual(self.check().json()['products_alerted'], 1)
+
+
+class PaymentStockTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+
+    def test_payment_decrements_all_lines(self):
+        kettle = create_product(self.supplier, stock=5)
+        toaster = create_product(self.supplier, stock=3, name='Toaster')
+        order = create_pending_order(self.customer, [(kettle, 2), (toaster, 3)])
+
+        response = api_client(self.customer.user).post('/payment-set/', {'order': order.id}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        kettle.refresh_from_db()
+        toaster.refresh_from_db()
+        self.assertEqual((kettle.stock_quantity, toaster.stock_quantity), (3, 0))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('placed', 'paid'))
+        self.assertTrue(Delivery.objects.filter(order=order).exists())
+
+    def test_short_line_rolls_back_the_whole_payment(self):
+        kettle = create_product(self.supplier, stock=5)
+        toaster = create_product(self.supplier, stock=1, name='Toaster')
+        order = create_pending_order(self.customer, [(kettle, 2), (toaster, 3)])
+
+        response = api_client(self.customer.user).post('/payment-set/', {'order': order.id}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Toaster', response.data['detail'])
+        kettle.refresh_from_db()
+        self.assertEqual(kettle.stock_quantity, 5)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'checkout_pending')
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(Delivery.objects.exists())
+        self.assertFalse(OutboundEmail.objects.exists())
+
+
+class SupplierStatsTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        self.courier = DeliveryPersonnel.objects.create(user=create_user('delivery', 'courier'), phone='9800000002', address='Bhaktapur')
+        rebuild_supplier_stats()
+
+    def create_product(self, name, stock):
+        response = api_client(self.supplier.user).post('/products-set/', {
+            'product_name': name, 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': stock, 'product_image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return Product.objects.get(pk=response.data['id'])
+
+    def pay(self, lines):
+        order = create_pending_order(self.customer, lines)
+        self.assertEqual(api_client(self.customer.user).post('/payment-set/', {'order': order.id}, format='json').status_code, 201)
+        return order
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_incremental_stats_match_a_rebuild_after_mixed_writes(self):
+        kettle = self.create_product('Kettle', 8)
+        toaster = self.create_product('Toaster', 6)
+        self.pay([(kettle, 2), (toaster, 1)])
+        delivered = self.pay([(kettle, 1)])
+        refunded = self.pay([(toaster, 2)])
+
+        delivery = Delivery.objects.get(order=delivered)
+        Delivery.objects.filter(pk=delivery.pk).update(delivery_personnel=self.courier, delivery_status='assigned')
+        self.assertEqual(api_client(self.courier.user).post(f'/deliveries/{delivery.id}/update-status-delivered/').status_code, 200)
+
+        response = api_client(self.supplier.user).put(f'/products-set/{kettle.id}/', {
+            'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 1, 'product_image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+
+        # a failed payment takes its order's sales off the revenue
+        payment = Payment.objects.get(order=refunded)
+        Payment.objects.filter(pk=payment.pk).update(status='failed')
+        request = APIRequestFactory().patch(f'/payment-set/{payment.pk}/', {}, format='json')
+        force_authenticate(request, self.admin)
+        self.assertEqual(PaymentViewSet.as_view({'patch': 'partial_update'})(request, pk=payment.pk).status_code, 200)
+
+        # an admin cancelling a placed order takes it off the pending orders
+        cancelled = self.pay([(kettle, 1), (toaster, 1)])
+        response = api_client(self.admin).patch(f'/order-set/{cancelled.id}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Order.objects.get(pk=cancelled.pk).status, 'cancelled')
+        self.assertEqual(api_client(self.admin).patch(f'/order-set/{cancelled.id}/', {'status': 'cart'}, format='json').status_code, 400)
+
+        # the toaster's order lines are deleted with it, their sales with them
+        self.assertEqual(api_client(self.supplier.user).delete(f'/products-set/{toaster.id}/').status_code, 204)
+
+        self.assertEqual(rebuild_supplier_stats(dry_run=True), [])
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.product = create_product(self.supplier, stock=5)
+        self.first, self.second = create_customer('first'), create_customer('second')
+
+    def cart(self, customer, quantity):
+        order = Order.objects.create(customer=customer, status='cart', payment_status='pending', total_amount=0)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=self.product.product_price)
+        Order.objects.filter(pk=order.pk).update(total_amount=self.product.product_price * quantity)
+        return order
+
+    def checkout(self, customer, order):
+        return api_client(customer.user).post(f'/order-set/{order.id}/checkout/')
+
+    def test_checkout_holds_the_stock_until_it_expires(self):
+        first_order, second_order = self.cart(self.first, 4), self.cart(self.second, 2)
+        response = self.checkout(self.first, first_order)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('reserved_until', response.data)
+        self.assertEqual(available_stock([self.product.id]), {self.product.id: 1})
+        # a second checkout of the same order reserves nothing more
+        self.assertEqual(self.checkout(self.first, first_order).status_code, 400)
+
+        response = self.checkout(self.second, second_order)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 1, requested: 2', str(response.data))
+        second_order.refresh_from_db()
+        self.assertEqual(second_order.status, 'cart')
+        self.assertEqual(StockReservation.objects.filter(order=second_order).count(), 0)
+
+        StockReservation.objects.filter(order=first_order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.checkout(self.second, second_order).status_code, 200)
+
+    def test_expired_checkout_can_be_checked_out_again(self):
+        first_order, second_order = self.cart(self.first, 4), self.cart(self.second, 2)
+        self.checkout(self.first, first_order)
+        StockReservation.objects.filter(order=first_order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.checkout(self.second, second_order)
+
+        # 3 are left, the order stays waiting for payment with nothing reserved
+        response = self.checkout(self.first, first_order)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 3, requested: 4', str(response.data))
+
+        release_expired_reservations()
+        api_client(self.second.user).post('/payment-set/', {'order': second_order.id}, format='json')
+        self.product.refresh_from_db()
+        self.product.stock_quantity = 10
+        self.product.save(update_fields=['stock_quantity'])
+
+        response = self.checkout(self.first, first_order)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(StockReservation.objects.filter(order=first_order).values_list('quantity', flat=True)), [4])
+        self.assertEqual(available_stock([self.product.id]), {self.product.id: 6})
+        # the payload is the order as the checkout left it
+        first_order.refresh_from_db()
+        self.assertEqual(response.data['order']['status'], 'checkout_pending')
+        self.assertEqual(response.data['order']['updated_at'], OrderSerializer(first_order).data['updated_at'])
+
+        # live again, a second checkout reserves nothing more
+        self.assertEqual(self.checkout(self.first, first_order).status_code, 400)
+
+    def test_payment_turns_the_reservation_into_a_decrement(self):
+        first_order, second_order = self.cart(self.first, 4), self.cart(self.second, 2)
+        self.checkout(self.first, first_order)
+        StockReservation.objects.filter(order=first_order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.checkout(self.second, second_order)
+
+        # the first reservation expired and the second one holds 2 of the 5, the first payment cant take 4 anymore
+        response = api_client(self.first.user).post('/payment-set/', {'order': first_order.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Kettle', response.data['detail'])
+
+        response = api_client(self.second.user).post('/payment-set/', {'order': second_order.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 3)
+        self.assertFalse(StockReservation.objects.filter(order=second_order).exists())
+        self.assertEqual(available_stock([self.product.id]), {self.product.id: 3})
+
+    def test_sweeper_releases_expired_reservations_in_batches(self):
+        orders = [self.cart(self.first, 1) for _ in range(5)]
+        for order in orders:
+            self.checkout(self.first, order)
+        StockReservation.objects.filter(order__in=orders[:3]).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        out = io.StringIO()
+        call_command('release_stock_reservations', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'released=3')
+        self.assertEqual(set(StockReservation.objects.values_list('order_id', flat=True)), {order.id for order in orders[3:]})
+
+
+class DailyRollupTests(TestCase):
+    DAY = date(2026, 3, 10)
+
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.product = create_product(self.supplier)
+
+    def at(self, day_offset, hour):
+        moment = timezone.make_aware(datetime.combine(self.DAY + timedelta(days=day_offset), time(hour)))
+        return mock.patch('django.utils.timezone.now', return_value=moment)
+
+    def order(self, day_offset, hour, status='checkout_pending', paid=False):
+        with self.at(day_offset, hour):
+            order = Order.objects.create(customer=self.customer, status=status, payment_status='paid' if paid else 'pending', total_amount=Decimal('10.00'))
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.product_price)
+            if paid:
+                Payment.objects.create(order=order, customer=self.customer, amount=order.total_amount, status='completed')
+        return order
+
+    def refresh(self, day_offset, hour=12):
+        with self.at(day_offset, hour):
+            refresh_daily_rollups()
+
+    def assertMatchesLiveTotals(self):
+        orders = Order.objects.all()
+        paid_sales = dict(OrderItem.objects.filter(order__payment_status='paid').values_list('product__supplier').annotate(total=Sum('line_total')))
+        summary = admin_dashboard_summary()
+        self.assertEqual(summary['total_orders'], orders.count())
+        self.assertEqual(summary['pending_orders'], orders.filter(status='checkout_pending').count())
+        self.assertEqual(summary['delivered_orders'], orders.filter(status='delivered').count())
+        self.assertEqual(summary['cancelled_orders'], orders.filter(status='cancelled').count())
+        self.assertEqual(summary['total_revenue'], Payment.objects.filter(status='completed').aggregate(total=Sum('amount', default=0))['total'])
+        self.assertEqual({row['supplier_id']: row['total_sales'] for row in summary['top_suppliers']}, paid_sales)
+
+    def test_rollups_and_live_tail_match_the_source_tables_across_runs(self):
+        self.order(-1, 10, paid=True)
+        self.order(0, 10)
+        self.refresh(0)
+        self.assertMatchesLiveTotals()
+
+        # the order of day 0 was created before that run and is not touched again, a later day gets rolled up first
+        self.order(1, 9, paid=True)
+        self.order(2, 15, status='cancelled')
+        self.refresh(3)
+        self.assertEqual(admin_dashboard_summary()['total_orders'], 4)
+        self.assertMatchesLiveTotals()
+
+        # a change to an already rolled up day, and today's orders read live
+        first = Order.objects.order_by('id').first()
+        with self.at(4, 10):
+            first.status = 'delivered'
+            first.save()
+        self.order(5, 8, paid=True)
+        self.refresh(5)
+        self.assertMatchesLiveTotals()
+        self.refresh(5, hour=18)
+        self.assertMatchesLiveTotals()
+
+    def test_every_closed_day_is_rolled_up_to_yesterday(self):
+        self.order(0, 10)
+        self.refresh(0)
+        self.refresh(3)
+        self.assertEqual(list(DailySalesRollup.objects.order_by('day').values_list('day', flat=True)), [self.DAY + timedelta(days=offset) for offset in (-1, 0, 1, 2)])
+        self.assertMatchesLiveTotals()
+
+
+class DeliveryAssignmentTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.customer = create_customer()
+        self.couriers = [
+            DeliveryPersonnel.objects.create(user=create_user('delivery', f'courier{i}'), phone='9800000002', address='Bhaktapur') for i in range(3)
+        ]
+
+    def deliveries(self, count, **fields):
+        orders = Order.objects.bulk_create([Order(customer=self.customer, status='placed', payment_status='paid', total_amount=10) for _ in range(count)])
+        fields = {'delivery_status': 'pending', 'delivery_personnel': None, **fields}
+        return Delivery.objects.bulk_create([Delivery(order=order, **fields) for order in orders])
+
+    def open_loads(self):
+        return [Delivery.objects.filter(delivery_personnel=courier, delivery_status='assigned').count() for courier in self.couriers]
+
+    def test_pending_deliveries_even_out_the_couriers(self):
+        self.deliveries(2, delivery_personnel=self.couriers[0], delivery_status='assigned')
+        self.deliveries(3, delivery_personnel=self.couriers[1], delivery_status='delivered')  # done, not open
+        self.deliveries(7)
+
+        totals = assign_deliveries(batch_size=3)
+
+        self.assertEqual(totals, {'assigned': 7, 'pending': 0, 'couriers': 3})
+        self.assertEqual(self.open_loads(), [3, 3, 3])
+        self.assertFalse(Delivery.objects.filter(delivery_status='pending').exists())
+        # one notification and one email per courier and batch
+        self.assertEqual(Notification.objects.filter(user=self.couriers[0].user).count(), 1)
+        self.assertEqual(Notification.objects.count(), OutboundEmail.objects.count())
+        self.assertEqual(sum(int(message.split()[4]) for message in Notification.objects.values_list('message', flat=True)), 7)
+
+    def test_full_and_inactive_couriers_get_nothing(self):
+        User.objects.filter(pk=self.couriers[2].user_id).update(is_active=False)
+        self.deliveries(1, delivery_personnel=self.couriers[0], delivery_status='assigned')
+        self.deliveries(5)
+
+        out = io.StringIO()
+        call_command('assign_deliveries', max_load=2, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'assigned=3 couriers=2 pending=2')
+        self.assertEqual(self.open_loads(), [2, 2, 0])
+
+    def test_queries_dont_grow_with_the_batch(self):
+        for count in (1, 500):
+            with self.subTest(count=count), transaction.atomic():
+                self.deliveries(count)
+                rebuild_unread_counts([courier.user_id for courier in self.couriers])
+                # the couriers, then per batch: its ids, the UPDATE, the notifications and their unread counters, the emails
+                # (and the savepoints), then the empty read
+                with self.assertNumQueries(11):
+                    self.assertEqual(assign_deliveries(batch_size=1000)['assigned'], count)
+                transaction.set_rollback(True)
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.customer = create_customer()
+        self.client = api_client(self.customer.user)
+
+    def unread(self):
+        return self.client.get('/notification-set/unread-count/').json()['unread']
+
+    def test_unread_count_and_mark_all_read(self):
+        create_notification(self.customer.user, 'Your order is on its way')
+        create_notification(self.customer.user, 'Delivered')
+        self.assertEqual(self.unread(), 2)
+
+        self.assertEqual(self.client.post('/notification-set/mark-all-read/').json(), {'marked_read': 2})
+        self.assertEqual(self.unread(), 0)
+        self.assertEqual(self.client.get('/notification-set/', {'is_read': 'false'}).json()['results'], [])
+        self.assertEqual(self.client.post('/notification-set/mark-all-read/').json(), {'marked_read': 0})
+
+        create_notification(self.customer.user, 'Rate your order')
+        self.assertEqual(self.unread(), 1)
+        self.assertEqual([row['message'] for row in self.client.get('/notification-set/', {'is_read': 'false'}).json()['results']], ['Rate your order'])
+
+    def test_broadcast_queries_dont_grow_with_the_users(self):
+        insert_batch = connection.ops.bulk_batch_size([field.name for field in Notification._meta.concrete_fields if not field.primary_key], [Notification()])
+        for count in (1, 300):
+            with self.subTest(count=count), transaction.atomic():
+                users = User.objects.bulk_create([User(email=f'user{i}@example.com', username=f'user{i}', full_name='User', user_role='supplier') for i in range(count)])
+                rebuild_unread_counts([user.pk for user in users])
+                # the ids, the savepoint, the INSERTs, the counter UPDATE, then the empty read
+                with self.assertNumQueries(5 + math.ceil(count / insert_batch)):
+                    self.assertEqual(broadcast('Sale starts tomorrow', User.objects.filter(user_role='supplier'), batch_size=500), count)
+                self.assertEqual(set(NotificationCount.objects.filter(user__in=users).values_list('unread', flat=True)), {1})
+                transaction.set_rollback(True)
+
+        self.assertEqual(broadcast('Welcome', [self.customer.user], batch_size=1), 1)
+        self.assertEqual(self.unread(), 1)
+
+    def test_rebuild_reports_and_fixes_drift(self):
+        create_notification(self.customer.user, 'Hello')
+        Notification.objects.create(user=self.customer.user, message='Written around the counter')
+
+        out = io.StringIO()
+        call_command('rebuild_notification_counts', stdout=out)
+        self.assertIn(f'user #{self.customer.user.pk}: unread stored=1 actual=2', out.getvalue())
+        self.assertEqual(rebuild_unread_counts(), [])
+        self.assertEqual(self.unread(), 2)
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    """Many customers paying for the last units of the same product at once, against the WAL file database."""
+
+    buyers = 24
+    stock = 10
+
+    def test_concurrent_payments_never_oversell(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        create_groups()
+        product = create_product(create_supplier(), stock=self.stock)
+        orders = [create_pending_order(create_customer(f'buyer{i}'), [(product, 1)]) for i in range(self.buyers)]
+
+        start = threading.Barrier(self.buyers)
+        status_codes = []
+
+        def pay(order):
+            try:
+                client = api_client(order.customer.user)
+                start.wait()
+                response = client.post('/payment-set/', {'order': order.id}, format='json')
+                status_codes.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(sorted(status_codes), [201] * self.stock + [400] * (self.buyers - self.stock))
+        self.assertEqual(Payment.objects.count(), self.stock)
+        self.assertEqual(Order.objects.filter(status='placed').count(), self.stock)
+
+
+class OrderTotalTests(TestCase):
+    def setUp(self):
+        create_groups()
+        supplier = create_supplier()
+        self.customer = create_customer()
+        self.kettle = create_product(supplier, price='12.50')
+        self.toaster = create_product(supplier, price='7.25', name='Toaster')
+        self.client = api_client(self.customer.user)
+        self.order = Order.objects.create(customer=self.customer, status='cart', payment_status='pending', total_amount=0)
+
+    def test_total_follows_line_changes(self):
+        kettle_line = self.client.post('/order-item-set/', {'order': self.order.id, 'product': self.kettle.id, 'quantity': 2}, format='json').data
+        self.client.post('/order-item-set/', {'order': self.order.id, 'product': self.toaster.id, 'quantity': 1}, format='json')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('32.25'))
+
+        self.client.put(f"/order-item-set/{kettle_line['id']}/", {'order': self.order.id, 'product': self.kettle.id, 'quantity': 4}, format='json')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('57.25'))
+
+        self.client.delete(f"/order-item-set/{kettle_line['id']}/")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('7.25'))
+        self.assertEqual(order_total_drift(), [])
+
+    def test_bulk_lines_upsert_the_cart(self):
+        OrderItem.objects.create(order=self.order, product=self.kettle, quantity=1, price=self.kettle.product_price)
+        OrderItem.objects.create(order=self.order, product=self.kettle, quantity=1, price=self.kettle.product_price)
+        Order.objects.filter(pk=self.order.pk).update(total_amount=Decimal('25.00'))
+
+        lines = [{'product': self.kettle.id, 'quantity': 3}, {'product': self.toaster.id, 'quantity': 2}]
+        response = self.client.post('/order-item-set/bulk/', {'order': self.order.id, 'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['order']['total_amount'], '52.00')
+        self.assertEqual(
+            sorted(self.order.items.values_list('product', 'quantity', 'line_total')),
+            sorted([(self.kettle.id, 3, Decimal('37.50')), (self.toaster.id, 2, Decimal('14.50'))]),
+        )
+        self.assertEqual(order_total_drift(), [])
+
+    def test_bulk_lines_report_every_bad_line(self):
+        lines = [
+            {'product': self.kettle.id, 'quantity': 2},
+            {'product': self.toaster.id, 'quantity': 11},
+            {'product': 999999, 'quantity': 1},
+            {'product': self.kettle.id, 'quantity': 1},
+        ]
+        response = self.client.post('/order-item-set/bulk/', {'order': self.order.id, 'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['lines']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['quantity'])
+        self.assertEqual(list(errors[2]), ['product'])
+        self.assertEqual(list(errors[3]), ['product'])
+        # nothing is written when any line is wrong
+        self.assertFalse(self.order.items.exists())
+
+        response = self.client.post('/order-item-set/bulk/', {'order': self.order.id, 'lines': [{'product': self.kettle.id, 'quantity': 0}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.data['lines'][0])
+
+        other_cart = Order.objects.create(customer=create_customer('someone'), status='cart', payment_status='pending', total_amount=0)
+        response = self.client.post('/order-item-set/bulk/', {'order': other_cart.id, 'lines': lines[:1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('order', response.data)
+
+    def test_bulk_lines_check_the_cart_in_their_transaction(self):
+        def checked_out_meanwhile(lines):
+            # the checkout lands between the request's validation and its write
+            Order.objects.filter(pk=self.order.pk).update(status='checkout_pending')
+            return cart_line_products(lines)
+
+        lines = [{'product': self.kettle.id, 'quantity': 1}]
+        with mock.patch('ems_app.views.cart_line_products', side_effect=checked_out_meanwhile):
+            response = self.client.post('/order-item-set/bulk/', {'order': self.order.id, 'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only cart orders can be changed.')
+        self.assertFalse(self.order.items.exists())
+
+    def test_single_lines_check_the_cart_in_their_transaction(self):
+        line = OrderItem.objects.create(order=self.order, product=self.kettle, quantity=1, price=self.kettle.product_price)
+        Order.objects.filter(pk=self.order.pk).update(total_amount=Decimal('12.50'))
+
+        def checked_out_meanwhile(order_id, now=None):
+            # the checkout lands between the request's checks and its write
+            Order.objects.filter(pk=order_id).update(status='checkout_pending')
+            return claim_cart(order_id, now)
+
+        requests = [
+            lambda: self.client.post('/order-item-set/', {'order': self.order.id, 'product': self.toaster.id, 'quantity': 1}, format='json'),
+            lambda: self.client.put(f'/order-item-set/{line.id}/', {'order': self.order.id, 'product': self.kettle.id, 'quantity': 3}, format='json'),
+            lambda: self.client.delete(f'/order-item-set/{line.id}/'),
+        ]
+        for send, status in zip(requests, (400, 400, 403)):
+            Order.objects.filter(pk=self.order.pk).update(status='cart')
+            with mock.patch('ems_app.views.claim_cart', side_effect=checked_out_meanwhile):
+                self.assertEqual(send().status_code, status)
+
+        self.assertEqual(list(self.order.items.values_list('product', 'quantity')), [(self.kettle.id, 1)])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('12.50'))
+
+    def test_repair_fixes_drifted_totals(self):
+        OrderItem.objects.create(order=self.order, product=self.kettle, quantity=3, price=self.kettle.product_price)
+        Order.objects.filter(pk=self.order.pk).update(total_amount=Decimal('1.00'))
+
+        self.assertEqual(repair_order_totals(), [(self.order.id, Decimal('1.00'), Decimal('37.50'))])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('37.50'))
+        self.assertEqual(order_total_drift(), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        self.supplier = create_supplier()
+        self.product = create_product(self.supplier)
+        self.client = api_client(create_customer().user)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first = self.client.get('/products-set/', {'limit': 5})
+        with self.assertNumQueries(0):
+            second = self.client.get('/products-set/', {'limit': 5})
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual((cache_stats()['hits'], cache_stats()['misses']), (1, 1))
+
+    def test_product_write_and_payment_invalidate_the_cache(self):
+        self.client.get(f'/products-set/{self.product.id}/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api_client(self.supplier.user).put(f'/products-set/{self.product.id}/', {
+                'product_name': 'Electric kettle', 'product_description': 'A product', 'product_price': '10.00',
+                'stock_quantity': 10, 'product_image': image_upload(),
+            })
+        self.assertEqual(self.client.get(f'/products-set/{self.product.id}/').json()['product_name'], 'Electric kettle')
+
+        customer = create_customer('buyer')
+        order = create_pending_order(customer, [(self.product, 4)])
+        with self.captureOnCommitCallbacks(execute=True):
+            api_client(customer.user).post('/payment-set/', {'order': order.id}, format='json')
+        self.assertEqual(self.client.get(f'/products-set/{self.product.id}/').json()['stock_quantity'], 6)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.customer = create_customer()
+        Notification.objects.bulk_create([Notification(user=self.customer.user, message=f'message {i}') for i in range(25)])
+        self.client = api_client(self.customer.user)
+        self.newest_first = list(Notification.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_walks_forward_and_back_with_cursors(self):
+        pages = []
+        url = '/notification-set/'
+        while url:
+            page = self.client.get(url).json()
+            pages.append([row['id'] for row in page['results']])
+            url = page['next']
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+        second_page = self.client.get(self.client.get('/notification-set/').json()['next']).json()
+        third_page = self.client.get(second_page['next']).json()
+        back = self.client.get(third_page['previous']).json()
+        self.assertEqual([row['id'] for row in back['results']], pages[1])
+        self.assertEqual([row['id'] for row in self.client.get(back['previous']).json()['results']], pages[0])
+
+    def test_limit_offset_still_available(self):
+        page = self.client.get('/notification-set/', {'limit': 5, 'offset': 20}).json()
+
+        self.assertEqual(page['count'], 25)
+        self.assertEqual([row['id'] for row in page['results']], self.newest_first[20:])
+
+    def test_garbage_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/notification-set/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+        # well formed, but the id isnt one
+        payload = json.dumps({'t': timezone.now().isoformat(), 'i': 'abc', 'r': 0})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        self.assertEqual(self.client.get('/notification-set/', {'cursor': cursor}).status_code, 404)
+
+    def test_cursor_without_offset_is_read_as_utc(self):
+        notification = Notification.objects.create(user=self.customer.user, message='Hello')
+        Notification.objects.filter(pk=notification.pk).update(created_at=datetime(2026, 3, 10, 12, 0, tzinfo=dt_timezone.utc))
+        # one second after it, with the offset left out
+        payload = json.dumps({'t': '2026-03-10T12:00:01', 'i': str(notification.pk + 1), 'r': 0})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        response = self.client.get('/notification-set/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [notification.pk])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        supplier = create_supplier()
+        self.kitchen = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+        self.kettle = create_product(supplier, name='Electric kettle')
+        self.kettle_stand = create_product(supplier, name='Stand', price='3.50')
+        self.toaster = create_product(supplier, name='Toaster')
+        Product.objects.filter(pk=self.kettle_stand.pk).update(product_description='Holds any kettle')
+        Product.objects.filter(pk=self.toaster.pk).update(category=self.kitchen)
+        self.client = api_client(create_customer().user)
+
+    def search(self, text):
+        return [row['id'] for row in self.client.get('/products-set/', {'search': text}).json()['results']]
+
+    def test_prefix_match_ranked_by_relevance(self):
+        # name matches weigh more than description matches
+        self.assertEqual(self.search('kett'), [self.kettle.id, self.kettle_stand.id])
+        self.assertEqual(self.search('elec kett'), [self.kettle.id])
+        self.assertEqual(self.search('3.50'), [self.kettle_stand.id])
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.search('kitchen'), [self.toaster.id])
+
+        ProductCategory.objects.filter(pk=self.kitchen.pk).update(category_name='Appliances')
+        caches[CACHE_ALIAS].clear()
+        self.assertEqual(self.search('kitchen'), [])
+        self.assertEqual(self.search('appliances'), [self.toaster.id])
+
+        self.toaster.delete()
+        caches[CACHE_ALIAS].clear()
+        self.assertEqual(self.search('appliances'), [])
+
+    def test_user_input_is_not_fts_syntax(self):
+        self.assertEqual(self.search('kettle" OR "toaster'), [])
+        self.assertEqual(self.search('***'), [])
+
+    def test_rebuild(self):
+        self.assertEqual(rebuild_search_index(), 3)
+        self.assertEqual(self.search('toast'), [self.toaster.id])
+
+
+# small tables read whole on purpose: one row per category, one (or one per supplier) per day, one per courier
+SCAN_ALLOWED_TABLES = {'ems_app_productcategory', 'ems_app_dailysalesrollup', 'ems_app_dailysuppliersales', 'ems_app_deliverypersonnel'}
+# SCAN is a read of every row, whether of the table or of one of its indexes (USING [COVERING] INDEX without a
+# constraint), SEARCH is a lookup or a range. Virtual tables (the fts index) are left out, their MATCH shows as a SCAN
+FULL_SCAN_PLAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$')
+
+
+def full_table_scans(run, counted=()):
+    """
+    Run EXPLAIN QUERY PLAN on every SELECT run() executes.
+    :param counted: tables run() may count whole through an index, for lists whose total (the offset page's count,
+        the list validators') is over every row of the table
+    :return: list of (table, sql) for every table of this app read whole
+    """
+    with CaptureQueriesContext(connection) as captured:
+        run()
+
+    scans = []
+    for query in captured.captured_queries:
+        if not query['sql'].lstrip().upper().startswith('SELECT'):
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+            plan = [row[-1] for row in cursor.fetchall()]
+        # an index walked in the ORDER BY's own order (no temp b-tree) and stopped by the LIMIT reads one page, not the table
+        paged = ' LIMIT ' in query['sql'] and not any('TEMP B-TREE' in detail for detail in plan)
+        for detail in plan:
+            match = FULL_SCAN_PLAN.match(detail)
+            if not match or not match.group(1).startswith('ems_app_') or match.group(1) in SCAN_ALLOWED_TABLES:
+                continue
+            if match.group(2) and (paged or (match.group(1) in counted and 'COUNT(' in query['sql'])):
+                continue
+            scans.append((match.group(1), query['sql']))
+    return scans
+
+
+class QueryPlanTests(TestCase):
+    """Every read endpoint and dashboard query has to be served from an index, none may scan a whole table."""
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+        self.product = create_product(self.supplier, stock=2)
+
+        paid = create_pending_order(self.customer, [(self.product, 1)])
+        Order.objects.filter(pk=paid.pk).update(status='ordered', payment_status='paid', created_at=timezone.now() - timedelta(days=2))
+        Payment.objects.create(order=paid, customer=self.customer, amount=paid.total_amount, status='completed')
+        self.paid = Order.objects.get(pk=paid.pk)
+
+        cart = Order.objects.create(customer=self.customer, status='cart', payment_status='pending', total_amount=0)
+        self.line = OrderItem.objects.create(order=cart, product=self.product, quantity=1, price=self.product.product_price)
+        Notification.objects.create(user=self.customer.user, message='Hello')
+        refresh_daily_rollups()
+
+    def assertNoFullTableScans(self, run, counted=()):
+        scans = full_table_scans(run, counted)
+        self.assertEqual(scans, [], '\n'.join(f'full scan of {table}: {sql}' for table, sql in scans))
+
+    def test_every_read_endpoint(self):
+        reads = {
+            'product-category-set/': [self.customer.user],
+            'products-set/': [self.customer.user, self.supplier.user],
+            'products-set/<int:pk>/': [self.customer.user, self.supplier.user],
+            'order-set/': [self.customer.user, self.admin],
+            'order-item-set/': [self.customer.user],
+            'order-item-set/<int:pk>/': [self.customer.user],
+            'payment-set/': [self.customer.user, self.admin],
+            'notification-set/': [self.customer.user],
+            'notification-set/unread-count/': [self.customer.user],
+        }
+        # a new read endpoint has to be added above to be checked
+        routes = {str(pattern.pattern) for pattern in urlpatterns if 'get' in getattr(pattern.callback, 'actions', {})}
+        self.assertEqual(routes, set(reads))
+
+        pks = {'products-set/<int:pk>/': self.product.pk, 'order-item-set/<int:pk>/': self.line.pk}
+        # lists of everything in a table, their COUNT (validators, offset pages) has nothing to narrow it down
+        whole = {('products-set/', 'customer'): ['ems_app_product'], ('payment-set/', 'admin'): ['ems_app_payment']}
+        for route, users in reads.items():
+            url = '/' + route.replace('<int:pk>', str(pks.get(route)))
+            for user in users:
+                with self.subTest(url=url, role=user.user_role):
+                    client = api_client(user)
+                    counted = whole.get((route, user.user_role), ())
+                    self.assertNoFullTableScans(lambda: self.assertEqual(client.get(url).status_code, 200), counted)
+                    self.assertNoFullTableScans(lambda: client.get(url, {'limit': 5, 'offset': 0}), counted)
+
+        self.assertNoFullTableScans(lambda: api_client(self.customer.user).get('/products-set/', {'search': 'kett'}))
+
+    def test_dashboards_and_stock_checks(self):
+        self.assertNoFullTableScans(lambda: api_client(self.admin).get('/admin-dashboard-analytics/'))
+        self.assertNoFullTableScans(lambda: api_client(self.supplier.user).get('/supplier-dashboard-analytics/'))
+        self.assertNoFullTableScans(lambda: self.client.post('/check-stock/', {'mode': 'digest'}))
+        self.assertNoFullTableScans(refresh_daily_rollups)
+        self.assertNoFullTableScans(lambda: record_order_paid(self.paid))
+        self.assertNoFullTableScans(lambda: compute_supplier_stats([self.supplier.id]))
+        self.assertNoFullTableScans(lambda: product_order_lines(self.product))
+
+    def test_index_walks_count_as_scans(self):
+        # reading a whole index is still reading every row, only a LIMIT in the index's order stops it early
+        self.assertEqual([table for table, _ in full_table_scans(lambda: list(Product.objects.order_by('updated_at').values_list('id')))], ['ems_app_product'])
+        self.assertEqual(full_table_scans(lambda: list(Product.objects.order_by('updated_at').values_list('id')[:5])), [])
+        self.assertEqual([table for table, _ in full_table_scans(lambda: Product.objects.count())], ['ems_app_product'])
+        self.assertEqual(full_table_scans(lambda: Product.objects.count(), counted=['ems_app_product']), [])
+
+    def test_stock_reservations(self):
+        Order.objects.filter(pk=self.line.order_id).update(total_amount=self.line.line_total)
+        self.assertNoFullTableScans(lambda: api_client(self.customer.user).post(f'/order-set/{self.line.order_id}/checkout/'))
+        self.assertNoFullTableScans(lambda: available_stock([self.product.id]))
+        self.assertNoFullTableScans(release_expired_reservations)
+
+    def test_delivery_assignment(self):
+        DeliveryPersonnel.objects.create(user=create_user('delivery', 'courier'), phone='9800000002', address='Bhaktapur')
+        Delivery.objects.create(order=self.paid, delivery_status='pending')
+        self.assertNoFullTableScans(assign_deliveries)
+
+    def test_notification_counters(self):
+        self.assertNoFullTableScans(lambda: api_client(self.customer.user).post('/notification-set/mark-all-read/'))
+        self.assertNoFullTableScans(lambda: broadcast('Sale starts tomorrow', User.objects.filter(user_role='customer')))
+        self.assertNoFullTableScans(lambda: rebuild_unread_counts([self.customer.user.pk]))
+
+    def test_date_ranged_exports(self):
+        client = api_client(self.admin)
+        since = (timezone.now() - timedelta(days=3)).date().isoformat()
+        for kind in ('orders', 'order-items', 'payments'):
+            with self.subTest(kind=kind):
+                self.assertNoFullTableScans(lambda: b''.join(client.get(f'/exports/{kind}/', {'date_from': since}).streaming_content))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class QueryBudgetTests(TestCase):
+    """Every endpoint in urls.py runs the same number of queries whether the tables hold 1, 10 or 1000 rows."""
+
+    SIZES = (1, 10, 1000)
+
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        self.courier = DeliveryPersonnel.objects.create(user=create_user('delivery', 'courier'), phone='9800000002', address='Bhaktapur')
+        self.category = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+        self.product = create_product(self.supplier, stock=5000)
+        rebuild_supplier_stats()  # the stats row exists in any running system, its very first write is a rebuild
+        fts_available('default')  # checked once per process
+
+    def assertQueryBudget(self, budget, user, seed):
+        """
+        :param budget: number of queries, or a function of the row count where a bulk write has to be split in batches
+        :param user: user the request is made as, loaded fresh every time like the token authentication does, None for anonymous
+        :param seed: called with the row count and the client, fills the tables and returns the request to measure
+        """
+        for rows in self.SIZES:
+            with self.subTest(rows=rows), transaction.atomic():
+                caches[CACHE_ALIAS].clear()
+                caches[PERMISSION_CACHE_ALIAS].clear()
+                if user:
+                    cached_permissions(user)  # measured warm, only the first request of a user after a change fills it
+                client = api_client(User.objects.get(pk=user.pk)) if user else APIClient()
+                request = seed(rows, client)
+                # the biggest sizes take a second or more, the slow request warning they log is no news here
+                with mock.patch('ems_app.metrics.SLOW_REQUEST_SECONDS', math.inf), self.assertNumQueries(budget(rows) if callable(budget) else budget):
+                    response = request()
+                self.assertLess(response.status_code, 300, getattr(response, 'data', response))
+                transaction.set_rollback(True)
+
+    def products(self, rows, **fields):
+        fields = {'stock_quantity': 5000, 'category': self.category, **fields}
+        return Product.objects.bulk_create([
+            Product(supplier=self.supplier, product_name=f'Product {i}', product_description='A product', product_price=Decimal('2.50'), **fields)
+            for i in range(rows)
+        ])
+
+    def order(self, rows, status='cart', payment_status='pending'):
+        """An order of the customer with rows lines, each one for a different product."""
+        order = Order.objects.create(customer=self.customer, status=status, payment_status=payment_status, total_amount=Decimal('2.50') * rows)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=product.product_price, line_total=product.product_price)
+            for product in self.products(rows)
+        ])
+        return order
+
+    def orders(self, rows):
+        return Order.objects.bulk_create([
+            Order(customer=self.customer, status='ordered', payment_status='paid', total_amount=Decimal('2.50')) for _ in range(rows)
+        ])
+
+    def test_categories_and_products(self):
+        def categories(rows, client):
+            ProductCategory.objects.bulk_create([ProductCategory(category_name=f'Category {i}', category_description='-') for i in range(rows)])
+            return lambda: client.get('/product-category-set/')
+        # the reads of these viewsets all start with the query for their ETag / Last-Modified (see conditional.py)
+        self.assertQueryBudget(3, self.customer.user, categories)
+        self.assertQueryBudget(2, self.supplier.user, lambda rows, client: lambda: client.post('/product-category-set/', {'category_name': 'Toys', 'category_description': '-'}))
+
+        def product_list(rows, client):
+            self.products(rows)
+            return lambda: client.get('/products-set/')
+        self.assertQueryBudget(2, self.customer.user, product_list)
+        self.assertQueryBudget(3, self.supplier.user, product_list)
+
+        def search(rows, client):
+            self.products(rows)
+            return lambda: client.get('/products-set/', {'search': 'product'})
+        self.assertQueryBudget(3, self.customer.user, search)
+
+        def product_detail(rows, client):
+            product = self.products(rows)[-1]
+            return lambda: client.get(f'/products-set/{product.id}/')
+        self.assertQueryBudget(2, self.customer.user, product_detail)
+
+        new_product = {'product_name': 'Toaster', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 3}
+
+        def create(rows, client):
+            self.products(rows)
+            return lambda: client.post('/products-set/', {**new_product, 'category': self.category.id, 'product_image': image_upload()})
+        # the insert of the image variants job included
+        self.assertQueryBudget(7, self.supplier.user, create)
+
+        def update(rows, client):
+            product = self.products(rows)[-1]
+            return lambda: client.put(f'/products-set/{product.id}/', {**new_product, 'product_image': image_upload()})
+        self.assertQueryBudget(7, self.supplier.user, update)
+
+        def delete(rows, client):
+            # the product sits on rows lines of old orders, all of them go with it, so do its image jobs and reservations
+            order = self.order(rows, status='delivered', payment_status='paid')
+            OrderItem.objects.filter(order=order).update(product=self.product)
+            return lambda: client.delete(f'/products-set/{self.product.id}/')
+        # one of them sums the sales of those lines, they come off the supplier stats with the product
+        self.assertQueryBudget(10, self.supplier.user, delete)
+
+        def product_import(rows, client):
+            # every other sku is already a product of the supplier, each chunk updates half and creates half
+            Product.objects.bulk_create([
+                Product(supplier=self.supplier, sku=f'S-{i}', product_name='Old', product_description='-', product_price=Decimal('1.00'), stock_quantity=1)
+                for i in range(0, rows, 2)
+            ])
+            content = 'sku,product_name,product_description,product_price,stock_quantity,category\n'
+            content += ''.join(f'S-{i},Product {i},A product,2.50,5000,Kitchen\n' for i in range(rows))
+            return lambda: client.post('/products-set/import/', {'file': SimpleUploadedFile('products.csv', content.encode())})
+        update_fields = ['category_id', 'product_description', 'product_name', 'product_price', 'stock_quantity', 'updated_at']
+        update_batch = connection.ops.bulk_batch_size(['pk', 'pk'] + update_fields, [Product()])
+        insert_batch = connection.ops.bulk_batch_size([field.name for field in Product._meta.concrete_fields if not field.primary_key], [Product()])
+
+        def import_budget(rows):
+            # supplier and category map once, then per chunk: the existing skus, savepoint, the bulk writes, supplier stats, release
+            budget = 2
+            for start in range(0, rows, IMPORT_CHUNK_SIZE):
+                chunk = range(start, min(rows, start + IMPORT_CHUNK_SIZE))
+                existing = len(chunk[::2]) if start % 2 == 0 else len(chunk[1::2])
+                budget += 4 + math.ceil(existing / update_batch) + math.ceil((len(chunk) - existing) / insert_batch)
+            return budget
+        self.assertQueryBudget(import_budget, self.supplier.user, product_import)
+
+    def test_orders_and_cart(self):
+        def order_list(rows, client):
+            self.orders(rows)
+            return lambda: client.get('/order-set/')
+        self.assertQueryBudget(3, self.customer.user, order_list)
+        self.assertQueryBudget(2, self.admin, order_list)
+        self.assertQueryBudget(2, self.customer.user, lambda rows, client: lambda: client.post('/order-set/', {}, format='json'))
+
+        def checkout(rows, client):
+            order = self.order(rows)
+            return lambda: client.post(f'/order-set/{order.id}/checkout/')
+        # one reservation per line, inserted in batches of what fits in sqlite's parameter limit
+        reservation_batch = connection.ops.bulk_batch_size([field.name for field in StockReservation._meta.concrete_fields if not field.primary_key], [StockReservation()])
+        self.assertQueryBudget(lambda rows: 7 + math.ceil(rows / reservation_batch), self.customer.user, checkout)
+
+        def item_list(rows, client):
+            self.order(rows)
+            return lambda: client.get('/order-item-set/')
+        self.assertQueryBudget(3, self.customer.user, item_list)
+
+        def item_detail(rows, client):
+            item = self.order(rows).items.last()
+            return lambda: client.get(f'/order-item-set/{item.id}/')
+        self.assertQueryBudget(2, self.customer.user, item_detail)
+
+        def add_item(rows, client):
+            order = self.order(rows)
+            return lambda: client.post('/order-item-set/', {'order': order.id, 'product': self.product.id, 'quantity': 2}, format='json')
+        self.assertQueryBudget(8, self.customer.user, add_item)  # the cart claim included, as on every line write
+
+        def change_item(rows, client):
+            item = self.order(rows).items.last()
+            return lambda: client.put(f'/order-item-set/{item.id}/', {'order': item.order_id, 'product': self.product.id, 'quantity': 3}, format='json')
+        self.assertQueryBudget(9, self.customer.user, change_item)
+
+        def bulk_lines(rows, client):
+            # half of the lines change lines already in the cart, the other half are new products
+            order = self.order(rows // 2)
+            products = [item.product_id for item in order.items.all()] + [product.id for product in self.products(rows - rows // 2)]
+            lines = [{'product': product_id, 'quantity': 2} for product_id in products]
+            return lambda: client.post('/order-item-set/bulk/', {'order': order.id, 'lines': lines}, format='json')
+        # the changed and the new lines are written in batches of what fits in sqlite's parameter limit, the rest (the cart claim included) is fixed
+        update_batch = connection.ops.bulk_batch_size(['pk', 'pk', 'quantity', 'price', 'line_total', 'updated_at'], [OrderItem()])
+        insert_batch = connection.ops.bulk_batch_size([field.name for field in OrderItem._meta.concrete_fields if not field.primary_key], [OrderItem()])
+        self.assertQueryBudget(lambda rows: 9 + math.ceil(rows // 2 / update_batch) + math.ceil((rows - rows // 2) / insert_batch), self.customer.user, bulk_lines)
+
+        def remove_item(rows, client):
+            item = self.order(rows).items.last()
+            return lambda: client.delete(f'/order-item-set/{item.id}/')
+        self.assertQueryBudget(7, self.customer.user, remove_item)
+
+    def test_payments_and_delivery(self):
+        def payment_list(rows, client):
+            Payment.objects.bulk_create([Payment(order=order, customer=self.customer, amount=order.total_amount, status='completed') for order in self.orders(rows)])
+            return lambda: client.get('/payment-set/')
+        self.assertQueryBudget(2, self.customer.user, payment_list)
+        self.assertQueryBudget(1, self.admin, payment_list)
+
+        def pay(rows, client):
+            order = self.order(rows, status='checkout_pending')
+            return lambda: client.post('/payment-set/', {'order': order.id}, format='json')
+        self.assertQueryBudget(16, self.customer.user, pay)
+
+        def deliver(rows, client):
+            order = self.order(rows, status='placed', payment_status='paid')
+            delivery = Delivery.objects.create(order=order, delivery_personnel=self.courier, delivery_status='assigned')
+            return lambda: client.post(f'/deliveries/{delivery.id}/update-status-delivered/')
+        self.assertQueryBudget(8, self.courier.user, deliver)
+
+    def test_accounts_notifications_and_dashboards(self):
+        def users(rows):
+            User.objects.bulk_create([User(email=f'user{i}@example.com', username=f'user{i}', full_name='User', user_role='customer') for i in range(rows)])
+
+        def register(rows, client):
+            users(rows)
+            return lambda: client.post('/register/', {
+                'email': 'new@example.com', 'username': 'new', 'password': 'secret', 'full_name': 'New', 'user_role': 'customer', 'phone': '1', 'address': 'Pokhara',
+            })
+        # one of them is user.groups.add() checking for an existing row, which it does once m2m_changed has receivers
+        self.assertQueryBudget(9, None, register)
+
+        def login(rows, client):
+            users(rows)
+            return lambda: client.post('/login/', {'email': 'customer@example.com', 'password': 'secret'})
+        self.customer.user.set_password('secret')
+        self.customer.user.save()
+        self.assertQueryBudget(5, None, login)
+
+        self.assertQueryBudget(1, None, lambda rows, client: lambda: client.get('/group-listing/'))
+
+        def notifications(rows, client):
+            Notification.objects.bulk_create([Notification(user=self.customer.user, message=f'message {i}') for i in range(rows)])
+            return lambda: client.get('/notification-set/')
+        self.assertQueryBudget(2, self.customer.user, notifications)
+
+        def unread_count(rows, client):
+            Notification.objects.bulk_create([Notification(user=self.customer.user, message=f'message {i}') for i in range(rows)])
+            rebuild_unread_counts([self.customer.user.pk])
+            return lambda: client.get('/notification-set/unread-count/')
+        self.assertQueryBudget(1, self.customer.user, unread_count)
+
+        def mark_all_read(rows, client):
+            unread_count(rows, client)
+            return lambda: client.post('/notification-set/mark-all-read/')
+        # the notifications UPDATE and the counter UPDATE (and the savepoint)
+        self.assertQueryBudget(4, self.customer.user, mark_all_read)
+
+        def admin_dashboard(rows, client):
+            self.order(rows, status='ordered', payment_status='paid')
+            return lambda: client.get('/admin-dashboard-analytics/')
+        self.assertQueryBudget(6, self.admin, admin_dashboard)
+
+        def supplier_dashboard(rows, client):
+            self.products(rows)
+            return lambda: client.get('/supplier-dashboard-analytics/')
+        self.assertQueryBudget(2, self.supplier.user, supplier_dashboard)
+        self.assertQueryBudget(0, self.admin, lambda rows, client: lambda: client.get('/catalog-cache-stats/'))
+        self.assertQueryBudget(0, self.admin, lambda rows, client: lambda: client.get('/metrics'))
+
+        def export(kind):
+            def seed(rows, client):
+                order = self.order(rows, status='ordered', payment_status='paid')
+                Payment.objects.bulk_create([Payment(order=order, customer=self.customer, amount=order.total_amount, status='completed') for order in [order, *self.orders(rows)]])
+
+                def request():
+                    response = client.get(f'/exports/{kind}/', {'output': 'jsonl', 'gzip': '1'})
+                    b''.join(response.streaming_content)  # the rows are only read while the body is sent
+                    return response
+                return request
+            return seed
+        # one query however many rows, the iterator reads them in chunks from the same cursor
+        for kind in ('orders', 'order-items', 'payments'):
+            self.assertQueryBudget(1, self.admin, export(kind))
+
+        def check_stock(mode):
+            def seed(rows, client):
+                self.products(rows, stock_quantity=1)
+                return lambda: client.post('/check-stock/', {'mode': mode})
+            return seed
+        self.assertQueryBudget(3, None, check_stock('digest'))
+        # one email per product, their single bulk INSERT is only split where SQLite's parameter limit says so
+        fields = [field for field in OutboundEmail._meta.concrete_fields if not field.primary_key]
+        batch = connection.ops.bulk_batch_size(fields, [None] * 1000)
+        self.assertQueryBudget(lambda rows: 2 + math.ceil(rows / batch), None, check_stock('product'))
+
+
+class FastReadTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        kitchen = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+        self.kettle = create_product(supplier, name='Electric kettle', price='1234.50')
+        Product.objects.filter(pk=self.kettle.pk).update(category=kitchen, product_image='products/kettle.png', image_variants={
+            'thumbnail': {'webp': {'name': 'products/variants/kettle-thumbnail.webp', 'width': 200, 'height': 150, 'bytes': 4210}},
+        })
+        create_product(supplier, name='Toaster')  # no category and no image, rendered as nulls
+
+        order = create_pending_order(self.customer, [(self.kettle, 2)])
+        Order.objects.filter(pk=order.pk).update(status='ordered', payment_status='paid')
+        Payment.objects.create(order=order, customer=self.customer, amount=order.total_amount, status='completed', transaction_id='txn-1')
+        Notification.objects.create(user=self.customer.user, message='Your order is on its way')
+
+    def get(self, user, url, params=None):
+        caches[CACHE_ALIAS].clear()
+        response = api_client(user).get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_same_bytes_as_the_serializers(self):
+        customer = self.customer.user
+        requests = [
+            (customer, '/products-set/', None),
+            (customer, '/products-set/', {'limit': 1, 'offset': 1}),
+            (customer, '/products-set/', {'search': 'kett'}),
+            (customer, f'/products-set/{self.kettle.id}/', None),
+            (customer, '/order-set/', None),
+            (self.admin, '/order-set/', {'limit': 5}),
+            (customer, '/payment-set/', None),
+            (customer, '/notification-set/', {'page_size': 1}),
+        ]
+        for user, url, params in requests:
+            with self.subTest(url=url, params=params):
+                fast = self.get(user, url, params)
+                with mock.patch.object(FastReadMixin, 'use_fast_read', return_value=False):
+                    regular = self.get(user, url, params)
+                self.assertEqual(fast, regular)
+
+    def test_only_viewsets_that_opt_in_take_the_fast_path(self):
+        self.assertFalse(FastReadMixin.fast_read)
+        with mock.patch.object(FastReadMixin, 'fast_renderer', autospec=True, side_effect=FastReadMixin.fast_renderer) as fast_renderer:
+            self.get(self.customer.user, '/order-set/')
+            self.assertTrue(fast_renderer.called)
+            fast_renderer.reset_mock()
+            with mock.patch.object(OrderViewSet, 'fast_read', False):
+                self.get(self.customer.user, '/order-set/')
+            self.assertFalse(fast_renderer.called)
+
+    def test_field_map_is_compiled_once(self):
+        self.assertIs(renderer_for(ProductSerializer), renderer_for(ProductSerializer))
+        # many to many fields would need a query per row
+        with self.assertRaises(ImproperlyConfigured):
+            renderer_for(UserSerializer)
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        create_groups()
+        self.customer = create_customer()
+        self.token = Token.objects.create(user=self.customer.user)
+
+    def get(self, path, token=None):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {(token or self.token).key}')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_cached_token_skips_the_token_and_profile_queries(self):
+        first, first_queries = self.get('/order-set/')
+        second, second_queries = self.get('/order-set/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        # the miss is one query for token, user and customer together, the hit needs none of them
+        self.assertEqual(len([sql for sql in first_queries if 'authtoken_token' in sql]), 1)
+        self.assertEqual(len(second_queries), len(first_queries) - 1)
+        self.assertFalse([sql for sql in second_queries if 'authtoken_token' in sql or 'FROM "ems_app_customer"' in sql])
+
+    def test_deleted_token_and_changed_user_are_not_served_from_cache(self):
+        self.assertEqual(self.get('/order-set/')[0].status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.get('/order-set/')[0].status_code, 401)
+
+        token = Token.objects.create(user=self.customer.user)
+        self.assertEqual(self.get('/order-set/', token)[0].status_code, 200)
+        user = User.objects.get(pk=self.customer.user.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.get('/order-set/', token)[0].status_code, 401)
+
+    def test_entries_expire_and_the_least_recently_used_goes_first(self):
+        cache = TokenCache(ttl=60, size=2)
+        tokens = [Token.objects.select_related('user').get(pk=self.token.pk)] + [
+            Token.objects.create(user=create_customer(f'customer{i}').user) for i in range(2)
+        ]
+        cache.set(tokens[0], cache.generation)
+        cache.set(tokens[1], cache.generation)
+        self.assertIsNotNone(cache.get(tokens[0].key))
+        cache.set(tokens[2], cache.generation)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(tokens[1].key))
+        self.assertEqual(cache.get(tokens[0].key).user.customer.id, self.customer.id)
+
+        with mock.patch('ems_app.authentication.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(cache.get(tokens[0].key))
+
+
+class PermissionCacheTests(TestCase):
+    def setUp(self):
+        caches[PERMISSION_CACHE_ALIAS].clear()
+        create_groups()
+        self.customer = create_customer()
+
+    def fresh_user(self):
+        # a new instance like every request gets, so nothing is left in its own _perm_cache
+        return User.objects.get(pk=self.customer.user.pk)
+
+    def test_group_permissions_are_shared_across_requests(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(3):
+            self.assertTrue(user.has_perm('ems_app.add_order'))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('ems_app.add_order'))
+            self.assertFalse(user.has_perm('ems_app.add_product'))
+
+        # another member of the group only needs its own membership and permissions
+        other = User.objects.get(pk=create_customer('other').user.pk)
+        with self.assertNumQueries(2):
+            self.assertTrue(other.has_perm('ems_app.add_order'))
+
+    def test_membership_and_permission_changes_are_seen(self):
+        self.assertTrue(self.fresh_user().has_perm('ems_app.add_order'))
+        customers = Group.objects.get(name='Customer')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customers.permissions.remove(Permission.objects.get(codename='add_order'))
+        self.assertFalse(self.fresh_user().has_perm('ems_app.add_order'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.user.groups.remove(customers)
+        self.assertFalse(self.fresh_user().has_perm('ems_app.view_order'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.user.user_permissions.add(Permission.objects.get(codename='add_product'))
+        self.assertTrue(self.fresh_user().has_perm('ems_app.add_product'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customers.user_set.add(self.customer.user)
+        self.assertTrue(self.fresh_user().has_perm('ems_app.view_order'))
+
+    def test_lookup_that_raced_an_invalidation_is_not_stored(self):
+        customers = Group.objects.get(name='Customer')
+        store = permission_cache._store
+
+        def revoked_meanwhile(entries, generation):
+            # the lookup has read the group's permissions, the revocation commits before it stores them
+            with self.captureOnCommitCallbacks(execute=True):
+                customers.permissions.remove(Permission.objects.get(codename='add_order'))
+            store(entries, generation)
+
+        with mock.patch.object(permission_cache, '_store', side_effect=revoked_meanwhile):
+            self.assertTrue(self.fresh_user().has_perm('ems_app.add_order'))  # what it read, for this request only
+        self.assertFalse(self.fresh_user().has_perm('ems_app.add_order'))
+
+        # an invalidation whose delete ran before the store, only its generation bump comes after the check
+        def forgotten_meanwhile(entries, generation):
+            cache = caches[PERMISSION_CACHE_ALIAS]
+            real_set_many = cache.set_many
+
+            def set_then_bump(*args, **kwargs):
+                real_set_many(*args, **kwargs)
+                permission_cache._bump_generation()
+            with mock.patch.object(cache, 'set_many', side_effect=set_then_bump):
+                store(entries, generation)
+
+        caches[PERMISSION_CACHE_ALIAS].clear()
+        with mock.patch.object(permission_cache, '_store', side_effect=forgotten_meanwhile):
+            self.fresh_user().has_perm('ems_app.view_order')
+        user = self.fresh_user()
+        with self.assertNumQueries(3):  # nothing of the raced lookup was kept
+            self.assertTrue(user.has_perm('ems_app.view_order'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        self.supplier = create_supplier()
+        self.client = api_client(self.supplier.user)
+
+    def process(self):
+        # render_variants is plain Pillow work, a thread pool stands in for the worker's process pool
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return drain_image_jobs(executor=executor)
+
+    def create(self, size):
+        response = self.client.post('/products-set/', {
+            'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 3, 'product_image': image_upload(size=size),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_upload_is_resized_by_the_worker(self):
+        created = self.create((1600, 1200))
+        self.assertEqual(created['image_variants'], {})
+        self.assertEqual(ProductImageJob.objects.filter(product=created['id'], status='pending').count(), 1)
+
+        self.assertEqual(self.process(), {'done': 1, 'skipped': 0, 'retried': 0, 'failed': 0})
+        variants = self.client.get(f"/products-set/{created['id']}/").data['image_variants']
+        self.assertEqual(set(variants), {'thumbnail', 'medium'})
+        self.assertEqual((variants['thumbnail']['jpeg']['width'], variants['thumbnail']['jpeg']['height']), (200, 150))
+        self.assertEqual((variants['medium']['webp']['width'], variants['medium']['webp']['height']), (800, 600))
+
+        stored = Product.objects.get(pk=created['id']).image_variants['medium']['webp']
+        self.assertEqual(variants['medium']['webp']['url'], f"http://testserver/media/{stored['name']}")
+        self.assertEqual(default_storage.size(stored['name']), variants['medium']['webp']['bytes'])
+        self.assertEqual(Image.open(default_storage.path(stored['name'])).format, 'WEBP')
+
+        # smaller than the variant sizes, kept at its own size
+        small = self.create((120, 90))
+        self.process()
+        self.assertEqual(Product.objects.get(pk=small['id']).image_variants['medium']['jpeg']['width'], 120)
+
+    def test_replaced_image_gets_new_variants(self):
+        created = self.create((400, 400))
+        self.process()
+        old = Product.objects.get(pk=created['id']).image_variants['thumbnail']['jpeg']['name']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f"/products-set/{created['id']}/", {
+                'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 3, 'product_image': image_upload(size=(300, 600)),
+            })
+        self.assertEqual(response.data['image_variants'], {})
+        self.assertEqual(self.process()['done'], 1)
+
+        product = Product.objects.get(pk=created['id'])
+        self.assertEqual(product.image_variants['thumbnail']['jpeg']['height'], 200)
+        self.assertFalse(default_storage.exists(old))
+
+    def test_deleted_product_takes_its_variants_along(self):
+        created = self.create((400, 400))
+        self.process()
+        names = [variant['name'] for formats in Product.objects.get(pk=created['id']).image_variants.values() for variant in formats.values()]
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f"/products-set/{created['id']}/").status_code, 204)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_backfill_queues_images_without_variants(self):
+        product = create_product(self.supplier)
+        create_product(self.supplier, name='Toaster')  # no image, nothing to make
+        Product.objects.filter(pk=product.pk).update(product_image=default_storage.save('products/old.png', image_upload()))
+
+        call_command('backfill_image_variants', stdout=io.StringIO())
+        call_command('backfill_image_variants', stdout=io.StringIO())
+        self.assertEqual(ProductImageJob.objects.filter(product=product).count(), 1)
+        self.assertEqual(self.process()['done'], 1)
+        self.assertEqual(set(Product.objects.get(pk=product.pk).image_variants), {'thumbnail', 'medium'})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.product = create_product(self.supplier)
+        self.client = api_client(self.customer.user)
+
+    def test_catalog_validators_are_shared_with_the_cached_page(self):
+        first = self.client.get('/products-set/', {'limit': 5, 'offset': 0})
+        other = api_client(create_customer('other').user)
+        # served from the entry the first customer filled, and the same after it is gone
+        cached = other.get('/products-set/', {'offset': 0, 'limit': 5}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        caches[CACHE_ALIAS].clear()
+        fresh = other.get('/products-set/', {'offset': 0, 'limit': 5})
+        self.assertEqual(fresh['ETag'], first['ETag'])
+
+        # a supplier's pages are its own, and so is their ETag
+        self.assertNotEqual(api_client(self.supplier.user).get('/products-set/', {'limit': 5, 'offset': 0})['ETag'], first['ETag'])
+
+    def test_catalog_revalidation(self):
+        first = self.client.get('/products-set/')
+        self.assertIn('Last-Modified', first)
+
+        # from the catalog cache, validators included
+        with self.assertNumQueries(0):
+            cached = self.client.get('/products-set/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        # without the cache only the validators query runs, the page itself isnt read
+        caches[CACHE_ALIAS].clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/products-set/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/products-set/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get('/products-set/', {'limit': 1}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        detail = self.client.get(f'/products-set/{self.product.id}/')
+        self.assertEqual(self.client.get(f'/products-set/{self.product.id}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api_client(self.supplier.user).put(f'/products-set/{self.product.id}/', {
+                'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '11.00', 'stock_quantity': 10, 'product_image': image_upload(),
+            })
+        changed = self.client.get('/products-set/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(f'/products-set/{self.product.id}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 200)
+
+        categories = self.client.get('/product-category-set/')
+        self.assertEqual(self.client.get('/product-category-set/', HTTP_IF_NONE_MATCH=categories['ETag']).status_code, 304)
+
+    def test_orders_and_notifications(self):
+        orders = [create_pending_order(self.customer, [(self.product, 1)]) for _ in range(2)]
+        first = self.client.get('/order-set/')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/order-set/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # a delete leaves MAX(updated_at) alone, the count is what changes the ETag
+        Order.objects.filter(pk=orders[0].pk).delete()
+        self.assertEqual(self.client.get('/order-set/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        # another customer's list of the same url never matches
+        other = api_client(create_customer('other').user)
+        self.assertEqual(other.get('/order-set/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        Notification.objects.create(user=self.customer.user, message='Your order is on its way')
+        notifications = self.client.get('/notification-set/')
+        self.assertEqual(self.client.get('/notification-set/', HTTP_IF_NONE_MATCH=notifications['ETag']).status_code, 304)
+        Notification.objects.create(user=self.customer.user, message='Delivered')
+        self.assertEqual(self.client.get('/notification-set/', HTTP_IF_NONE_MATCH=notifications['ETag']).status_code, 200)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        caches[PERMISSION_CACHE_ALIAS].clear()
+        create_groups()
+        self.supplier = create_supplier()
+        self.client = api_client(self.supplier.user)
+        self.kitchen = ProductCategory.objects.create(category_name='Kitchen', category_description='Kitchen things')
+
+    def upload(self, content, name='products.csv', **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/products-set/import/', {'file': SimpleUploadedFile(name, content.encode()), **data})
+
+    def test_csv_creates_updates_and_reports_bad_rows(self):
+        content = (
+            'sku,product_name,product_description,product_price,stock_quantity,category\n'
+            'K-1,Kettle,A kettle,20.00,3,kitchen\n'
+            'T-1,Toaster,A toaster,35.50,0,\n'
+            'X-1,Broken,A product,cheap,1,Kitchen\n'
+            'X-2,,A product,1.00,1,Garden\n'
+        )
+        with mock.patch('ems_app.product_import.IMPORT_CHUNK_SIZE', 2):
+            response = self.upload(content)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual({key: response.data[key] for key in ('rows', 'created', 'updated', 'failed')}, {'rows': 4, 'created': 2, 'updated': 0, 'failed': 2})
+        self.assertEqual([(error['line'], error['sku']) for error in response.data['errors']], [(4, 'X-1'), (5, 'X-2')])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'product_name', 'category'})
+
+        kettle = Product.objects.get(supplier=self.supplier, sku='K-1')
+        self.assertEqual((kettle.category_id, kettle.low_stock_threshold), (self.kitchen.id, 5))
+        self.assertIsNone(Product.objects.get(sku='T-1').category_id)
+
+        # matched on the sku, columns left out keep their values
+        Product.objects.filter(pk=kettle.pk).update(low_stock_alerted_at=timezone.now())
+        response = self.upload('{"sku": "K-1", "product_name": "Kettle", "product_description": "A kettle", "product_price": "18.00", "stock_quantity": 40}\n\nnot json\n', name='products.jsonl')
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (0, 1, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        kettle.refresh_from_db()
+        self.assertEqual((kettle.product_price, kettle.stock_quantity, kettle.category_id, kettle.low_stock_threshold), (Decimal('18.00'), 40, self.kitchen.id, 5))
+        self.assertIsNone(kettle.low_stock_alerted_at)
+        self.assertEqual(Product.objects.filter(supplier=self.supplier).count(), 2)
+
+        stats = self.supplier.stats
+        stats.refresh_from_db()
+        self.assertEqual({field: getattr(stats, field) for field in ('total_products', 'total_stock', 'low_stock_products')}, {
+            key: value for key, value in compute_supplier_stats([self.supplier.id])[self.supplier.id].items() if key in ('total_products', 'total_stock', 'low_stock_products')
+        })
+
+    def test_skus_are_per_supplier(self):
+        other = create_supplier('other')
+        Product.objects.filter(pk=create_product(other).pk).update(sku='K-1')
+        self.upload('sku,product_name,product_description,product_price,stock_quantity\nK-1,Kettle,A kettle,20.00,3\n')
+        self.assertEqual(Product.objects.filter(sku='K-1').count(), 2)
+
+        # the single product endpoints keep the sku unique per supplier too
+        response = self.client.post('/products-set/', {
+            'sku': 'K-1', 'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 3, 'product_image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', response.data)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_sku_taken_by_a_concurrent_write_is_a_400(self):
+        Product.objects.filter(pk=create_product(self.supplier).pk).update(sku='K-1')
+        toaster = create_product(self.supplier, name='Toaster')
+        product = {'product_name': 'Kettle', 'product_description': 'A product', 'product_price': '20.00', 'stock_quantity': 3}
+        # the other write lands after validate_sku looked, the unique constraint is what catches it
+        with mock.patch.object(ProductSerializer, 'validate_sku', side_effect=lambda value: value):
+            response = self.client.post('/products-set/', {**product, 'sku': 'K-1', 'product_image': image_upload()})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('sku', response.data)
+
+            response = self.client.put(f'/products-set/{toaster.id}/', {**product, 'sku': 'K-1', 'product_image': image_upload()})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('sku', response.data)
+        self.assertIsNone(Product.objects.get(pk=toaster.pk).sku)
+
+    def test_rows_the_database_refuses_are_row_errors(self):
+        write_chunk = product_import._write_chunk
+
+        def refuse_broken(supplier, rows):
+            if 'X-1' in rows:
+                raise IntegrityError('CHECK constraint failed: stock_quantity')
+            return write_chunk(supplier, rows)
+
+        content = 'sku,product_name,product_description,product_price,stock_quantity\nK-1,Kettle,A kettle,20.00,3\nX-1,Broken,A product,1.00,1\nT-1,Toaster,A toaster,35.50,0\n'
+        with mock.patch('ems_app.product_import._write_chunk', side_effect=refuse_broken):
+            response = self.upload(content)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        self.assertEqual((response.data['errors'][0]['line'], response.data['errors'][0]['sku']), (3, 'X-1'))
+        self.assertEqual(set(Product.objects.filter(supplier=self.supplier).values_list('sku', flat=True)), {'K-1', 'T-1'})
+
+    def test_unreadable_files(self):
+        self.assertEqual(self.upload('sku\nA\n', name='products.txt').status_code, 400)
+        self.assertEqual(api_client(create_customer().user).post('/products-set/import/', {'file': SimpleUploadedFile('p.csv', b'sku\n')}).status_code, 403)
+
+        response = self.client.post('/products-set/import/', {'file': SimpleUploadedFile('products.jsonl', b'{"sku": "\xff"}\n')})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.data)
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as source:
+            for i in range(25):
+                source.write(json.dumps({'sku': f'S-{i}', 'product_name': f'Product {i}', 'product_description': '-', 'product_price': '1.00', 'stock_quantity': i, 'category': 'Kitchen'}) + '\n')
+        stdout = io.StringIO()
+        call_command('import_products', source.name, supplier=self.supplier.id, chunk_size=10, stdout=stdout)
+        self.assertIn('25 row(s): 25 created, 0 updated, 0 failed.', stdout.getvalue())
+        call_command('import_products', source.name, supplier=self.supplier.id, stdout=stdout)
+        self.assertIn('25 row(s): 0 created, 25 updated, 0 failed.', stdout.getvalue())
+        self.assertEqual(Product.objects.filter(supplier=self.supplier, category=self.kitchen).count(), 25)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        self.client = api_client(self.admin)
+        self.product = create_product(self.supplier, stock=50)
+        Product.objects.filter(pk=self.product.pk).update(sku='K-1')
+
+        self.old, self.new = [create_pending_order(self.customer, [(self.product, quantity)]) for quantity in (1, 2)]
+        for order, days in ((self.old, 10), (self.new, 1)):
+            Order.objects.filter(pk=order.pk).update(status='ordered', payment_status='paid', created_at=timezone.now() - timedelta(days=days))
+            payment = Payment.objects.create(order=order, customer=self.customer, amount=order.total_amount, status='completed')
+            Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(days=days))
+        create_pending_order(self.customer, [(self.product, 3)])  # still waiting for payment, not exported
+
+    def download(self, kind, **params):
+        response = self.client.get(f'/exports/{kind}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_with_joined_columns(self):
+        response, content = self.download('order-items')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="order-items-', response['Content-Disposition'])
+
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([row['order_id'] for row in rows], [str(self.old.id), str(self.new.id)])
+        self.assertEqual(
+            {key: rows[1][key] for key in ('customer_email', 'product_sku', 'supplier_name', 'quantity', 'line_total')},
+            {'customer_email': 'customer@example.com', 'product_sku': 'K-1', 'supplier_name': 'Supplier', 'quantity': '2', 'line_total': '20.00'},
+        )
+        self.assertTrue(rows[0]['order_created_at'].endswith('+00:00'))
+
+    def test_date_range_and_gzip(self):
+        since = (timezone.now() - timedelta(days=2)).date().isoformat()
+        response, content = self.download('payments', output='jsonl', gzip='1', date_from=since)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.jsonl.gz"'))
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual([row['order_id'] for row in rows], [self.new.id])
+        self.assertEqual(rows[0]['amount'], '20.00')
+
+        # a date alone as the end takes in that whole day
+        _, content = self.download('orders', date_to=(timezone.now() - timedelta(days=10)).date().isoformat())
+        self.assertEqual([row['id'] for row in csv.DictReader(io.StringIO(content.decode()))], [str(self.old.id)])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/exports/orders/', {'date_from': 'last week'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/orders/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/users/').status_code, 404)
+        self.assertEqual(api_client(self.customer.user).get('/exports/orders/').status_code, 403)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        caches[PERMISSION_CACHE_ALIAS].clear()
+        reset_metrics()
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        self.product = create_product(self.supplier)
+
+    def scrape(self):
+        response = api_client(self.admin).get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_route(self):
+        client = api_client(self.customer.user)
+        client.get(f'/products-set/{self.product.id}/')
+        client.get(f'/products-set/{self.product.id}/')
+        client.get('/products-set/999999/')
+        with self.assertNumQueries(2):
+            client.get('/notification-set/')
+
+        text = self.scrape()
+        # one series for every product id, the route is the pattern
+        self.assertIn('ems_http_requests_total{route="products-set/<int:pk>/",method="GET",status="200"} 2', text)
+        self.assertIn('ems_http_requests_total{route="products-set/<int:pk>/",method="GET",status="404"} 1', text)
+        self.assertIn('ems_http_request_duration_seconds_count{route="products-set/<int:pk>/",method="GET"} 3', text)
+        self.assertIn('ems_http_request_duration_seconds_bucket{route="products-set/<int:pk>/",method="GET",le="+Inf"} 3', text)
+        # the two queries of the notification list fall in the le="2" bucket and not below
+        self.assertIn('ems_http_request_sql_queries_bucket{route="notification-set/",method="GET",le="1"} 0', text)
+        self.assertIn('ems_http_request_sql_queries_bucket{route="notification-set/",method="GET",le="2"} 1', text)
+        self.assertIn('ems_http_request_sql_queries_sum{route="notification-set/",method="GET"} 2', text)
+        self.assertRegex(text, r'ems_http_request_sql_seconds_total\{route="notification-set/",method="GET"\} [0-9.e-]+')
+
+        self.assertEqual(api_client(self.customer.user).get('/metrics').status_code, 403)
+
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with mock.patch('ems_app.metrics.SLOW_REQUEST_SECONDS', 0), self.assertLogs('ems_app.metrics', 'WARNING') as logs:
+            api_client(self.customer.user).get('/order-set/')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('slow request GET /order-set/ (order-set/) 200', logs.output[0])
+        self.assertIn('FROM "ems_app_order"', logs.output[0])
+
+    def test_email_time(self):
+        send_notification_email('Hello', 'Body', ['customer@example.com'])
+        deliver_batch(FailingEmailBackend())
+        text = self.scrape()
+        self.assertIn('ems_email_seconds_count{stage="queue"} 1', text)
+        self.assertIn('ems_email_seconds_count{stage="send"} 1', text)
+        self.assertIn('ems_email_send_failures_total 1', text)
+
+
+class AsyncReadTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        caches[PERMISSION_CACHE_ALIAS].clear()
+        token_cache.clear()
+        reset_metrics()
+        create_groups()
+        self.supplier = create_supplier()
+        self.customer = create_customer()
+        self.admin = User.objects.create(email='admin@example.com', username='admin', full_name='Admin', user_role='admin', is_staff=True, is_superuser=True)
+        self.product = create_product(self.supplier)
+        create_product(create_supplier('other'), name='Toaster')
+        rebuild_supplier_stats()
+        Notification.objects.create(user=self.customer.user, message='Your order is on its way')
+        self.tokens = {user.user_role: Token.objects.create(user=user).key for user in (self.customer.user, self.supplier.user, self.admin)}
+
+    def sync_get(self, path, role=None, **extra):
+        client = APIClient()
+        if role:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[role]}')
+        return client.get(path, **extra)
+
+    async def async_get(self, path, role=None, headers=None, **extra):
+        headers = {**({'Authorization': f'Token {self.tokens[role]}'} if role else {}), **(headers or {})}
+        return await self.async_client.get(f'/async{path}', headers=headers, **extra)
+
+    async def test_reads_match_the_sync_views(self):
+        reads = [
+            ('/products-set/', 'customer', {}), ('/products-set/', 'supplier', {}), ('/products-set/', 'customer', {'limit': 1, 'offset': 1}),
+            ('/products-set/', 'customer', {'search': 'kett'}), (f'/products-set/{self.product.id}/', 'customer', {}),
+            ('/products-set/999999/', 'customer', {}), ('/notification-set/', 'customer', {}), ('/notification-set/unread-count/', 'customer', {}),
+            ('/group-listing/', None, {}),
+            ('/admin-dashboard-analytics/', 'admin', {}), ('/supplier-dashboard-analytics/', 'supplier', {}),
+        ]
+        for path, role, params in reads:
+            with self.subTest(path=path, role=role, params=params):
+                response = await self.async_get(path, role, data=params)
+                # a fresh catalog cache for the sync view, it has to build its page itself
+                caches[CACHE_ALIAS].clear()
+                expected = await sync_to_async(self.sync_get)(path, role, data=params)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+                # the pagination links point at the url that was asked for
+                self.assertEqual(json.loads(response.content.replace(b'/async/', b'/')), json.loads(expected.content))
+                self.assertEqual('ETag' in response, 'ETag' in expected)
+
+    async def test_revalidation_and_catalog_cache(self):
+        first = await self.async_get('/products-set/', 'customer')
+        cached = await self.async_get('/products-set/', 'customer', headers={'If-None-Match': first['ETag']})
+        self.assertEqual((cached.status_code, cached['ETag']), (304, first['ETag']))
+        self.assertEqual((await sync_to_async(cache_stats)())['hits'], 1)
+
+        caches[CACHE_ALIAS].clear()
+        self.assertEqual((await self.async_get('/products-set/', 'customer', headers={'If-None-Match': first['ETag']})).status_code, 304)
+        notifications = await self.async_get('/notification-set/', 'customer')
+        self.assertEqual((await self.async_get('/notification-set/', 'customer', headers={'If-None-Match': notifications['ETag']})).status_code, 304)
+
+    async def test_authentication_and_permissions(self):
+        missing = await self.async_get('/notification-set/')
+        self.assertEqual((missing.status_code, missing['WWW-Authenticate']), (401, 'Token'))
+        self.assertEqual(missing.json(), {'detail': 'Authentication credentials were not provided.'})
+        invalid = await self.async_client.get('/async/group-listing/', headers={'Authorization': 'Token nope'})
+        self.assertEqual((invalid.status_code, invalid.json()), (401, {'detail': 'Invalid token.'}))
+
+        self.assertEqual((await self.async_get('/admin-dashboard-analytics/', 'customer')).status_code, 403)
+        not_supplier = await self.async_get('/supplier-dashboard-analytics/', 'customer')
+        self.assertEqual((not_supplier.status_code, not_supplier.json()), (403, {'detail': 'You are not a supplier.'}))
+        self.assertEqual((await self.async_client.post('/async/products-set/')).status_code, 405)
+
+    async def test_cache_calls_stay_off_the_event_loop(self):
+        threads = []
+
+        def spy(method):
+            def called(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return method(*args, **kwargs)
+            return called
+
+        with mock.patch.object(LocMemCache, 'get', spy(LocMemCache.get)), mock.patch.object(LocMemCache, 'set', spy(LocMemCache.set)), \
+                mock.patch.object(TokenCache, 'get', spy(TokenCache.get)), mock.patch.object(TokenCache, 'set', spy(TokenCache.set)):
+            for _ in range(2):  # a miss of both caches, then a hit
+                self.assertEqual((await self.async_get('/products-set/', 'customer')).status_code, 200)
+
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    async def test_queries_are_counted_in_metrics(self):
+        await sync_to_async(self.sync_get)('/notification-set/', 'customer')  # caches the token
+        await self.async_get('/notification-set/', 'customer')
+        text = await sync_to_async(render_metrics)()
+        # the validators and the page, the token came from the cache
+        self.assertIn('ems_http_request_sql_queries_sum{route="async/notification-set/",method="GET"} 2', text)
+        self.assertIn('ems_http_requests_total{route="async/notification-set/",method="GET",status="200"} 1', text)
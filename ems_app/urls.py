@@ -1,16 +1,23 @@
 
 from django.urls import path,include
-from .views import ProductViewSet, ProductCategoryViewSet,OrderViewSet,OrderItemViewSet,PaymentViewSet
-from .utils import  register, login,check_all_products_for_low_stock,group_id,admin_dashboard_analytics,supplier_dashboard_analytics,update_delivery_as_delivered
+from .views import ProductViewSet, ProductCategoryViewSet,OrderViewSet,OrderItemViewSet,PaymentViewSet,NotificationViewSet
+from . import async_views
+from .utils import  register, login,check_all_products_for_low_stock,group_id,admin_dashboard_analytics,supplier_dashboard_analytics,update_delivery_as_delivered,catalog_cache_statistics,export_data,metrics
 
 urlpatterns = [
     path('product-category-set/',ProductCategoryViewSet.as_view({'get':'list','post':'create'})),
     path('products-set/',ProductViewSet.as_view({'get':'list','post':'create'})),
+    path('products-set/import/',ProductViewSet.as_view({'post':'bulk_import'})),
     path('products-set/<int:pk>/',ProductViewSet.as_view({'get':'retrieve','put':'update','delete':'destroy'})),
     path('order-set/',OrderViewSet.as_view({'get':'list','post':'create'})),
+    path('order-set/<int:pk>/',OrderViewSet.as_view({'put':'update','patch':'partial_update'})),
     path('order-item-set/',OrderItemViewSet.as_view({'get':'list','post':'create'})),
+    path('order-item-set/bulk/',OrderItemViewSet.as_view({'post':'bulk'})),
     path('order-item-set/<int:pk>/',OrderItemViewSet.as_view({'get':'retrieve','put':'update','delete':'destroy'})),
-    path('payment-set/',PaymentViewSet.as_view({'post':'create'})),
+    path('payment-set/',PaymentViewSet.as_view({'get':'list','post':'create'})),
+    path('notification-set/',NotificationViewSet.as_view({'get':'list'})),
+    path('notification-set/unread-count/',NotificationViewSet.as_view({'get':'unread_count'})),
+    path('notification-set/mark-all-read/',NotificationViewSet.as_view({'post':'mark_all_read'})),
     path('order-set/<int:pk>/checkout/', OrderViewSet.as_view({'post': 'checkout'})),
     path('register/',register),
     path('login/',login),
@@ -18,6 +25,17 @@ urlpatterns = [
     path('group-listing/',group_id),
     path('admin-dashboard-analytics/',admin_dashboard_analytics),
     path('supplier-dashboard-analytics/',supplier_dashboard_analytics),
+    path('catalog-cache-stats/',catalog_cache_statistics),
+    path('exports/<str:kind>/',export_data),
+    path('metrics',metrics),
     path('deliveries/<int:delivery_pk>/update-status-delivered/', update_delivery_as_delivered),
+    # async versions of the read heavy endpoints, for ASGI (ems_app/async_views.py)
+    path('async/products-set/',async_views.product_list),
+    path('async/products-set/<int:pk>/',async_views.product_detail),
+    path('async/notification-set/',async_views.notification_list),
+    path('async/notification-set/unread-count/',async_views.notification_unread_count),
+    path('async/group-listing/',async_views.group_listing),
+    path('async/admin-dashboard-analytics/',async_views.admin_dashboard_analytics),
+    path('async/supplier-dashboard-analytics/',async_views.supplier_dashboard_analytics),
 
 ]
\ No newline at end of file
@@ -1,4 +1,3 @@
-from django.core.mail import send_mail
 from django.conf import settings
 from .models import Product
 from rest_framework.response import Response
@@ -14,6 +13,18 @@ from rest_framework.permissions import IsAdminUser,IsAuthenticated,AllowAny
 from django.contrib.auth.models import Group
 from django.utils import timezone
 from rest_framework.exceptions import PermissionDenied
+from .analytics import admin_dashboard_summary
+from .outbox import enqueue_email, enqueue_emails
+from .catalog_cache import cache_stats
+from .exports import EXPORT_OUTPUTS, EXPORTS, export_response, parse_bound
+from .metrics import observe_email, render_metrics
+from .notifications import create_notifications
+from django.http import HttpResponse
+from django.db.models import F, Q
+from datetime import timedelta
+from itertools import groupby
+from .supplier_stats import get_supplier_stats, record_order_delivered, PENDING_ORDER_STATUSES
+from django.db import transaction
 
 
 
@@ -103,156 +114,160 @@ def login(request):
 
 def send_notification_email(subject, body, recipient_list):
     """
-    Send an email notification.
+    Queue an email notification, it is delivered by `manage.py send_queued_emails` so the request never waits on SMTP.
     :param subject: Email subject
     :param body: Email body
     :param recipient_list: List of recipient email addresses
     """
-    send_mail(
-        subject,
-        body,
-        settings.DEFAULT_FROM_EMAIL,
-        recipient_list,
-        fail_silently=False  # Use True to prevent exceptions, but False is better for debugging
-    )
+    with observe_email('queue'):
+        enqueue_email(subject, body, recipient_list)
     
+def low_stock_realert_hours():
+    # read when the check runs, not at import, so a settings change (or override_settings) is picked up
+    return getattr(settings, 'LOW_STOCK_REALERT_HOURS', 24)
+
+
+def products_due_for_low_stock_alert(realert_hours=None):
+    # one joined query for the products and their supplier users, skipping the ones alerted within the last realert_hours
+    if realert_hours is None:
+        realert_hours = low_stock_realert_hours()
+    cutoff = timezone.now() - timedelta(hours=realert_hours)
+    return (
+        Product.objects
+        .filter(stock_quantity__lt=F('low_stock_threshold'), supplier__isnull=False)
+        .filter(Q(low_stock_alerted_at__isnull=True) | Q(low_stock_alerted_at__lt=cutoff))
+        .select_related('supplier__user')
+        .order_by('supplier_id', 'id')
+    )
+
+
+def low_stock_message(product):
+    # (subject, body, recipients) of the alert for one product, supplier__user has to be selected with it
+    subject = f"Low Stock Alert: {product.product_name}"
+    body = (
+        f"Dear {product.supplier.user.full_name},\n\n"
+        f"The stock for '{product.product_name}' is low.\n"
+        f"Remaining quantity: {product.stock_quantity}.\n"
+        f"Please restock soon.\n\n"
+        f"- Aryush Ecom"
+    )
+    return subject, body, [product.supplier.user.email]
+
+
 def low_stock_emailing(product):
-    if product.stock_quantity < 5:  # double check
-        supplier_email = product.supplier.user.email
-        subject = f"Low Stock Alert: {product.product_name}"
+    if product.stock_quantity < product.low_stock_threshold:  # double check
+        send_notification_email(*low_stock_message(product))
+
+
+def low_stock_digest_emailing(products):
+    """
+    Send one summary email per supplier instead of one email per product.
+    :param products: low stock products with supplier__user selected, ordered by supplier
+    """
+    messages = []
+    for supplier, supplier_products in groupby(products, key=lambda product: product.supplier):
+        supplier_products = list(supplier_products)
+        lines = "".join(
+            f"  - {product.product_name}: {product.stock_quantity} left (alert below {product.low_stock_threshold})\n"
+            for product in supplier_products
+        )
         body = (
-            f"Dear {product.supplier.user.full_name},\n\n"
-            f"The stock for '{product.product_name}' is low.\n"
-            f"Remaining quantity: {product.stock_quantity}.\n"
+            f"Dear {supplier.user.full_name},\n\n"
+            f"The stock for {len(supplier_products)} of your products is low:\n"
+            f"{lines}\n"
             f"Please restock soon.\n\n"
             f"- Aryush Ecom"
         )
-        send_notification_email(subject, body, [supplier_email])
-        
+        messages.append((f"Low Stock Alert: {len(supplier_products)} product(s)", body, [supplier.user.email]))
+
+    # one INSERT for all the digests, the outbox worker sends them over a single connection
+    enqueue_emails(messages)
+
+
 @csrf_exempt
 def check_all_products_for_low_stock(request):
     if request.method == "POST":
-        low_stock_products = Product.objects.filter(stock_quantity__lt=5)
-        for product in low_stock_products:
-            low_stock_emailing(product)
-
-        if low_stock_products.exists():
-            return JsonResponse({'detail': 'Low stocks found and emailed'})
+        # mode=digest sends one summary per supplier, the default stays one email per product
+        mode = request.POST.get('mode') or request.GET.get('mode', 'product')
+        # the window is the settings' only, anyone can call this endpoint and must not be able to shorten it
+        realert_hours = low_stock_realert_hours()
+
+        low_stock_products = list(products_due_for_low_stock_alert(realert_hours))
+        if mode == 'digest':
+            low_stock_digest_emailing(low_stock_products)
+        else:
+            # still one email per product, queued with a single INSERT
+            enqueue_emails([low_stock_message(product) for product in low_stock_products])
+
+        if low_stock_products:
+            # updated_at stays, an alert is not a change of the product (its ETag and the cached catalog pages)
+            Product.objects.filter(id__in=[product.id for product in low_stock_products]).update(low_stock_alerted_at=timezone.now())
+            return JsonResponse({'detail': 'Low stocks found and emailed', 'products_alerted': len(low_stock_products)})
+        elif Product.objects.filter(stock_quantity__lt=F('low_stock_threshold')).exists():
+            return JsonResponse({'detail': f'Low stocks were already emailed within the last {realert_hours} hours.'})
         else:
             return JsonResponse({'detail': 'All stocks are up to date!'})
 
 def create_notification(user, message):
-    Notification.objects.create(user=user, message=message)
+    create_notifications([(user, message)])
 
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def admin_dashboard_analytics(request):
-    # Calculate total revenue from completed payments
-    completed_payments = Payment.objects.filter(status='completed')
-    total_revenue = 0
-    for payment in completed_payments:
-        total_revenue += payment.amount
-
-    # Calculate order counts
-    all_orders = Order.objects.all()
-    total_orders = 0
-    pending_orders = 0
-    delivered_orders = 0
-    cancelled_orders = 0
-
-    for order in all_orders:
-        total_orders += 1
-        if order.status == 'checkout_pending':
-            pending_orders += 1
-        elif order.status == 'delivered':
-            delivered_orders += 1
-        elif order.status == 'cancelled':
-            cancelled_orders += 1
-
-    # Calculate top suppliers
-    supplier_sales = {}  # Dictionary to store total sales for each supplier
-
-    order_items = OrderItem.objects.all()
-    for item in order_items:
-        if item.product and item.product.supplier:
-            supplier = item.product.supplier
-            supplier_id = supplier.id
-            supplier_name = supplier.user.full_name
-            item_sales = item.price * item.quantity
-
-            if supplier_id not in supplier_sales:
-                supplier_sales[supplier_id] = {
-                    'supplier_id': supplier_id,
-                    'supplier_name': supplier_name,
-                    'total_sales': 0
-                }
-
-            supplier_sales[supplier_id]['total_sales'] += item_sales
-
-    def get_total_sales(supplier):
-        return supplier['total_sales']
-    # Convert to list and sort by total sales
-    top_suppliers_list = list(supplier_sales.values())
-
-    top_suppliers_list.sort(key=get_total_sales, reverse=True)
-
-    top_suppliers = top_suppliers_list[:5]  # Get top 5
-
-    return Response({
-        'total_revenue': total_revenue,
-        'total_orders': total_orders,
-        'pending_orders': pending_orders,
-        'delivered_orders': delivered_orders,
-        'cancelled_orders': cancelled_orders,
-        'top_suppliers': top_suppliers,
-    })
+    # revenue, order counts and top suppliers come from the daily rollups (see ems_app/analytics.py)
+    return Response(admin_dashboard_summary())
     
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def supplier_dashboard_analytics(request):
-    user = request.user
+@permission_classes([IsAdminUser])
+def export_data(request, kind):
+    # ?output=csv|jsonl, ?date_from= / ?date_to= (dates or datetimes, both ends included), ?gzip=1, streamed as it is read
+    if kind not in EXPORTS:
+        return Response({'detail': f"Nothing to export called '{kind}', use one of: {', '.join(EXPORTS)}."}, status=404)
+    output = request.query_params.get('output', 'csv')
+    if output not in EXPORT_OUTPUTS:
+        return Response({'detail': f"output has to be one of: {', '.join(EXPORT_OUTPUTS)}."}, status=400)
+    try:
+        start = parse_bound(request.query_params.get('date_from'))
+        end = parse_bound(request.query_params.get('date_to'), end=True)
+    except ValueError as exc:
+        return Response({'detail': str(exc)}, status=400)
+    gzip = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    return export_response(kind, output=output, start=start, end=end, gzip=gzip)
 
-    # Check if user is a supplier
-    if user.user_role != 'supplier':
-        return Response({'detail': 'You are not a supplier.'}, status=403)
 
-    supplier = user.supplier
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    # Prometheus scrape target, its scrape config authenticates with an admin token (authorization: type: Token)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    # Total products
-    products = Product.objects.filter(supplier=supplier)
-    total_products = 0
-    total_stock = 0
-    low_stock_products = 0
 
-    for product in products:
-        total_products += 1
-        total_stock += product.stock_quantity
-        if product.stock_quantity < 5:
-            low_stock_products += 1
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalog_cache_statistics(request):
+    # hit/miss counters of the product catalog cache
+    return Response(cache_stats())
 
-    # Calculate revenue generated
-    order_items = OrderItem.objects.filter(product__supplier=supplier, order__payment_status='paid')
-    revenue_generated = 0
 
-    for item in order_items:
-        item_total = item.price * item.quantity
-        revenue_generated += item_total
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def supplier_dashboard_analytics(request):
+    user = request.user
 
-    # Orders pending
-    pending_order_items = OrderItem.objects.filter(product__supplier=supplier, order__status='ordered')
-    orders_pending = 0
+    # Check if user is a supplier
+    if user.user_role != 'supplier':
+        return Response({'detail': 'You are not a supplier.'}, status=403)
 
-    for item in pending_order_items:
-        orders_pending += 1
+    # single row read, the numbers are maintained by the product, payment and delivery write paths
+    stats = get_supplier_stats(user.supplier)
 
-    # Return the analytics data
     return Response({
-        'total_products': total_products,
-        'total_stock': total_stock,
-        'low_stock_products': low_stock_products,
-        'revenue_generated': revenue_generated,
-        'orders_pending': orders_pending,
+        'total_products': stats.total_products,
+        'total_stock': stats.total_stock,
+        'low_stock_products': stats.low_stock_products,
+        'revenue_generated': stats.revenue_generated,
+        'orders_pending': stats.orders_pending,
     })
     
 @api_view(['GET'])
@@ -270,22 +285,29 @@ def update_delivery_as_delivered(request, delivery_pk):
     user = request.user
 
     try:
-        delivery = Delivery.objects.get(id=delivery_pk)
+        # everything the checks and the email below read comes in with this one query
+        delivery = Delivery.objects.select_related('delivery_personnel', 'order__customer__user').get(id=delivery_pk)
     except Delivery.DoesNotExist:
         return Response({'detail': 'Delivery not found.'})
 
     # Ensure only assigned personnel can update
-    if delivery.delivery_personnel is None or delivery.delivery_personnel.user != user:
+    if delivery.delivery_personnel is None or delivery.delivery_personnel.user_id != user.id:
         raise PermissionDenied('You are not assigned to this delivery.')
 
-    # Hardcode the status!
-    delivery.delivery_status = 'delivered'
-    delivery.delivered_date = timezone.now()
+    with transaction.atomic():
+        was_pending = delivery.order.status in PENDING_ORDER_STATUSES
+
+        # Hardcode the status!
+        delivery.delivery_status = 'delivered'
+        delivery.delivered_date = timezone.now()
+
+        # Update parent order status too
+        delivery.order.status = 'delivered'
+        delivery.order.save()
+        delivery.save()
 
-    # Update parent order status too
-    delivery.order.status = 'delivered'
-    delivery.order.save()
-    delivery.save()
+        if was_pending:
+            record_order_delivered(delivery.order)
     
     customer_email = delivery.order.customer.user.email
     subject = f"Order {delivery.order.id}"
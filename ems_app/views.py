@@ -1,7 +1,9 @@
+import os
+
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from django.contrib.auth.hashers import make_password
-from .models import Product,Order, OrderItem, Payment, Delivery, Notification
+from .models import Product,Order, OrderItem, Payment, Delivery, Notification, StockReservation
 from .serializers import *
 from rest_framework.viewsets import ModelViewSet
 from django.contrib.auth import authenticate
@@ -9,15 +11,45 @@ from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework import status
 from .utils import create_notification
-from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.permissions import DjangoModelPermissions, IsAuthenticated
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from .supplier_stats import order_snapshot, product_order_lines, product_snapshot, record_order_change, record_order_paid, record_product_change, record_product_changes, record_product_deleted
+from .inventory import OutOfStock, convert_reservation, order_quantities, reserve_stock
+from .order_totals import apply_line_delta
+from .cart import CartClosed, cart_line_errors, cart_line_products, claim_cart, upsert_cart_lines
+from django.utils import timezone
+from .catalog_cache import CatalogCacheMixin, invalidate_catalog
+from .conditional import ConditionalGetMixin
+from .pagination import KeysetPagination
+from .notifications import mark_all_read as mark_notifications_read, unread_count as notification_unread_count
+from .fast_serializers import FastReadMixin
+from .image_variants import delete_variant_files, enqueue_image_variants
+from .product_import import IMPORT_FORMATS, ImportFileError, import_products
+from .search import ProductPagination, ProductSearchFilter
+from django_filters.rest_framework import DjangoFilterBackend
 
 
 # this is for supplier or admin to create a unique category under which products related to that will exists.
-class ProductCategoryViewSet(ModelViewSet):
+class ProductCategoryViewSet(CatalogCacheMixin, ConditionalGetMixin, ModelViewSet):
     queryset = ProductCategory.objects.all()
     serializer_class = ProductCategorySerializer
     search_fields = ['category_name']
     permission_classes = [DjangoModelPermissions]
+    catalog_cache_kind = 'categories'
+
+    # every category write drops the cached catalog, product payloads carry the category too
+    def perform_create(self, serializer):
+        serializer.save()
+        invalidate_catalog()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        invalidate_catalog()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_catalog()
 
 
     #overriding the create function so that if the user tries to create the similar category he gets an error with the existing category id so that it will be easier for him to find out the category 
@@ -42,11 +74,23 @@ class ProductCategoryViewSet(ModelViewSet):
     #     serializer.save()
             
     
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CatalogCacheMixin, ConditionalGetMixin, FastReadMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    fast_read = True
+    pagination_class = ProductPagination
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]  # ?search= goes through the fts index, search_fields is the fallback off sqlite
     search_fields = ['product_name','product_price','category__category_name']
     filterset_fields = ['product_name','category__category_name']
     permission_classes = [DjangoModelPermissions]    
+    catalog_cache_kind = 'products'
+
+    def catalog_cache_scope(self):
+        # suppliers only see their own products so their pages cant be shared with anyone else
+        user = self.request.user
+        if user.user_role == 'supplier':
+            return f'supplier:{user.supplier.id}'
+        return 'all'
+
     def get_queryset(self):
         user = self.request.user
         
@@ -60,13 +104,74 @@ class ProductViewSet(ModelViewSet):
         # if user.user_role != 'supplier':
         #     raise PermissionDenied('Only suppliers can create products')   # now have set groups and permission instead of this now the permission check is handled before calling this perform_Create function
         current_logged_supplier = user.supplier  # so that the product will be created with logged supplier only
-        serializer.save(supplier=current_logged_supplier)
+        try:
+            with transaction.atomic():
+                product = serializer.save(supplier=current_logged_supplier)
+                record_product_change(after=product_snapshot(product))
+                enqueue_image_variants([product])
+                invalidate_catalog()
+        except IntegrityError:
+            # the only unique constraint is the sku's, taken by a concurrent write after validate_sku looked
+            raise ValidationError({'sku': [SKU_TAKEN]})
+
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic():
+                before = product_snapshot(serializer.instance)
+                if 'product_image' in serializer.validated_data:
+                    # the variants of the old image go until the worker has made the new ones
+                    old_variants = serializer.instance.image_variants
+                    product = serializer.save(image_variants={})
+                    enqueue_image_variants([product])
+                    delete_variant_files(old_variants)
+                else:
+                    product = serializer.save()
+                record_product_change(before=before, after=product_snapshot(product))
+                invalidate_catalog()
+
+                # restocked, the next time it runs low the supplier should hear about it straight away
+                if product.low_stock_alerted_at and product.stock_quantity >= product.low_stock_threshold:
+                    Product.objects.filter(pk=product.pk).update(low_stock_alerted_at=None)
+        except IntegrityError:
+            raise ValidationError({'sku': [SKU_TAKEN]})
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            before = product_snapshot(instance)
+            order_lines = product_order_lines(instance)  # the delete cascades to its order lines, their sales go too
+            instance.delete()
+            record_product_deleted(before, order_lines)
+            delete_variant_files(instance.image_variants)
+            invalidate_catalog()
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        # multipart with the csv or json lines file as "file", the format from its extension unless "file_format" says it
+        user = request.user
+        if user.user_role != 'supplier' or not user.has_perm('ems_app.change_product'):
+            raise PermissionDenied('Only suppliers can import products.')
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        file_format = request.data.get('file_format') or IMPORT_FORMATS.get(os.path.splitext(upload.name)[1].lower())
+        if file_format not in IMPORT_FORMATS.values():
+            raise ValidationError({'file_format': ['Give a .csv or .jsonl file, or file_format "csv" or "jsonl".']})
+
+        # django has already spooled a big upload to a temporary file, it is read from there a chunk at a time
+        try:
+            report = import_products(user.supplier, upload, file_format)
+        except ImportFileError as exc:
+            return Response({**exc.report, 'file': [str(exc)]}, status=400)
+        return Response(report, status=200)
         
     # for retrive , update and delete get_object uses get_queryset where i have already filtered out suppliers products so even if other supplier tries to access others product then he fails to do so as the get_queryset returns only his products and API will respond with a 404 error   {"detail": "No Product matches the given query."}
         
    
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, FastReadMixin, ModelViewSet):
     serializer_class = OrderSerializer
+    fast_read = True
+    pagination_class = KeysetPagination
     permission_classes = [DjangoModelPermissions]   
     
     # customer gets to see their order only and admin gets to see all other users cant through groups and permission 
@@ -77,7 +182,7 @@ class OrderViewSet(ModelViewSet):
         # admin shoudlnt be able to see pending orders
         
         elif user.user_role == 'admin':
-            allowed_status = ['ordered', 'shipped', 'delivered', 'cancelled']
+            allowed_status = ['placed', 'ordered', 'shipped', 'delivered', 'cancelled']
             return Order.objects.filter(status__in=allowed_status)
         
         return Order.objects.none()
@@ -87,30 +192,57 @@ class OrderViewSet(ModelViewSet):
         # if user.user_role != 'customer':
         #     raise PermissionDenied('Only customers can create orders.')
         serializer.save(customer=user.customer,status='cart',payment_status='pending',total_amount=0  )
+
+    def get_serializer_class(self):
+        if self.request.user.user_role == 'admin' and self.action in ('update', 'partial_update'):
+            return AdminOrderSerializer
+        return super().get_serializer_class()
+
+    def perform_update(self, serializer):
+        # an admin cancelling or delivering an order moves the supplier stats in the same transaction
+        with transaction.atomic():
+            before = order_snapshot(serializer.instance)
+            order = serializer.save()
+            record_order_change(order, before, order_snapshot(order))
     
     @action(detail=True, methods=['post'])
     def checkout(self, request, pk=None):
         order = self.get_object()
         user = request.user
 
-        if user.user_role != 'customer' or order.customer != user.customer:
+        # compared by id, order.customer would be one more query for a row we already have as user.customer
+        if user.user_role != 'customer' or order.customer_id != user.customer.id:
             raise PermissionDenied('You can only checkout your own order!!')
-        if order.status != 'cart':
+        if order.status not in ('cart', 'checkout_pending'):
             return Response({'error': 'Only cart orders can be checked out.'}, status=400)
         if order.total_amount <= 0:
             raise ValidationError('Cannot checkout an empty cart.')
 
-        # Check stock but do NOT reduce stock yet
-        for item in order.items.all():
-            if item.product.stock_quantity < item.quantity:
-                raise ValidationError( f"Not enough stock for product '{item.product.name}'. "f"Available: {item.product.stock_quantity}, requested: {item.quantity}")
-
+        # the stock is held for the payment, not reduced yet: the reservation expires if the payment doesnt come
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                # conditional so two checkouts of the same cart cant both reserve. A checkout whose reservation expired
+                # (or was swept) without a payment holds nothing anymore, it can be checked out again
+                live = StockReservation.objects.filter(order=OuterRef('pk'), expires_at__gt=now)
+                claimable = Q(status='cart') | Q(status='checkout_pending') & ~Exists(live)
+                claimed = Order.objects.filter(claimable, pk=order.pk).update(status='checkout_pending', updated_at=now)
+                if not claimed:
+                    return Response({'error': 'Only cart orders can be checked out.'}, status=400)
+                if order.status == 'checkout_pending':
+                    StockReservation.objects.filter(order=order).delete()  # the expired ones, reserved again below
+                quantities = order_quantities(order)
+                reserved_until = reserve_stock(order, quantities)
+        except OutOfStock as exc:
+            product = exc.short_products()[0]
+            raise ValidationError( f"Not enough stock for product '{product.product_name}'. "f"Available: {max(product.available_stock, 0)}, requested: {quantities[product.id]}")
+        # what the UPDATE wrote, the payload is serialized from this instance
         order.status = 'checkout_pending'  # Waiting for payment
-        order.save()
+        order.updated_at = now
 
         # Return order like a bill
         serializer = self.get_serializer(order)
-        return Response({'message': 'Order ready for payment.','order': serializer.data}, status=200)
+        return Response({'message': 'Order ready for payment.','order': serializer.data, 'reserved_until': reserved_until}, status=200)
 
     
 class OrderItemViewSet(ModelViewSet):
@@ -131,7 +263,7 @@ class OrderItemViewSet(ModelViewSet):
         product = serializer.validated_data['product']
         quantity = serializer.validated_data['quantity']
 
-        if user.user_role != 'customer' or order.customer != user.customer:
+        if user.user_role != 'customer' or order.customer_id != user.customer.id:
             raise PermissionDenied('You can only add items to your own cart.')
 
         # Check stock before adding
@@ -141,52 +273,92 @@ class OrderItemViewSet(ModelViewSet):
                 f"Available product at the moment: {product.stock_quantity}, you requested for: {quantity}."
             )
 
-        serializer.save(price=product.product_price)
-        self.update_order_total(order)
+        # the new line and the order total go in together, the total just moves by this line instead of being re-summed
+        with transaction.atomic():
+            self.claim_carts(order.id)
+            item = serializer.save(price=product.product_price)
+            apply_line_delta(order.id, item.line_total)
+
+    def claim_carts(self, *order_ids):
+        # in the transaction that writes the line, a checkout in between would otherwise get a line it never reserved
+        try:
+            for order_id in sorted(set(order_ids)):
+                claim_cart(order_id)
+        except CartClosed:
+            raise ValidationError({'order': ['Only cart orders can be changed.']})
 
     def perform_update(self, serializer):
         # here aba if product nei change garo vane tyo aaune vo product ma else itll be none with same product
         product = serializer.validated_data.get('product', None)
         instance = serializer.instance
-
-        if product:
-            # if new product chaneko cha vane you need to update the price
-            serializer.save(price=product.price)
-        else:
-            serializer.save()
-
-        self.update_order_total(instance.order)
-
+        old_order_id, old_line_total = instance.order_id, instance.line_total
+
+        with transaction.atomic():
+            new_order = serializer.validated_data.get('order')
+            self.claim_carts(old_order_id, new_order.id if new_order else old_order_id)
+            if product:
+                # if new product chaneko cha vane you need to update the price
+                item = serializer.save(price=product.product_price)
+            else:
+                item = serializer.save()
+
+            if item.order_id == old_order_id:
+                apply_line_delta(item.order_id, item.line_total - old_line_total)
+            else:
+                apply_line_delta(old_order_id, -old_line_total)
+                apply_line_delta(item.order_id, item.line_total)
+
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # the whole cart in one request: {"order": id, "lines": [{"product": id, "quantity": n}, ...]}
+        if request.user.user_role != 'customer':
+            raise PermissionDenied('You can only add items to your own cart.')
+        serializer = BulkCartLinesSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.validated_data['order']
+        lines = serializer.validated_data['lines']
+
+        # every line is checked before anything is written, the response says which lines are wrong and why
+        products = cart_line_products(lines)
+        errors = cart_line_errors(lines, products)
+        if any(errors):
+            return Response({'lines': errors}, status=400)
+
+        # whether it is still a cart is checked in the transaction that writes the lines
+        try:
+            items = upsert_cart_lines(order, lines, products)
+        except CartClosed:
+            return Response({'error': 'Only cart orders can be changed.'}, status=400)
+        order.refresh_from_db(fields=['total_amount'])
+        return Response({
+            'message': 'Cart updated.',
+            'order': OrderSerializer(order).data,
+            'items': OrderItemSerializer(items, many=True).data,
+        }, status=200)
 
     def perform_destroy(self, instance):
-        order = instance.order
-        if order.status != 'cart':
-            raise PermissionDenied('You can only remove items from your cart before checkout.')
-        instance.delete()
-        self.update_order_total(order)
-
-    def update_order_total(self, order):
-        total = 0 
-
-        # Loop through each item in the order
-        for item in order.items.all():
-            item_total = item.price * item.quantity  # Calculate total for this item
-            total += item_total  # Add it to the overall total
-
-        # Update the order's total_amount
-        order.total_amount = total
-
-        order.save()
+        with transaction.atomic():
+            try:
+                claim_cart(instance.order_id)
+            except CartClosed:
+                raise PermissionDenied('You can only remove items from your cart before checkout.')
+            instance.delete()
+            apply_line_delta(instance.order_id, -instance.line_total)
     
 from .utils import send_notification_email
-class PaymentViewSet(ModelViewSet):
+class PaymentViewSet(FastReadMixin, ModelViewSet):
     serializer_class = PaymentSerializer
+    fast_read = True
+    pagination_class = KeysetPagination
     permission_classes = [DjangoModelPermissions]
     def get_queryset(self):
         user = self.request.user
         if user.user_role == 'customer':
             return Payment.objects.filter(customer=user.customer)
-        return Payment.objects.all()
+        elif user.user_role == 'admin':
+            return Payment.objects.all()
+        return Payment.objects.none()
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -195,7 +367,7 @@ class PaymentViewSet(ModelViewSet):
         order = serializer.validated_data['order']
         user = request.user
 
-        if order.customer != user.customer:
+        if order.customer_id != user.customer.id:
             return Response({'detail': 'You can only pay for your own orders.'}, status=status.HTTP_403_FORBIDDEN)
 
         if order.status != 'checkout_pending':
@@ -204,47 +376,55 @@ class PaymentViewSet(ModelViewSet):
         if order.total_amount <= 0:
             return Response({'detail': 'Cannot create payment for order with zero total.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        payment = serializer.save(
-            customer=user.customer,
-            amount=order.total_amount,
-            status='completed'  # Assume success for simplicity
-        )
-
-        if payment.status == 'completed':
-            order.payment_status = 'paid'
-            order.status = 'placed'
-
-            for item in order.items.all():
-                product = item.product
-                if product.stock_quantity < item.quantity:
-                    return Response(
-                        {'detail': f"Not enough stock for product '{product.product_name}' at payment time."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                product.stock_quantity -= item.quantity
-                product.save()
-
-            order.save()
-            
-
-            Delivery.objects.create(
-                order=order,
-                delivery_personnel=None,
-                delivery_status='pending',
-                delivered_date=None,
-                delivery_address=order.customer.address
-            )
-            subject = f"Order #{order.id} Confirmation"
-            body = (
-                f"Dear {user.full_name},\n\n"
-                f"Your order #{order.id} has been placed successfully.\n"
-                f"We will notify you when it is shipped.\n\n"
-                f"Order Total: ${order.total_amount}\n\n"
-                f"Thank you for shopping with us!"
+        # one transaction for the whole payment: if any line runs out of stock the payment, the order change and every decrement roll back
+        try:
+            with transaction.atomic():
+                # conditional so two concurrent payments for the same order cant both go through
+                claimed = Order.objects.filter(pk=order.pk, status='checkout_pending').update(
+                    status='placed', payment_status='paid', updated_at=timezone.now()
+                )
+                if not claimed:
+                    return Response({'detail': 'Payment can only be done for orders in checkout pending status.'}, status=status.HTTP_400_BAD_REQUEST)
+                order.status = 'placed'
+                order.payment_status = 'paid'
+
+                # the checkout's reservation becomes the decrement, all lines in one conditional UPDATE, before the
+                # payment row so a short line fails first
+                record_product_changes(convert_reservation(order))
+                invalidate_catalog()  # stock_quantity is part of the cached product payloads
+
+                payment = serializer.save(
+                    customer=user.customer,
+                    amount=order.total_amount,
+                    status='completed'  # Assume success for simplicity
+                )
+                record_order_paid(order)
+
+                Delivery.objects.create(
+                    order=order,
+                    delivery_personnel=None,
+                    delivery_status='pending',
+                    delivered_date=None,
+                    delivery_address=user.customer.address  # same customer as order.customer, checked above
+                )
+                subject = f"Order #{order.id} Confirmation"
+                body = (
+                    f"Dear {user.full_name},\n\n"
+                    f"Your order #{order.id} has been placed successfully.\n"
+                    f"We will notify you when it is shipped.\n\n"
+                    f"Order Total: ${order.total_amount}\n\n"
+                    f"Thank you for shopping with us!"
+                )
+
+                send_notification_email(subject, body, [user.email])
+        except OutOfStock as exc:
+            short = exc.short_products()
+            product_name = short[0].product_name if short else 'unknown'
+            return Response(
+                {'detail': f"Not enough stock for product '{product_name}' at payment time."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            send_notification_email(subject, body, [user.email])
-        
         return Response(
             {'detail': 'Payment successful and order placed.', 'payment': serializer.data},
             status=status.HTTP_201_CREATED,
@@ -252,24 +432,44 @@ class PaymentViewSet(ModelViewSet):
 
 
     def perform_update(self, serializer):
-        payment = serializer.save()
-        order = payment.order
-
-        if payment.status == 'completed':
-            order.payment_status = 'paid'
-            order.save()
-        elif payment.status == 'failed':
-            order.payment_status = 'failed'
-            order.save()
+        with transaction.atomic():
+            payment = serializer.save()
+            order = payment.order
+            before = order_snapshot(order)
+
+            if payment.status == 'completed':
+                order.payment_status = 'paid'
+                order.save()
+            elif payment.status == 'failed':
+                order.payment_status = 'failed'
+                order.save()
+            record_order_change(order, before, order_snapshot(order))
     
     
 
     
-class NotificationViewSet(ModelViewSet):
+class NotificationViewSet(ConditionalGetMixin, FastReadMixin, ModelViewSet):
     serializer_class = NotificationSerializer
+    fast_read = True
+    pagination_class = KeysetPagination
     permission_classes = [DjangoModelPermissions]
+    filterset_fields = ['is_read']
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')  
+        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+
+    def get_permissions(self):
+        if self.action in ('mark_all_read', 'unread_count'):
+            return [IsAuthenticated()]  # only ever the user's own notifications
+        return super().get_permissions()
+
+    @action(detail=False, methods=['post'], url_path='mark-all-read')
+    def mark_all_read(self, request):
+        return Response({'marked_read': mark_notifications_read(request.user)})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        # the badge poll, one row of the counter table however many notifications the user has
+        return Response({'unread': notification_unread_count(request.user)})  
     
     
\ No newline at end of file